@@ -1,3 +1,10 @@
-from .main import create_app, app
+def __getattr__(name):
+    # Import the Flask app lazily so that background pool workers can import
+    # app.thumbnails without building an application.
+    if name in ("create_app", "app"):
+        from . import main
+        return getattr(main, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 __all__ = ["create_app", "app"]
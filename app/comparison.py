@@ -0,0 +1,159 @@
+"""Comparison sessions: ranking by asking as few pairwise questions as possible.
+
+A session sorts by binary insertion. Items are placed one at a time into a
+sorted list (best first), and each is positioned by binary search against
+the items already placed. Placing an item among ``k`` costs at most
+``ceil(log2(k + 1))`` answers. Ordering ``n`` items from scratch therefore
+takes about ``n log2 n - 1.4 n`` answers, close to the information-theoretic
+minimum, instead of the ``n (n - 1) / 2`` pairs of an all-pairs tournament:
+about 3,800 rather than 124,750 for 500 items. New items inserted into an
+existing ranking cost about ``log2 n`` answers each.
+
+A tie ends the search and places the item right after the one it tied with.
+Finishing a session early keeps what has been placed so far, so the work of
+a partial session is never lost.
+
+The state of a session is a plain JSON-serialisable dict, so it can be
+stored and resumed from any device:
+
+``sorted``
+    names placed so far, best first
+``pending``
+    names still to place, in the order they will be placed
+``low``, ``high``
+    the slice of ``sorted`` the first pending item still has to be placed in
+``step``
+    bumped whenever the question changes, used to reject a stale answer
+``asked``, ``ties``
+    how many answers have been applied, and how many of those were ties
+"""
+from __future__ import annotations
+
+import math
+from typing import Dict, Iterable, List, Optional, Tuple
+
+SCOPES = ("all", "unranked")
+ANSWERS = ("left", "right", "tie")
+
+
+def new_session(ranked: List[str], pending: List[str]) -> Dict:
+    """A session placing ``pending`` into the order ``ranked`` (best first)."""
+    state = {
+        "sorted": list(ranked),
+        "pending": list(pending),
+        "low": 0,
+        "high": len(ranked),
+        "step": 0,
+        "asked": 0,
+        "ties": 0,
+    }
+    _place_settled(state)
+    return state
+
+
+def _place_settled(state: Dict) -> None:
+    """Insert pending items whose place needs no further answers."""
+    while state["pending"] and state["low"] >= state["high"]:
+        state["sorted"].insert(state["low"], state["pending"].pop(0))
+        state["low"], state["high"] = 0, len(state["sorted"])
+
+
+def question(state: Dict) -> Optional[Tuple[str, str]]:
+    """The next pair to ask about, ``(candidate, placed item)``; None once done."""
+    if not state["pending"]:
+        return None
+    return state["pending"][0], state["sorted"][(state["low"] + state["high"]) // 2]
+
+
+def answer(state: Dict, winner: str) -> None:
+    """Apply an answer to the current question.
+
+    ``left`` prefers the candidate and ``right`` the placed item, matching
+    the order ``question`` returns them in.
+    """
+    if winner not in ANSWERS:
+        raise ValueError(f"Answer must be one of {', '.join(ANSWERS)}")
+    if not state["pending"]:
+        raise LookupError("The session has no more questions")
+    middle = (state["low"] + state["high"]) // 2
+    if winner == "left":
+        state["high"] = middle
+    elif winner == "right":
+        state["low"] = middle + 1
+    else:
+        state["low"] = state["high"] = middle + 1
+        state["ties"] += 1
+    state["step"] += 1
+    state["asked"] += 1
+    _place_settled(state)
+
+
+def drop(state: Dict, names: Iterable[str]) -> None:
+    """Forget files that were deleted or moved away during the session.
+
+    The search for the current candidate starts over if the placed items
+    changed under it.
+    """
+    names = set(names)
+    current = question(state)
+    placed = [name for name in state["sorted"] if name not in names]
+    pending = [name for name in state["pending"] if name not in names]
+    if len(placed) != len(state["sorted"]) or pending[:1] != state["pending"][:1]:
+        state["low"], state["high"] = 0, len(placed)
+    state["sorted"], state["pending"] = placed, pending
+    _place_settled(state)
+    if question(state) != current:
+        state["step"] += 1
+
+
+def rename(state: Dict, old: str, new: str) -> None:
+    """Follow a file renamed on disk during the session."""
+    drop(state, [new])
+    state["sorted"] = [new if name == old else name for name in state["sorted"]]
+    state["pending"] = [new if name == old else name for name in state["pending"]]
+
+
+def remaining_estimate(state: Dict) -> int:
+    """Upper bound on the answers still needed to finish the session."""
+    if not state["pending"]:
+        return 0
+    remaining = math.ceil(math.log2(state["high"] - state["low"] + 1))
+    placed = len(state["sorted"])
+    for offset in range(1, len(state["pending"])):
+        remaining += math.ceil(math.log2(placed + offset + 1))
+    return remaining
+
+
+def final_order(state: Dict, include_pending: bool) -> List[str]:
+    """The order the session has produced so far, best first.
+
+    Items not placed yet follow in their original order when
+    ``include_pending`` is set, and are left out otherwise.
+    """
+    order = list(state["sorted"])
+    if include_pending:
+        order += state["pending"]
+    return order
+
+
+def merge(ranking: List[str], order: List[str]) -> List[str]:
+    """Apply a session's ``order`` to the full ``ranking``.
+
+    Files in ``order`` take its order. Ranked files outside it, such as
+    videos when only photos were compared, stay right after the file they
+    followed before.
+    """
+    members = set(order)
+    head: List[str] = []
+    followers: Dict[str, List[str]] = {}
+    target = head
+    for name in ranking:
+        if name in members:
+            target = followers.setdefault(name, [])
+        else:
+            target.append(name)
+    merged = head
+    for name in order:
+        merged.append(name)
+        merged += followers.get(name, [])
+    return merged
@@ -0,0 +1,175 @@
+"""The change feed: a log of what each mutating request changed.
+
+Every event gets the next number in one sequence shared by all projects,
+so a client that remembers the last number it saw can ask for everything
+after it and apply the changes as small deltas, whether it was offline for
+a second or reconnecting after a network switch.
+
+Events live in SQLite next to the media index, so an event published by
+one gunicorn worker is seen by clients connected to any other. Only the
+most recent events are kept; a client asking for older ones is told to
+reload instead.
+
+Requests waiting for new events do not query the log themselves: one
+thread per worker checks it for all of them and wakes them when it grows.
+"""
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+# Events kept for clients catching up; older ones are pruned
+RETAINED_EVENTS = 10000
+# Prune once every this many events rather than on every insert
+PRUNE_INTERVAL = 100
+# Seconds between checks for events published by other workers
+POLL_INTERVAL = 0.5
+
+_MIGRATIONS = [
+    """
+    CREATE TABLE events (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        project TEXT,
+        type TEXT NOT NULL,
+        data TEXT NOT NULL,
+        created REAL NOT NULL
+    );
+    CREATE INDEX events_project ON events (project, seq);
+    """,
+]
+
+
+class EventLog:
+    """A numbered log of change events, shared by every worker."""
+
+    def __init__(self, db_path: Path) -> None:
+        self.db_path = db_path
+        self._local = threading.local()
+        # The newest sequence number seen by the poller, and who waits for more
+        self._changed = threading.Condition()
+        self._seen: Optional[int] = None
+        self._waiters = 0
+        self._poller: Optional[threading.Thread] = None
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for target, script in enumerate(_MIGRATIONS[version:], start=version + 1):
+                conn.executescript(f"BEGIN; {script}; PRAGMA user_version = {target}; COMMIT;")
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread, reopened after a fork (gunicorn workers).
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(str(self.db_path), timeout=30)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = self._connection()
+        with conn:
+            yield conn
+
+    def publish(self, project: Optional[str], event_type: str, data: Dict) -> int:
+        """Append an event and return its sequence number."""
+        with self._connect() as conn:
+            seq = conn.execute(
+                "INSERT INTO events (project, type, data, created) VALUES (?, ?, ?, ?)",
+                (project, event_type, json.dumps(data), time.time()),
+            ).lastrowid
+            if seq % PRUNE_INTERVAL == 0:
+                conn.execute("DELETE FROM events WHERE seq <= ?", (seq - RETAINED_EVENTS,))
+        # Requests of this worker need not wait for the next poll
+        with self._changed:
+            if self._seen is not None and seq > self._seen:
+                self._seen = seq
+                self._changed.notify_all()
+        return seq
+
+    def wait(self, seq: int, timeout: float) -> int:
+        """Block until an event newer than ``seq`` is published or ``timeout`` passes.
+
+        Returns the newest sequence number seen, which is ``seq`` or less
+        after a timeout. Pass it back in to wait for the next event, as
+        events of other projects wake every waiter.
+        """
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            self._waiters += 1
+            try:
+                if self._poller is None or not self._poller.is_alive():
+                    self._poller = threading.Thread(target=self._poll, name="event-poller", daemon=True)
+                    self._poller.start()
+                while self._seen is None or self._seen <= seq:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._changed.wait(remaining)
+                return self._seen if self._seen is not None else seq
+            finally:
+                self._waiters -= 1
+
+    def _poll(self) -> None:
+        """Check the log for new events while any request waits for them."""
+        while True:
+            with self._changed:
+                if not self._waiters:
+                    # Stale once nobody polls; the next poller reads it afresh
+                    self._seen = None
+                    self._poller = None
+                    return
+            latest = self.latest()
+            with self._changed:
+                if latest != self._seen:
+                    self._seen = latest
+                    self._changed.notify_all()
+            time.sleep(POLL_INTERVAL)
+
+    def latest(self) -> int:
+        """The sequence number of the newest event ever published, 0 before the first."""
+        row = self._connection().execute(
+            "SELECT seq FROM sqlite_sequence WHERE name = 'events'"
+        ).fetchone()
+        return row[0] if row else 0
+
+    def missed(self, since: int) -> bool:
+        """Whether events after ``since`` can no longer be replayed.
+
+        That is when some were pruned, or when ``since`` is ahead of the log
+        because the index directory was deleted and the numbering restarted.
+        """
+        conn = self._connection()
+        latest = self.latest()
+        if since > latest:
+            return True
+        oldest = conn.execute("SELECT MIN(seq) FROM events").fetchone()[0]
+        return since < (oldest if oldest is not None else latest + 1) - 1
+
+    def since(self, seq: int, project: Optional[str] = None, limit: int = 500) -> List[Dict]:
+        """Events after ``seq``, oldest first, optionally only those of one project."""
+        sql = "SELECT * FROM events WHERE seq > ?"
+        params: list = [seq]
+        if project is not None:
+            sql += " AND project = ?"
+            params.append(project)
+        sql += " ORDER BY seq LIMIT ?"
+        params.append(limit)
+        return [
+            {
+                "seq": row["seq"],
+                "type": row["type"],
+                "project": row["project"],
+                "data": json.loads(row["data"]),
+                "created": row["created"],
+            }
+            for row in self._connection().execute(sql, params)
+        ]
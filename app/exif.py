@@ -0,0 +1,130 @@
+"""EXIF extraction.
+
+EXIF is read once per file, when its thumbnails are made or when the media
+index first sees it, and kept in the index. ``read_exif`` works on an image
+that is already open so thumbnail generation gets it without reopening the
+file. ``exif_files`` reads a batch and runs on the background process pool.
+"""
+from __future__ import annotations
+
+import os
+from datetime import datetime, timedelta, timezone
+from numbers import Rational
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Pillow for EXIF
+try:
+    from PIL import ExifTags, Image
+    PILLOW_AVAILABLE = True
+except ImportError:
+    PILLOW_AVAILABLE = False
+
+# Only these tags are kept
+EXIF_TAGS = (
+    "Make", "Model", "DateTime", "DateTimeOriginal", "OffsetTimeOriginal",
+    "ExposureTime", "FNumber", "ISOSpeedRatings", "ISO",
+    "FocalLength", "LensModel", "LensMake",
+    "ExposureProgram", "WhiteBalance", "Flash",
+    "ImageWidth", "ImageHeight", "Orientation",
+)
+# Formats that don't typically have EXIF
+NO_EXIF_EXTENSIONS = {".gif", ".bmp", ".webp", ".heic"}
+# The Exif sub-IFD holds the capture settings and DateTimeOriginal
+EXIF_IFD_POINTER = 0x8769
+EXIF_DATE_FORMAT = "%Y:%m:%d %H:%M:%S"
+
+
+def can_read_exif(file_path: Path) -> bool:
+    return PILLOW_AVAILABLE and file_path.suffix.lower() not in NO_EXIF_EXTENSIONS
+
+
+def _plain_value(value):
+    """A JSON-friendly form of an EXIF value, or None to drop it."""
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", errors="ignore")
+    if isinstance(value, str):
+        return value.strip("\x00 ") or None
+    if isinstance(value, tuple) and len(value) == 2 and all(isinstance(v, int) for v in value):
+        # Rationals from older Pillow versions
+        return round(value[0] / value[1], 6) if value[1] else None
+    if isinstance(value, Rational) and not isinstance(value, int):
+        # Pillow's IFDRational; 0/0 is how cameras write "unknown"
+        return round(float(value), 6) if value.denominator else None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, tuple):
+        values = [_plain_value(v) for v in value]
+        return values if None not in values else None
+    return None
+
+
+def read_exif(img) -> Dict:
+    """The useful EXIF tags of an open image."""
+    try:
+        exif = img.getexif()
+        tags = dict(exif)
+        tags.update(exif.get_ifd(EXIF_IFD_POINTER))
+    except Exception:
+        return {}
+    result = {}
+    for tag_id, value in tags.items():
+        tag = ExifTags.TAGS.get(tag_id)
+        if tag in EXIF_TAGS:
+            value = _plain_value(value)
+            if value is not None:
+                result[tag] = value
+    return result
+
+
+def extract_exif(file_path: Path) -> Dict:
+    """The useful EXIF tags of an image file; empty when it has none or can't be read."""
+    if not can_read_exif(file_path):
+        return {}
+    try:
+        with Image.open(file_path) as img:
+            return read_exif(img)
+    except Exception as e:
+        print(f"Failed to extract EXIF from {file_path}: {e}")
+        return {}
+
+
+def capture_time(exif: Dict) -> Optional[float]:
+    """When the photo was taken, as a Unix timestamp, from ``DateTimeOriginal``.
+
+    The EXIF time has no zone of its own. ``OffsetTimeOriginal`` supplies one
+    when the camera wrote it; otherwise the server's local zone is assumed,
+    the same zone file mtimes are shown in.
+    """
+    value = exif.get("DateTimeOriginal")
+    if not isinstance(value, str):
+        return None
+    try:
+        taken = datetime.strptime(value[:19], EXIF_DATE_FORMAT)
+    except ValueError:
+        return None
+    offset = exif.get("OffsetTimeOriginal")
+    if isinstance(offset, str) and len(offset) == 6 and offset[0] in "+-":
+        try:
+            delta = timedelta(hours=int(offset[1:3]), minutes=int(offset[4:6]))
+        except ValueError:
+            delta = None
+        if delta is not None:
+            taken = taken.replace(tzinfo=timezone(delta if offset[0] == "+" else -delta))
+    try:
+        return taken.timestamp()
+    except (OverflowError, OSError, ValueError):
+        return None
+
+
+def exif_files(paths: List[Path]) -> List[Optional[Tuple[int, float, Dict]]]:
+    """EXIF of a batch of files as ``(size, mtime, exif)``, or None for files that are gone."""
+    results = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            results.append(None)
+            continue
+        results.append((stat.st_size, stat.st_mtime, extract_exif(path)))
+    return results
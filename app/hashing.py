@@ -0,0 +1,64 @@
+"""Content hashing for uploads and the library-wide duplicate index.
+
+``digest_files`` runs inside worker processes of the background pool, so it
+lives at module level and only depends on the standard library.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+# The library index uses SHA-256. OpenSSL runs it on the CPU's SHA extensions
+# (x86 SHA-NI, ARMv8 crypto), which outpaces both MD5 and BLAKE2b there.
+DIGEST_ALGORITHM = "sha256"
+# Per-project duplicate checks (the "hash" in the media metadata) predate the
+# library index and stay MD5 so that stored values remain comparable.
+LEGACY_HASH_ALGORITHM = "md5"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def new_digest():
+    return hashlib.new(DIGEST_ALGORITHM)
+
+
+class ContentHasher:
+    """Computes the legacy MD5 hash and the library digest in a single pass."""
+
+    def __init__(self) -> None:
+        self._legacy = hashlib.new(LEGACY_HASH_ALGORITHM)
+        self._digest = new_digest()
+
+    def update(self, data) -> None:
+        self._legacy.update(data)
+        self._digest.update(data)
+
+    def hexdigests(self) -> Tuple[str, str]:
+        """Return ``(md5, digest)`` as hex strings."""
+        return self._legacy.hexdigest(), self._digest.hexdigest()
+
+
+def digest_files(paths: List[Path]) -> List[Optional[Tuple[int, float, str]]]:
+    """Library digests of a batch of files.
+
+    Each result is ``(size, mtime, digest)`` as of when the file was read, or
+    None if the file is gone or changed while it was being hashed.
+    """
+    results = []
+    for path in paths:
+        try:
+            before = os.stat(path)
+            digest = new_digest()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+            after = os.stat(path)
+        except OSError:
+            results.append(None)
+            continue
+        if (before.st_size, before.st_mtime_ns) != (after.st_size, after.st_mtime_ns):
+            results.append(None)
+        else:
+            results.append((before.st_size, before.st_mtime, digest.hexdigest()))
+    return results
@@ -0,0 +1,547 @@
+"""Background work: a process pool for CPU-bound tasks, a thread pool for I/O-bound
+ones, and persisted jobs.
+
+Job rows live in SQLite so that any gunicorn worker can answer a progress
+poll, whichever worker is actually running the job.
+
+Long operations that must not run inside a request (building a project
+archive, deleting or moving many files) are submitted to a ``JobRunner``
+with their parameters. Every worker process runs one, and its threads
+claim queued jobs from the shared table. While a job runs, its process
+refreshes a heartbeat; a job whose heartbeat stops, because its worker
+was restarted or killed, is queued again and picked up by another worker.
+Handlers are therefore written to be run again: they skip work that is
+already done, and can checkpoint partial results with ``Job.save``.
+"""
+from __future__ import annotations
+
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+ACTIVE_STATUSES = ("queued", "running")
+# Jobs a user is waiting on, taken before queued background work
+INTERACTIVE_KINDS = ("archive", "delete", "move")
+# Runner threads per worker process; the first only takes interactive jobs,
+# so a long backfill never keeps a user's delete waiting
+RUNNER_THREADS = 2
+# How often a runner with nothing to do looks for queued jobs, and how often
+# running jobs refresh their heartbeat and pick up cancellation requests
+POLL_INTERVAL = 2.0
+HEARTBEAT_INTERVAL = 2.0
+# A running job whose heartbeat is older than this lost its worker
+STALE_SECONDS = 30
+# Runs a job gets before it is given up on
+MAX_ATTEMPTS = 3
+# Finished jobs are kept this long
+KEEP_FINISHED_SECONDS = 7 * 24 * 60 * 60
+PRUNE_INTERVAL = 60 * 60
+
+_MIGRATIONS = [
+    """
+    CREATE TABLE jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        project TEXT,
+        status TEXT NOT NULL,
+        total INTEGER NOT NULL DEFAULT 0,
+        done INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        created REAL NOT NULL,
+        updated REAL NOT NULL
+    );
+    CREATE INDEX jobs_project ON jobs (project, created);
+    """,
+    # Jobs run by a JobRunner carry their parameters and outcome
+    """
+    ALTER TABLE jobs ADD COLUMN params TEXT;
+    ALTER TABLE jobs ADD COLUMN result TEXT;
+    ALTER TABLE jobs ADD COLUMN error TEXT;
+    ALTER TABLE jobs ADD COLUMN owner TEXT;
+    ALTER TABLE jobs ADD COLUMN heartbeat REAL;
+    ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0;
+    CREATE INDEX jobs_status ON jobs (status, created);
+    """,
+    # Jobs without parameters were driven by callbacks in the process that
+    # created them, and were left running when it stopped
+    """
+    UPDATE jobs SET status = 'failed', error = 'The job was interrupted by a restart'
+    WHERE params IS NULL AND status IN ('queued', 'running');
+    """,
+]
+
+
+class JobCancelled(Exception):
+    """Raised inside a handler whose job was cancelled."""
+
+
+class JobError(Exception):
+    """A handler failure whose message is shown to the client."""
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+
+class JobStore:
+    """Progress records for background jobs."""
+
+    def __init__(self, db_path: Path) -> None:
+        self.db_path = db_path
+        self._local = threading.local()
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for target, script in enumerate(_MIGRATIONS[version:], start=version + 1):
+                conn.executescript(f"BEGIN; {script}; PRAGMA user_version = {target}; COMMIT;")
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread, reopened after a fork (gunicorn workers).
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(str(self.db_path), timeout=30)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = self._connection()
+        with conn:
+            yield conn
+
+    def advance(self, job_id: str, done: int = 0, failed: int = 0) -> None:
+        """Record finished items; the job completes when its handler returns."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET done = done + ?, failed = failed + ?, updated = ? WHERE id = ?",
+                (done, failed, time.time(), job_id),
+            )
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row["id"],
+            "kind": row["kind"],
+            "project": row["project"],
+            "status": row["status"],
+            "total": row["total"],
+            "done": row["done"],
+            "failed": row["failed"],
+            "created": row["created"],
+            "updated": row["updated"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "cancellable": row["params"] is not None and row["status"] in ACTIVE_STATUSES,
+            "cancelRequested": bool(row["cancel_requested"]),
+        }
+
+    # ============ Jobs run by a JobRunner ============
+
+    def submit(self, kind: str, project: Optional[str], params: Dict) -> str:
+        """Queue a job for a runner; returns its id."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, project, status, created, updated, params) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, kind, project, now, now, _dumps(params)),
+            )
+        return job_id
+
+    def find_active(self, kind: str, project: Optional[str], params: Dict) -> Optional[str]:
+        """The id of a queued or running job with these parameters, so it isn't submitted twice."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status IN ('queued', 'running') AND kind = ? "
+                "AND project IS ? AND params = ? ORDER BY created LIMIT 1",
+                (kind, project, _dumps(params)),
+            ).fetchone()
+        return row["id"] if row else None
+
+    def active_params(self, kind: str, project: Optional[str]) -> List[Dict]:
+        """The parameters of the queued and running jobs of ``kind`` for ``project``."""
+        with self._connect() as conn:
+            return [
+                json.loads(row["params"])
+                for row in conn.execute(
+                    "SELECT params FROM jobs WHERE status IN ('queued', 'running') AND kind = ? "
+                    "AND project IS ? AND params IS NOT NULL",
+                    (kind, project),
+                )
+            ]
+
+    def claim(self, owner: str, kinds: Iterable[str]) -> Optional[Dict]:
+        """Take the oldest queued job of one of ``kinds`` for ``owner``.
+
+        Interactive jobs go first, however much background work is queued.
+        """
+        kinds = list(kinds)
+        placeholders = ",".join("?" * len(kinds))
+        interactive = ",".join("?" * len(INTERACTIVE_KINDS))
+        with self._connect() as conn:
+            candidates = conn.execute(
+                f"SELECT id FROM jobs WHERE status = 'queued' AND params IS NOT NULL "
+                f"AND kind IN ({placeholders}) ORDER BY kind IN ({interactive}) DESC, created LIMIT 10",
+                [*kinds, *INTERACTIVE_KINDS],
+            ).fetchall()
+        for candidate in candidates:
+            now = time.time()
+            with self._connect() as conn:
+                # Another process may have taken it since the SELECT
+                claimed = conn.execute(
+                    "UPDATE jobs SET status = 'running', owner = ?, heartbeat = ?, "
+                    "attempts = attempts + 1, updated = ? WHERE id = ? AND status = 'queued'",
+                    (owner, now, now, candidate["id"]),
+                ).rowcount
+                if claimed:
+                    row = conn.execute("SELECT * FROM jobs WHERE id = ?", (candidate["id"],)).fetchone()
+                    return {
+                        "id": row["id"],
+                        "kind": row["kind"],
+                        "project": row["project"],
+                        "params": json.loads(row["params"]),
+                        "result": json.loads(row["result"]) if row["result"] else None,
+                        "attempts": row["attempts"],
+                    }
+        return None
+
+    def set_progress(self, job_id: str, total: int, done: int = 0, failed: int = 0) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET total = ?, done = ?, failed = ?, updated = ? WHERE id = ?",
+                (total, done, failed, time.time(), job_id),
+            )
+
+    def save(self, job_id: str, result: Dict) -> None:
+        """Checkpoint a job's partial result, which a rerun after a restart starts from."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET result = ?, updated = ? WHERE id = ?", (_dumps(result), time.time(), job_id)
+            )
+
+    def finish(self, job_id: str, status: str, result: Optional[Dict] = None,
+               error: Optional[str] = None) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = COALESCE(?, result), error = ?, owner = NULL, "
+                "updated = ? WHERE id = ?",
+                (status, _dumps(result) if result is not None else None, error, time.time(), job_id),
+            )
+
+    def heartbeat(self, owner: str, job_ids: List[str]) -> List[str]:
+        """Refresh the heartbeat of ``owner``'s running jobs; returns those asked to cancel."""
+        placeholders = ",".join("?" * len(job_ids))
+        with self._connect() as conn:
+            conn.execute(
+                f"UPDATE jobs SET heartbeat = ? WHERE owner = ? AND id IN ({placeholders})",
+                [time.time(), owner, *job_ids],
+            )
+            rows = conn.execute(
+                f"SELECT id FROM jobs WHERE cancel_requested AND id IN ({placeholders})", job_ids
+            ).fetchall()
+        return [row["id"] for row in rows]
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued job at once, or ask a running one to stop; False if it is not cancellable."""
+        now = time.time()
+        with self._connect() as conn:
+            queued = conn.execute(
+                "UPDATE jobs SET status = 'cancelled', cancel_requested = 1, updated = ? "
+                "WHERE id = ? AND status = 'queued' AND params IS NOT NULL",
+                (now, job_id),
+            ).rowcount
+            running = conn.execute(
+                "UPDATE jobs SET cancel_requested = 1, updated = ? "
+                "WHERE id = ? AND status = 'running' AND params IS NOT NULL",
+                (now, job_id),
+            ).rowcount
+        return bool(queued or running)
+
+    def requeue_stale(self) -> int:
+        """Queue again the running jobs whose worker stopped sending heartbeats.
+
+        Jobs that were asked to cancel are cancelled instead, and jobs that
+        have used up their attempts fail.
+        """
+        now = time.time()
+        cutoff = now - STALE_SECONDS
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'cancelled', owner = NULL, updated = ? "
+                "WHERE status = 'running' AND params IS NOT NULL AND heartbeat < ? AND cancel_requested",
+                (now, cutoff),
+            )
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', owner = NULL, updated = ?, "
+                "error = 'The job was interrupted too many times' "
+                "WHERE status = 'running' AND params IS NOT NULL AND heartbeat < ? AND attempts >= ?",
+                (now, cutoff, MAX_ATTEMPTS),
+            )
+            return conn.execute(
+                "UPDATE jobs SET status = 'queued', owner = NULL, updated = ? "
+                "WHERE status = 'running' AND params IS NOT NULL AND heartbeat < ?",
+                (now, cutoff),
+            ).rowcount
+
+    def prune(self) -> None:
+        """Forget jobs that finished long ago."""
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN ('completed', 'failed', 'cancelled') AND updated < ?",
+                (time.time() - KEEP_FINISHED_SECONDS,),
+            )
+
+
+class Job:
+    """A running job, as its handler sees it."""
+
+    def __init__(self, store: JobStore, claimed: Dict) -> None:
+        self.store = store
+        self.id: str = claimed["id"]
+        self.kind: str = claimed["kind"]
+        self.project: Optional[str] = claimed["project"]
+        self.params: Dict = claimed["params"]
+        # The last checkpoint of an earlier, interrupted run
+        self.checkpoint: Optional[Dict] = claimed["result"]
+        self.attempt: int = claimed["attempts"]
+        self.cancelled = threading.Event()
+
+    def check(self) -> None:
+        """Raise JobCancelled if the job was cancelled; handlers call this between steps."""
+        if self.cancelled.is_set():
+            raise JobCancelled()
+
+    def set_progress(self, total: int, done: int = 0, failed: int = 0) -> None:
+        """Set the job's item counts, such as at the start of a run."""
+        self.store.set_progress(self.id, total, done, failed)
+
+    def advance(self, done: int = 0, failed: int = 0) -> None:
+        self.store.advance(self.id, done, failed)
+
+    def save(self, result: Dict) -> None:
+        self.store.save(self.id, result)
+
+
+class JobRunner:
+    """Runs queued jobs with their registered handler, in threads of every worker process.
+
+    A handler takes a ``Job`` and returns the job's result, a JSON-friendly
+    dict. It reports progress with ``advance``, calls ``check`` between
+    steps so the job can be cancelled, and raises ``JobError`` to fail with
+    a message for the client.
+    """
+
+    def __init__(self, store: JobStore, handlers: Dict[str, Callable[[Job], Optional[Dict]]],
+                 threads: int = RUNNER_THREADS) -> None:
+        self.store = store
+        self.handlers = handlers
+        self.threads = threads
+        self._running: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        # Notified whenever a job run by this process finishes
+        self._finished = threading.Condition()
+        self._pid: Optional[int] = None
+
+    @property
+    def owner(self) -> str:
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def start(self) -> None:
+        """Start this process's runner threads, again after a fork."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._running = {}
+        interactive = [kind for kind in self.handlers if kind in INTERACTIVE_KINDS]
+        for number in range(self.threads):
+            kinds = interactive if number == 0 and interactive and self.threads > 1 else list(self.handlers)
+            threading.Thread(
+                target=self._run, args=(kinds,), name=f"bestshot-jobs-{number}", daemon=True,
+            ).start()
+        threading.Thread(target=self._heartbeat_loop, name="bestshot-jobs-heartbeat", daemon=True).start()
+
+    def submit(self, kind: str, project: Optional[str], params: Dict) -> str:
+        """Queue a job, or return the id of an identical one already queued or running."""
+        job_id = self.store.find_active(kind, project, params) or self.store.submit(kind, project, params)
+        self.start()
+        # A runner of this process is usually free to take it at once
+        self._wake.set()
+        return job_id
+
+    def cancel(self, job_id: str) -> bool:
+        if not self.store.cancel(job_id):
+            return False
+        with self._lock:
+            job = self._running.get(job_id)
+        if job is not None:
+            job.cancelled.set()
+        return True
+
+    def wait(self, job_id: str, timeout: float) -> Optional[Dict]:
+        """The job once it has finished, or as it stands after ``timeout`` seconds."""
+        deadline = time.monotonic() + timeout
+        job = self.store.get(job_id)
+        while job is not None and job["status"] in ACTIVE_STATUSES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Woken early when this process finishes a job; jobs in other
+            # processes are noticed by polling
+            with self._finished:
+                self._finished.wait(min(remaining, 0.25))
+            job = self.store.get(job_id)
+        return job
+
+    def _run(self, kinds: List[str]) -> None:
+        pid = os.getpid()
+        while self._pid == pid:
+            try:
+                claimed = self.store.claim(self.owner, kinds)
+            except sqlite3.Error as e:
+                print(f"Failed to claim a job: {e}")
+                claimed = None
+            if claimed is None:
+                self._wake.wait(POLL_INTERVAL)
+                self._wake.clear()
+                continue
+            job = Job(self.store, claimed)
+            with self._lock:
+                self._running[job.id] = job
+            try:
+                result = self.handlers[job.kind](job)
+                self.store.finish(job.id, "completed", result)
+            except JobCancelled:
+                self.store.finish(job.id, "cancelled")
+            except JobError as e:
+                self.store.finish(job.id, "failed", error=str(e))
+            except Exception as e:
+                traceback.print_exc()
+                self.store.finish(job.id, "failed", error=f"{type(e).__name__}: {e}")
+            finally:
+                with self._lock:
+                    self._running.pop(job.id, None)
+                with self._finished:
+                    self._finished.notify_all()
+
+    def _heartbeat_loop(self) -> None:
+        pid = os.getpid()
+        pruned = 0.0
+        while self._pid == pid:
+            time.sleep(HEARTBEAT_INTERVAL)
+            with self._lock:
+                running = dict(self._running)
+            try:
+                if running:
+                    for job_id in self.store.heartbeat(self.owner, list(running)):
+                        running[job_id].cancelled.set()
+                if self.store.requeue_stale():
+                    self._wake.set()
+                if time.monotonic() - pruned > PRUNE_INTERVAL:
+                    self.store.prune()
+                    pruned = time.monotonic()
+            except sqlite3.Error as e:
+                print(f"Job heartbeat failed: {e}")
+
+
+def default_process_workers() -> int:
+    """Pool processes per web worker: ``PROCESS_POOL_WORKERS``, or the cores shared among the workers.
+
+    The number of web workers is read from ``WEB_CONCURRENCY``, which
+    Gunicorn also uses as its default ``-w``, so that every worker's pool
+    together uses each core once.
+    """
+    configured = os.environ.get("PROCESS_POOL_WORKERS", "").strip()
+    if configured:
+        return max(1, int(configured))
+    try:
+        web_workers = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+    except ValueError:
+        web_workers = 1
+    return max(1, (os.cpu_count() or 1) // web_workers)
+
+
+class ProcessPool:
+    """A process pool for CPU-bound work, created lazily in each worker process.
+
+    A pool left broken by a process that died (killed for memory, or a
+    crash in an image decoder) is replaced on the next submit. Tasks that
+    were running in it fail with ``BrokenProcessPool``.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None) -> None:
+        self.max_workers = max_workers or default_process_workers()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self, broken: Optional[ProcessPoolExecutor] = None) -> ProcessPoolExecutor:
+        with self._lock:
+            if broken is not None and self._executor is broken:
+                print("Process pool broken; starting a new one")
+                broken.shutdown(wait=False)
+                self._executor = None
+            if self._executor is None or self._pid != os.getpid():
+                # Workers start from a clean forkserver rather than forking a
+                # multi-threaded web worker mid-request.
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context(
+                    "forkserver" if "forkserver" in methods else "spawn"
+                )
+                self._executor = ProcessPoolExecutor(self.max_workers, mp_context=context)
+                self._pid = os.getpid()
+            return self._executor
+
+    def submit(self, fn: Callable, *args, on_done: Optional[Callable[[Future], None]] = None) -> Future:
+        executor = self._get_executor()
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            future = self._get_executor(broken=executor).submit(fn, *args)
+        if on_done is not None:
+            future.add_done_callback(on_done)
+        return future
+
+
+class ThreadPool:
+    """A thread pool for I/O-bound work inside a request, created lazily in each worker process."""
+
+    def __init__(self, max_workers: int) -> None:
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="bestshot-io")
+                self._pid = os.getpid()
+            return self._executor
+
+    def submit(self, fn: Callable, *args) -> Future:
+        return self._get_executor().submit(fn, *args)
+
+    def map(self, fn: Callable, items: Iterable) -> List:
+        """``fn`` applied to every item concurrently, in order; re-raises the first error."""
+        return list(self._get_executor().map(fn, items))
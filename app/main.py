@@ -1,38 +1,120 @@
 from __future__ import annotations
 
+import base64
+import binascii
 import hashlib
 import json
+import mimetypes
 import os
 import re
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 import csv
 import io
 
 import shutil
 
-from io import BytesIO
 import zipfile
+from urllib.parse import quote
+import unicodedata
 
 from flask import (
     Flask,
     abort,
+    g,
+    has_request_context,
     jsonify,
     render_template,
     request,
-    send_file,
     send_from_directory,
+    stream_with_context,
     Response,
 )
 from werkzeug.utils import secure_filename
 
-# Pillow for thumbnails and EXIF
+# Support both `python app/main.py` and importing the `app` package
 try:
-    from PIL import Image, ExifTags, ImageOps
-    PILLOW_AVAILABLE = True
+    from .comparison import ANSWERS, SCOPES, question, remaining_estimate
+    from .events import EventLog
+    from .exif import exif_files, extract_exif
+    from .hashing import digest_files
+    from .jobs import Job, JobCancelled, JobError, JobRunner, JobStore, ProcessPool, ThreadPool
+    from .similarity import DEFAULT_MAX_DISTANCE, MAX_DISTANCE_LIMIT, cluster_pairs, dhash_files
+    from .media_index import MediaIndex
+    from .media_meta import ComparisonConflict, MediaMetaStore, RankingConflict
+    from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Metrics
+    from .profiling import DEFAULT_SLOW_SECONDS, PROFILE_HEADER, PROFILE_ID_HEADER, RequestProfiler
+    from .rating import OUTCOMES, fit, next_pair, unrated
+    from .thumbnails import (
+        ALL_THUMBNAILS_MASK,
+        DEFAULT_THUMBNAIL_SIZE,
+        PILLOW_AVAILABLE,
+        THUMBNAIL_SIZES,
+        build_sprite_sheet,
+        can_thumbnail,
+        generate_thumbnail,
+        placeholder_files,
+        thumbnail_mask,
+        thumbnail_name,
+        rendition_version,
+        thumbnail_names,
+        thumbnail_sizes,
+        thumbnail_version,
+    )
+    from .watcher import DEFAULT_POLL_INTERVAL, Changes, FolderWatcher
+    from .uploads import (
+        TUS_VERSION,
+        ResumableUploads,
+        UploadBusyError,
+        UploadRequest,
+        file_fingerprint,
+        parse_upload_metadata,
+        prune_stale_uploads,
+        uploads_dir,
+    )
 except ImportError:
-    PILLOW_AVAILABLE = False
+    from comparison import ANSWERS, SCOPES, question, remaining_estimate
+    from events import EventLog
+    from exif import exif_files, extract_exif
+    from hashing import digest_files
+    from jobs import Job, JobCancelled, JobError, JobRunner, JobStore, ProcessPool, ThreadPool
+    from similarity import DEFAULT_MAX_DISTANCE, MAX_DISTANCE_LIMIT, cluster_pairs, dhash_files
+    from media_index import MediaIndex
+    from media_meta import ComparisonConflict, MediaMetaStore, RankingConflict
+    from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Metrics
+    from profiling import DEFAULT_SLOW_SECONDS, PROFILE_HEADER, PROFILE_ID_HEADER, RequestProfiler
+    from rating import OUTCOMES, fit, next_pair, unrated
+    from thumbnails import (
+        ALL_THUMBNAILS_MASK,
+        DEFAULT_THUMBNAIL_SIZE,
+        PILLOW_AVAILABLE,
+        THUMBNAIL_SIZES,
+        build_sprite_sheet,
+        can_thumbnail,
+        generate_thumbnail,
+        placeholder_files,
+        thumbnail_mask,
+        thumbnail_name,
+        rendition_version,
+        thumbnail_names,
+        thumbnail_sizes,
+        thumbnail_version,
+    )
+    from watcher import DEFAULT_POLL_INTERVAL, Changes, FolderWatcher
+    from uploads import (
+        TUS_VERSION,
+        ResumableUploads,
+        UploadBusyError,
+        UploadRequest,
+        file_fingerprint,
+        parse_upload_metadata,
+        prune_stale_uploads,
+        uploads_dir,
+    )
 
 BASE_DIR = Path(__file__).resolve().parent
 TEMPLATES_DIR = BASE_DIR.parent / "templates"
@@ -71,11 +153,73 @@ VIDEO_EXTENSIONS = {
 }
 
 ALLOWED_EXTENSIONS = IMAGE_EXTENSIONS | VIDEO_EXTENSIONS
-RANKING_FILENAME = ".ranking.json"
 META_FILENAME = ".project.json"
-MEDIA_META_FILENAME = ".media-meta.json"
 THUMBS_DIR_NAME = ".thumbs"
-THUMBNAIL_SIZE = (400, 400)
+INDEX_DIR_NAME = ".bestshot"
+INDEX_FILENAME = "index.db"
+JOBS_FILENAME = "jobs.db"
+EVENTS_FILENAME = "events.db"
+METRICS_FILENAME = "metrics.db"
+PROFILES_DIR_NAME = "profiles"
+ARCHIVES_DIR_NAME = "archives"
+SPRITES_DIR_NAME = "sprites"
+WATCHER_LOCK_FILENAME = "watcher.lock"
+# Directory mtimes younger than this may still change within the same clock
+# tick, so the index does not trust them and rescans on the next request.
+MTIME_SETTLE_NS = 2_000_000_000
+SORT_OPTIONS = (
+    "rank", "name", "name_desc", "date", "date_desc", "taken", "taken_desc", "size", "size_desc",
+    "rating",
+)
+MAX_PAGE_SIZE = 1000
+# Opt-in offload of file transfers to a front proxy: nginx's X-Accel-Redirect
+# (to an internal location mapped onto PROJECT_ROOT) or X-Sendfile (Apache
+# mod_xsendfile, lighttpd) with the file's absolute path.
+SENDFILE_MODES = ("x-accel", "x-sendfile")
+DEFAULT_SENDFILE_PREFIX = "/protected-media/"
+# Versioned thumbnail URLs never change content, so clients may keep them for a year
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+# Formats that are already compressed are stored as-is in ZIP downloads;
+# deflating them costs CPU for next to no size reduction.
+UNCOMPRESSED_EXTENSIONS = {".bmp", ".tif", ".tiff"}
+ZIP_CHUNK_SIZE = 1024 * 1024
+# Partial archives left by a build that never finished are removed after this long
+ARCHIVE_PART_MAX_AGE = 24 * 60 * 60
+# Sprite sheets: the renditions they may be built from, the most files on
+# one sheet, cells per row, and sheets kept per project
+SPRITE_SIZES = (200, 400)
+DEFAULT_SPRITE_SIZE = 200
+MAX_SPRITE_ITEMS = 100
+SPRITE_COLUMNS = 10
+MAX_PROJECT_SPRITES = 50
+# Files per hashing task (content digests or perceptual hashes) on the process pool
+DIGEST_BATCH_SIZE = 32
+# Projects scanned at once by listings that span projects
+REFRESH_WORKERS = 8
+NDJSON_MIMETYPE = "application/x-ndjson"
+DEFAULT_DUPLICATE_GROUPS = 100
+# Files per request to the batch EXIF endpoint
+MAX_EXIF_BATCH = 100
+# Longest voter id kept with a vote
+MAX_VOTER_LENGTH = 100
+# Change feed: how often a waiting request checks for new events, how long
+# an event stream stays open before the browser reconnects, and how long a
+# long-poll may wait
+EVENT_STREAM_SECONDS = 55
+EVENT_HEARTBEAT_SECONDS = 15
+EVENT_RETRY_MS = 1000
+MAX_EVENT_WAIT = 25
+EVENT_BATCH_SIZE = 500
+EVENT_STREAM_MIMETYPE = "text/event-stream"
+# How long a request that started a job waits for it, so that quick jobs
+# answer like a plain request and only long ones are followed by polling
+JOB_INLINE_WAIT = 2
+JOB_RETRY_AFTER = 2
+# Files deleted between checkpoints of a batch delete job
+DELETE_BATCH_SIZE = 200
+# Slow-request entries returned by the profiles endpoint by default, and at most
+DEFAULT_SLOW_REQUESTS = 50
+MAX_SLOW_REQUESTS = 1000
 
 
 def _sanitize_project_name(name: str) -> str:
@@ -95,24 +239,148 @@ def _sanitize_project_name(name: str) -> str:
     return sanitized
 
 
+def _encode_cursor(sort_by: str, keys: list) -> str:
+    """Encode the sort keys of the last item on a page as an opaque cursor."""
+    raw = json.dumps({"sort": sort_by, "keys": keys}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str, sort_by: str) -> list:
+    """Decode a cursor, rejecting malformed ones and ones from another sort order."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        abort(400, description="Invalid cursor")
+    if not isinstance(data, dict) or not isinstance(data.get("keys"), list):
+        abort(400, description="Invalid cursor")
+    if data.get("sort") != sort_by:
+        abort(400, description="Cursor does not match the requested sort")
+    return data["keys"]
+
+
+class _ZipStreamBuffer(io.RawIOBase):
+    """Write-only sink that collects ZIP output until the generator drains it."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _zip_info(file_path: Path) -> zipfile.ZipInfo:
+    info = zipfile.ZipInfo.from_file(file_path, file_path.name)
+    if file_path.suffix.lower() in UNCOMPRESSED_EXTENSIONS:
+        info.compress_type = zipfile.ZIP_DEFLATED
+    else:
+        info.compress_type = zipfile.ZIP_STORED
+    return info
+
+
+def _iter_zip_stream(files: List[Path]):
+    """Yield a ZIP archive of ``files`` chunk by chunk.
+
+    The sink is not seekable, so zipfile writes each entry with a data
+    descriptor (and ZIP64 records where sizes require it), which keeps memory
+    bounded by the chunk size regardless of how large the archive gets.
+    """
+    sink = _ZipStreamBuffer()
+    with zipfile.ZipFile(sink, "w") as zf:
+        for file_path in files:
+            info = _zip_info(file_path)
+            with open(file_path, "rb") as src, zf.open(info, "w") as dest:
+                for chunk in iter(lambda: src.read(ZIP_CHUNK_SIZE), b""):
+                    dest.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()
+
+
+def _write_zip_archive(files: List[Path], dest: Path, after_file: Callable[[bool], None],
+                       check: Callable[[], None]) -> None:
+    """Write a ZIP archive of ``files`` to ``dest``.
+
+    ``check`` is called between chunks and may raise to stop. ``after_file``
+    is told whether each file made it in; files removed in the meantime are
+    left out.
+    """
+    with zipfile.ZipFile(dest, "w") as zf:
+        for file_path in files:
+            try:
+                info = _zip_info(file_path)
+                src = open(file_path, "rb")
+            except FileNotFoundError:
+                after_file(False)
+                continue
+            with src, zf.open(info, "w") as out:
+                for chunk in iter(lambda: src.read(ZIP_CHUNK_SIZE), b""):
+                    out.write(chunk)
+                    check()
+            after_file(True)
+
+
+def _attachment_response(body, mimetype: str, download_name: str) -> Response:
+    """Build an attachment response, encoding non-ASCII download names (RFC 6266)."""
+    response = Response(body, mimetype=mimetype)
+    try:
+        download_name.encode("ascii")
+        names = {"filename": download_name}
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize("NFKD", download_name).encode("ascii", "ignore").decode("ascii")
+        names = {"filename": simple, "filename*": f"UTF-8''{quote(download_name, safe='')}"}
+    response.headers.set("Content-Disposition", "attachment", **names)
+    return response
+
+
 def create_app() -> Flask:
     app = Flask(
         __name__,
         template_folder=str(TEMPLATES_DIR),
         static_folder=str(STATIC_DIR),
     )
+    app.request_class = UploadRequest
 
     # Add CORS headers to all responses
     @app.after_request
     def after_request(response):
         response.headers.add('Access-Control-Allow-Origin', '*')
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
-        response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
+        response.headers.add(
+            'Access-Control-Allow-Headers',
+            'Content-Type,Authorization,If-Match,Last-Event-ID,Tus-Resumable,Upload-Length,Upload-Metadata,Upload-Offset,X-Profile',
+        )
+        response.headers.add('Access-Control-Allow-Methods', 'GET,HEAD,PUT,POST,PATCH,DELETE,OPTIONS')
+        response.headers.add('Access-Control-Expose-Headers', 'ETag,Location,Server-Timing,Tus-Resumable,Upload-Length,Upload-Offset,X-Profile-Id')
         return response
 
     project_root = Path(os.environ.get("PROJECT_ROOT", str(DEFAULT_PROJECT_ROOT))).resolve()
     project_root.mkdir(parents=True, exist_ok=True)
 
+    sendfile_mode = os.environ.get("SENDFILE_MODE", "").strip().lower()
+    if sendfile_mode and sendfile_mode not in SENDFILE_MODES:
+        raise ValueError(f"SENDFILE_MODE must be one of: {', '.join(SENDFILE_MODES)}")
+    sendfile_prefix = "/" + os.environ.get("SENDFILE_PREFIX", DEFAULT_SENDFILE_PREFIX).strip("/") + "/"
+
+    watch_mode = os.environ.get("WATCH_MODE", "auto").strip().lower()
+    watch_interval = float(os.environ.get("WATCH_POLL_INTERVAL", DEFAULT_POLL_INTERVAL))
+
+    profile_dir = Path(os.environ.get(
+        "PROFILE_DIR", str(project_root / INDEX_DIR_NAME / PROFILES_DIR_NAME)
+    )).resolve()
+    profile_sample_rate = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+    profile_token = os.environ.get("PROFILE_TOKEN", "").strip() or None
+    slow_request_seconds = float(os.environ.get("SLOW_REQUEST_SECONDS", DEFAULT_SLOW_SECONDS))
+
     def _project_path(name: str) -> Path:
         # Use writing-friendly sanitization for project names
         safe_name = _sanitize_project_name(name)
@@ -124,23 +392,180 @@ def create_app() -> Flask:
             abort(400, description="Project path is outside of the root")
         return project_path
 
-    def _list_projects() -> List[dict]:
+    # ============ Metrics ============
+    # Counters for /metrics, and a per-request breakdown of where the time
+    # went for the Server-Timing header.
+    metrics = Metrics(project_root / INDEX_DIR_NAME / METRICS_FILENAME)
+
+    def _count_time(phase: str, seconds: float) -> None:
+        """Add ``seconds`` to a Server-Timing phase, taking them out of the enclosing phase."""
+        if not has_request_context():
+            return
+        timings = g.setdefault("timings", {})
+        timings[phase] = timings.get(phase, 0.0) + seconds
+        stack = g.setdefault("timing_stack", [])
+        if stack:
+            stack[-1][0] += seconds
+
+    @contextmanager
+    def _timed(phase: str) -> Iterator[None]:
+        """Count the time spent in the block towards a Server-Timing phase.
+
+        Phases nested inside it are not counted twice, so the phases never
+        add up to more than the request took.
+        """
+        if not has_request_context():
+            yield
+            return
+        # Time spent in phases nested inside this one
+        frame = [0.0]
+        stack = g.setdefault("timing_stack", [])
+        stack.append(frame)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            stack.pop()
+            _count_time(phase, time.perf_counter() - started - frame[0])
+
+    def _observe_metadata(store: str, operation: str, seconds: float) -> None:
+        metrics.observe(
+            "bestshot_metadata_duration_seconds", seconds,
+            (("store", store), ("operation", operation)),
+        )
+        _count_time("meta", seconds)
+
+    def _count_streamed_bytes(response: Response, route: str) -> None:
+        """Count a streamed body's bytes as they are sent, since its length is not known up front."""
+        body = response.response
+        chunks = response.iter_encoded()
+
+        def counted() -> Iterator[bytes]:
+            sent = 0
+            try:
+                for chunk in chunks:
+                    sent += len(chunk)
+                    yield chunk
+            finally:
+                metrics.inc("bestshot_http_response_bytes_total", (("route", route),), sent)
+                if hasattr(body, "close"):
+                    body.close()
+
+        response.response = counted()
+
+    @app.before_request
+    def start_timing():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        elapsed = time.perf_counter() - g.get("request_started", time.perf_counter())
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        status = str(response.status_code)
+        metrics.inc("bestshot_http_requests_total", (
+            ("route", route), ("method", request.method), ("status", status),
+        ))
+        if response.status_code >= 400:
+            metrics.inc("bestshot_http_errors_total", (
+                ("route", route), ("method", request.method), ("status", status),
+            ))
+        metrics.observe(
+            "bestshot_http_request_duration_seconds", elapsed,
+            (("route", route), ("method", request.method)),
+        )
+        if request.method != "HEAD":
+            if response.content_length is None and response.is_streamed:
+                _count_streamed_bytes(response, route)
+            elif response.content_length:
+                metrics.inc("bestshot_http_response_bytes_total", (("route", route),),
+                            response.content_length)
+        response.headers["Server-Timing"] = ", ".join(
+            [f"{phase};dur={seconds * 1000:.1f}" for phase, seconds in g.get("timings", {}).items()]
+            + [f"total;dur={elapsed * 1000:.1f}"]
+        )
+        return response
+
+    # ============ Profiling ============
+    # Flagged or sampled requests run under cProfile; slow ones are logged
+    # with the stacks they spent their time in.
+    profiler = RequestProfiler(
+        profile_dir, sample_rate=profile_sample_rate, token=profile_token,
+        slow_seconds=slow_request_seconds,
+    )
+
+    @app.before_request
+    def start_profiling():
+        g.profile = profiler.begin(request.headers.get(PROFILE_HEADER))
+
+    @app.after_request
+    def finish_profiling(response):
+        entry = g.pop("profile", None)
+        if entry is None:
+            return response
+
+        def describe() -> dict:
+            project = (request.view_args or {}).get("project_name")
+            return {
+                "method": request.method,
+                "path": request.full_path.rstrip("?"),
+                "route": request.url_rule.rule if request.url_rule else "unmatched",
+                "status": response.status_code,
+                "project": project,
+                "projectFiles": media_index.count_media([project], None, "", []) if project else None,
+            }
+
+        profile_id = profiler.end(entry, describe)
+        if profile_id:
+            response.headers[PROFILE_ID_HEADER] = profile_id
+        return response
+
+    @app.teardown_request
+    def abandon_profiling(exc):
+        # A request that failed before its response was finished is not recorded
+        entry = g.pop("profile", None)
+        if entry is not None:
+            profiler.discard(entry)
+
+    media_index = MediaIndex(project_root / INDEX_DIR_NAME / INDEX_FILENAME)
+    job_store = JobStore(project_root / INDEX_DIR_NAME / JOBS_FILENAME)
+    archives_dir = project_root / INDEX_DIR_NAME / ARCHIVES_DIR_NAME
+    sprites_dir = project_root / INDEX_DIR_NAME / SPRITES_DIR_NAME
+    # Sheets being built by this worker, by name, so a page asked for again
+    # meanwhile is not built twice
+    sprite_pool = ThreadPool(1)
+    sprite_builds: Set[str] = set()
+    sprite_builds_lock = threading.Lock()
+    event_log = EventLog(project_root / INDEX_DIR_NAME / EVENTS_FILENAME)
+    process_pool = ProcessPool()
+    io_pool = ThreadPool(REFRESH_WORKERS)
+    resumable_uploads = ResumableUploads()
+    media_meta = MediaMetaStore(
+        observer=lambda operation, seconds: _observe_metadata("media-meta", operation, seconds)
+    )
+
+    def _project_folders() -> List[Path]:
+        """List project folders, skipping hidden directories such as the index."""
+        return [
+            folder for folder in sorted(project_root.iterdir())
+            if folder.is_dir() and not folder.name.startswith(".")
+        ]
+
+    def _list_projects(folders: List[Path], details: List[Tuple[float, str]]) -> List[dict]:
+        """Summarise ``folders`` given each one's ``(mtime, description)``."""
+        counts = media_index.media_counts()
         projects = []
-        for folder in sorted(project_root.iterdir()):
-            if not folder.is_dir():
-                continue
-            all_media = _list_media_files(folder, "all")
-            images = [f for f in all_media if f.suffix.lower() in IMAGE_EXTENSIONS]
-            videos = [f for f in all_media if f.suffix.lower() in VIDEO_EXTENSIONS]
-            metadata = _load_metadata(folder)
+        for folder, (mtime, description) in zip(folders, details):
+            project_counts = counts.get(folder.name, {})
+            image_count = project_counts.get("image", 0)
+            video_count = project_counts.get("video", 0)
             projects.append(
                 {
                     "name": folder.name,
-                    "imageCount": len(images),
-                    "videoCount": len(videos),
-                    "mediaCount": len(all_media),
-                    "updated": datetime.fromtimestamp(folder.stat().st_mtime).isoformat(),
-                    "description": metadata.get("description", ""),
+                    "imageCount": image_count,
+                    "videoCount": video_count,
+                    "mediaCount": image_count + video_count,
+                    "updated": datetime.fromtimestamp(mtime).isoformat(),
+                    "description": description,
                 }
             )
         return projects
@@ -160,82 +585,162 @@ def create_app() -> Flask:
                 files.append(file)
         return sorted(files)
 
-    def _load_rankings(folder: Path) -> List[str]:
-        ranking_file = folder / RANKING_FILENAME
-        if ranking_file.exists():
-            try:
-                data = json.loads(ranking_file.read_text())
-                if isinstance(data, list):
-                    return [str(name) for name in data]
-            except json.JSONDecodeError:
-                pass
-        return []
+    def _send_file(directory: Path, filename: str, as_attachment: bool = False,
+                   etag=True, download_name: Optional[str] = None) -> Response:
+        """Send a file the caller has already validated to lie inside ``directory``.
+
+        In offload mode only the headers are built here: the front proxy
+        transfers the bytes and answers Range and conditional requests itself.
+        """
+        if not sendfile_mode:
+            return send_from_directory(directory, filename, as_attachment=as_attachment, etag=etag,
+                                       download_name=download_name)
+        file_path = (directory / filename).resolve()
+        mimetype = mimetypes.guess_type(file_path.name)[0] or "application/octet-stream"
+        if as_attachment:
+            response = _attachment_response(None, mimetype, download_name or file_path.name)
+        else:
+            response = Response(mimetype=mimetype)
+        if sendfile_mode == "x-accel":
+            # nginx decodes the URI before mapping it onto the internal location
+            location = sendfile_prefix + quote(file_path.relative_to(project_root).as_posix())
+            response.headers["X-Accel-Redirect"] = location
+        else:
+            response.headers["X-Sendfile"] = str(file_path)
+        return response
+
+    def _listing_etag(folders: List[Path], *parts) -> str:
+        """Strong ETag for a listing of ``folders``, refreshing their index rows first.
+
+        It covers the projects' change versions, the request's path and query
+        string, and any ``parts`` of the response that are not read from the
+        index, so it is known before the listing is built.
+        """
+        _refresh_projects(folders)
+        tag = media_index.change_tag([folder.name for folder in folders])
+        material = json.dumps([tag, request.full_path, *parts], default=str)
+        return hashlib.sha256(material.encode()).hexdigest()[:32]
+
+    def _not_modified(etag: str) -> Optional[Response]:
+        """A 304 response if the client already holds the listing tagged ``etag``."""
+        if not request.if_none_match.contains(etag):
+            return None
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response
+
+    def _listing_response(payload: dict, etag: str) -> Response:
+        # Cacheable, but revalidated on every use
+        with _timed("encode"):
+            response = jsonify(payload)
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response
 
-    def _save_rankings(folder: Path, order: List[str]) -> None:
-        ranking_file = folder / RANKING_FILENAME
-        ranking_file.write_text(json.dumps(order, indent=2))
+    def _ranking_precondition() -> Optional[int]:
+        """The ranking version named by the request's If-Match header, if any."""
+        if_match = request.if_match
+        if not if_match or if_match.star_tag:
+            return None
+        for tag in if_match.as_set():
+            if tag.isdigit():
+                return int(tag)
+        abort(412, description="Rankings have changed; reload and try again")
+
+    def _ranking_response(payload: dict, version: int) -> Response:
+        response = jsonify({**payload, "version": version})
+        response.set_etag(str(version))
+        return response
+
+    def _comparison_payload(folder: Path, session: dict) -> dict:
+        """A comparison session and its current question, with the files as the listings show them."""
+        state = session["state"]
+        pair = question(state)
+        rows = media_index.media_rows(folder.name, pair or ())
+        left, right = (rows.get(name) for name in pair) if pair else (None, None)
+        return {
+            "scope": session["scope"],
+            "media": session["media"],
+            "step": state["step"],
+            "done": pair is None,
+            "left": _serialize_row(left, folder.name) if left is not None else None,
+            "right": _serialize_row(right, folder.name) if right is not None else None,
+            "asked": state["asked"],
+            "ties": state["ties"],
+            "remaining": remaining_estimate(state),
+            "placed": len(state["sorted"]),
+            "total": len(state["sorted"]) + len(state["pending"]),
+            "order": state["sorted"],
+        }
+
+    def _voter(payload: dict) -> Optional[str]:
+        """The optional id a client sends to tell its votes apart from other people's."""
+        voter = payload.get("voter")
+        if voter is None:
+            return None
+        if not isinstance(voter, str) or not voter.strip() or len(voter) > MAX_VOTER_LENGTH:
+            abort(400, description=f"voter must be a string of at most {MAX_VOTER_LENGTH} characters")
+        return voter.strip()
+
+    def _unrank_files(folder: Path, filenames: List[str]) -> int:
+        """Drop deleted or moved files from a project's ranking; returns the ranking version."""
+        version = media_meta.unrank(folder, filenames)
+        media_index.store_signatures(folder.name, ranking_mtime=version)
+        return version
+
+    def _publish(project: Optional[str], event_type: str, **data) -> None:
+        """Tell change feed subscribers what a request changed (see events.py)."""
+        event_log.publish(project, event_type, data)
 
     def _load_metadata(folder: Path) -> Dict[str, str]:
         metadata_file = folder / META_FILENAME
-        if metadata_file.exists():
-            try:
-                data = json.loads(metadata_file.read_text())
-                if isinstance(data, dict):
-                    return {
-                        "description": str(data.get("description", "") or ""),
-                    }
-            except json.JSONDecodeError:
-                pass
-        return {"description": ""}
+        started = time.perf_counter()
+        try:
+            if metadata_file.exists():
+                try:
+                    data = json.loads(metadata_file.read_text())
+                    if isinstance(data, dict):
+                        return {
+                            "description": str(data.get("description", "") or ""),
+                        }
+                except json.JSONDecodeError:
+                    pass
+            return {"description": ""}
+        finally:
+            _observe_metadata("project-json", "read", time.perf_counter() - started)
 
     def _save_metadata(folder: Path, metadata: Dict[str, str]) -> None:
         metadata_file = folder / META_FILENAME
+        started = time.perf_counter()
         metadata_file.write_text(json.dumps(metadata, indent=2))
+        _observe_metadata("project-json", "write", time.perf_counter() - started)
 
-    def _load_media_meta(folder: Path) -> Dict[str, Dict]:
-        """Load per-media metadata (tags, comments, etc.) for all files in a project."""
-        meta_file = folder / MEDIA_META_FILENAME
-        if meta_file.exists():
-            try:
-                data = json.loads(meta_file.read_text())
-                if isinstance(data, dict):
-                    return data
-            except json.JSONDecodeError:
-                pass
-        return {}
-
-    def _save_media_meta(folder: Path, media_meta: Dict[str, Dict]) -> None:
-        """Save per-media metadata for all files in a project."""
-        meta_file = folder / MEDIA_META_FILENAME
-        meta_file.write_text(json.dumps(media_meta, indent=2))
+    def _apply_media_meta(folder: Path, records: Dict[str, Dict], revision: int) -> None:
+        """Copy metadata records just written to the store into the media index."""
+        media_index.update_media_meta(folder.name, records)
+        media_index.store_signatures(folder.name, meta_mtime=revision)
 
     def _get_media_tags(folder: Path, filename: str) -> List[str]:
         """Get tags for a specific media file."""
-        media_meta = _load_media_meta(folder)
-        file_meta = media_meta.get(filename, {})
-        return file_meta.get("tags", [])
+        return media_meta.get(folder, filename)["tags"]
 
     def _set_media_tags(folder: Path, filename: str, tags: List[str]) -> None:
         """Set tags for a specific media file."""
-        media_meta = _load_media_meta(folder)
-        if filename not in media_meta:
-            media_meta[filename] = {}
-        media_meta[filename]["tags"] = tags
-        _save_media_meta(folder, media_meta)
+        _apply_media_meta(folder, *media_meta.update(folder, {filename: {"tags": tags}}))
 
     def _get_media_comment(folder: Path, filename: str) -> str:
         """Get comment for a specific media file."""
-        media_meta = _load_media_meta(folder)
-        file_meta = media_meta.get(filename, {})
-        return file_meta.get("comment", "")
+        return media_meta.get(folder, filename)["comment"]
 
     def _set_media_comment(folder: Path, filename: str, comment: str) -> None:
         """Set comment for a specific media file."""
-        media_meta = _load_media_meta(folder)
-        if filename not in media_meta:
-            media_meta[filename] = {}
-        media_meta[filename]["comment"] = comment
-        _save_media_meta(folder, media_meta)
+        _apply_media_meta(folder, *media_meta.update(folder, {filename: {"comment": comment}}))
+
+    def _remove_media_meta(folder: Path, filenames: List[str]) -> None:
+        """Forget the metadata of deleted or moved files."""
+        revision = media_meta.delete(folder, filenames)
+        media_index.store_signatures(folder.name, meta_mtime=revision)
 
     def _get_file_hash(file_path: Path) -> str:
         """Calculate MD5 hash of a file for duplicate detection."""
@@ -251,183 +756,631 @@ def create_app() -> Flask:
 
     def _load_file_hashes(folder: Path) -> Dict[str, str]:
         """Load stored file hashes for a project."""
-        media_meta = _load_media_meta(folder)
-        hashes = {}
-        for filename, meta in media_meta.items():
-            if "hash" in meta:
-                hashes[meta["hash"]] = filename
-        return hashes
-
-    def _set_file_hash(folder: Path, filename: str, file_hash: str) -> None:
-        """Store file hash in media metadata."""
-        media_meta = _load_media_meta(folder)
-        if filename not in media_meta:
-            media_meta[filename] = {}
-        media_meta[filename]["hash"] = file_hash
-        _save_media_meta(folder, media_meta)
-
-    def _generate_thumbnail(file_path: Path, thumbs_dir: Path) -> Optional[str]:
-        """Generate a thumbnail for an image file."""
-        if not PILLOW_AVAILABLE:
+        return media_meta.hashes(folder)
+
+    def _set_file_hashes(folder: Path, hashes: Dict[str, str]) -> None:
+        """Store file hashes in media metadata."""
+        changes = {filename: {"hash": file_hash} for filename, file_hash in hashes.items()}
+        _apply_media_meta(folder, *media_meta.update(folder, changes))
+
+    def _media_type_for(filename: str) -> str:
+        return "video" if Path(filename).suffix.lower() in VIDEO_EXTENSIONS else "image"
+
+    def _settled_mtime(path: Path) -> Optional[int]:
+        """Return the mtime of a path if it is old enough to trust, else None."""
+        try:
+            mtime = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return 0
+        if time.time_ns() - mtime < MTIME_SETTLE_NS:
             return None
-        
-        if file_path.suffix.lower() not in IMAGE_EXTENSIONS:
+        return mtime
+
+    def _current_mtime(path: Path) -> int:
+        try:
+            return path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def _scan_media_files(folder: Path) -> Dict[str, tuple]:
+        """Scan a project folder with os.scandir, returning index rows keyed by name."""
+        files = {}
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if os.path.splitext(entry.name)[1].lower() not in ALLOWED_EXTENSIONS:
+                    continue
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                files[entry.name] = (
+                    _media_type_for(entry.name),
+                    stat.st_size,
+                    stat.st_mtime,
+                    stat.st_ctime,
+                )
+        return files
+
+    def _refresh_index(folder: Path) -> None:
+        """Reconcile the media index with a project folder.
+
+        The folder listing and the thumbnails directory are only re-read when
+        their mtime differs from the one recorded at the last reconcile. Media
+        metadata, rankings and ratings are compared by the metadata store's
+        revision, ranking version and vote version instead.
+        """
+        project = folder.name
+        stored = media_index.project_signatures(project) or {}
+        thumbs_dir = folder / THUMBS_DIR_NAME
+        current = {
+            "dir_mtime": _current_mtime(folder),
+            "thumbs_mtime": _current_mtime(thumbs_dir),
+            "ranking_mtime": media_meta.ranking_version(folder),
+            "meta_mtime": media_meta.revision(folder),
+            "votes_mtime": media_meta.votes_version(folder),
+        }
+        stale = {
+            column for column, mtime in current.items()
+            if stored.get(column) is None or stored[column] != mtime
+        }
+        if not stale:
+            return
+        # New rows need thumbnail state, rank and metadata applied too
+        if "dir_mtime" in stale:
+            stale.update(current)
+
+        signatures = {}
+        if "dir_mtime" in stale:
+            signatures["dir_mtime"] = _settled_mtime(folder)
+            synced = media_index.sync_files(project, _scan_media_files(folder))
+            if synced:
+                # New or changed images get their EXIF read in the background,
+                # unless a thumbnail job reads it with the pixels anyway
+                synced = set(synced) - _thumbnailing(project)
+                _enqueue_exif(folder, [
+                    name for name in media_index.files_without_exif(project) if name in synced
+                ])
+        if "thumbs_mtime" in stale:
+            signatures["thumbs_mtime"] = _settled_mtime(thumbs_dir)
+            thumbs = set(os.listdir(thumbs_dir)) if thumbs_dir.is_dir() else set()
+            # Only files whose renditions appeared or disappeared need a new version
+            changed = {}
+            for name, (known_mask, known_version) in media_index.thumbnail_states(project).items():
+                mask = thumbnail_mask(name, thumbs)
+                if mask != known_mask or (mask and not known_version):
+                    changed[name] = (mask, thumbnail_version(thumbs_dir, name) if mask else None)
+            media_index.set_thumbnails(project, changed)
+        if "ranking_mtime" in stale:
+            order, signatures["ranking_mtime"] = media_meta.rankings(folder)
+            media_index.store_rankings(project, dict(order))
+        if "meta_mtime" in stale:
+            records, signatures["meta_mtime"] = media_meta.load(folder)
+            media_index.store_media_meta(project, records)
+        if "votes_mtime" in stale:
+            votes, signatures["votes_mtime"] = media_meta.votes(folder)
+            # Start from the previous fit: one new vote only nudges it
+            previous = {
+                name: rating[0]
+                for name, rating in media_index.ratings(project).items() if rating
+            }
+            media_index.store_ratings(project, fit(votes, previous))
+        media_index.store_signatures(project, **signatures)
+
+    def _refresh_projects(folders: List[Path]) -> None:
+        """Reconcile several projects with the media index, scanning them concurrently."""
+        with _timed("scan"):
+            if len(folders) > 1:
+                io_pool.map(_refresh_index, folders)
+            elif folders:
+                _refresh_index(folders[0])
+
+    def _stream_media(folders: List[Path], media_type: str, sort_by: str, query: str,
+                      tags: List[str]) -> Response:
+        """Every matching item of ``folders`` as NDJSON, one item per line, in listing order.
+
+        The folders are scanned concurrently. Rank order lists project by
+        project, so each project's items are sent as soon as that project is
+        scanned. Other orders are global: they start once every project is
+        scanned and k-way merge the projects' sorted rows as they stream.
+        """
+        type_filter = {"photos": "image", "videos": "video"}.get(media_type)
+        folders = sorted(folders, key=lambda folder: folder.name)
+        scans = [io_pool.submit(_refresh_index, folder) for folder in folders]
+
+        def lines(rows) -> Iterator[str]:
+            for row in rows:
+                item = _serialize_row(row, row["project"])
+                item["project"] = row["project"]
+                yield json.dumps(item) + "\n"
+
+        def generate() -> Iterator[str]:
+            if sort_by == "rank":
+                for folder, scan in zip(folders, scans):
+                    scan.result()
+                    yield from lines(media_index.iter_media([folder.name], type_filter, sort_by, query, tags))
+                return
+            for scan in scans:
+                scan.result()
+            projects = [folder.name for folder in folders]
+            yield from lines(media_index.iter_media(projects, type_filter, sort_by, query, tags))
+
+        response = Response(generate(), mimetype=NDJSON_MIMETYPE)
+        response.cache_control.no_cache = True
+        # Let a buffering proxy such as nginx pass lines on as they are written
+        response.headers["X-Accel-Buffering"] = "no"
+        return response
+
+    def _index_file(folder: Path, file_path: Path, digest: Optional[str] = None) -> None:
+        """Record a file written by the app in the media index, with its digest if known."""
+        _index_files(folder, [(file_path, digest)])
+
+    def _index_files(folder: Path, files: List[Tuple[Path, Optional[str]]]) -> None:
+        """Record ``(file_path, digest)`` pairs in the media index, a few writes for the whole batch."""
+        thumbs_dir = folder / THUMBS_DIR_NAME
+        rows, digests, thumbs = {}, [], {}
+        for file_path, digest in files:
+            try:
+                stat = file_path.stat()
+            except FileNotFoundError:
+                continue  # removed meanwhile; the watcher forgets it
+            rows[file_path.name] = (
+                _media_type_for(file_path.name), stat.st_size, stat.st_mtime, stat.st_ctime,
+            )
+            if digest:
+                digests.append((file_path.name, stat.st_size, stat.st_mtime, digest))
+            existing = {
+                name for name in thumbnail_names(file_path.name).values()
+                if (thumbs_dir / name).exists()
+            }
+            mask = thumbnail_mask(file_path.name, existing)
+            thumbs[file_path.name] = (mask, thumbnail_version(thumbs_dir, file_path.name) if mask else None)
+        media_index.upsert_files(folder.name, rows)
+        if digests:
+            media_index.store_digests(folder.name, digests)
+        if thumbs:
+            media_index.set_thumbnails(folder.name, thumbs)
+
+    def _remove_thumbnails(folder: Path, filename: str) -> None:
+        """Delete every thumbnail rendition of a media file."""
+        thumbs_dir = folder / THUMBS_DIR_NAME
+        for thumb_name in thumbnail_names(filename).values():
+            thumb_path = thumbs_dir / thumb_name
+            if thumb_path.exists():
+                thumb_path.unlink()
+
+    def _stale_thumbnails(folder: Path, files: List[Path]) -> List[Path]:
+        """The images among ``files`` with a thumbnail rendition that is missing or older than the image."""
+        thumbs_dir = folder / THUMBS_DIR_NAME
+        thumb_mtimes = {}
+        if thumbs_dir.is_dir():
+            with os.scandir(thumbs_dir) as entries:
+                thumb_mtimes = {entry.name: entry.stat().st_mtime for entry in entries}
+        stale = []
+        for file_path in files:
+            try:
+                source_mtime = file_path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            for thumb_name in thumbnail_names(file_path.name).values():
+                thumb_mtime = thumb_mtimes.get(thumb_name)
+                if thumb_mtime is None or thumb_mtime < source_mtime:
+                    stale.append(file_path)
+                    break
+        return stale
+
+    def _enqueue_thumbnails(folder: Path, files: List[Path]) -> Optional[str]:
+        """Queue thumbnail generation for ``files``; return the job id."""
+        names = [
+            file_path.name for file_path in files
+            if file_path.suffix.lower() in IMAGE_EXTENSIONS and can_thumbnail(file_path)
+        ]
+        if not names:
             return None
-        
-        # Skip HEIC for now as it requires additional support
-        if file_path.suffix.lower() == ".heic":
+        return job_runner.submit("thumbnails", folder.name, {"files": names})
+
+    def _thumbnailing(project: str) -> Set[str]:
+        """Names of the files that a queued or running thumbnail job of ``project`` covers."""
+        names: Set[str] = set()
+        for params in job_store.active_params("thumbnails", project):
+            # A job without ``files`` covers the whole project
+            names.update(params.get("files") or media_index.file_names(project))
+        return names
+
+    def _thumbnail_job(job: Job) -> None:
+        """Generate the thumbnails of the job's ``files`` on the process pool.
+
+        Without ``files`` the whole project is covered, and images whose
+        thumbnails are current but that lack a perceptual hash or a
+        placeholder get them, read from the smallest rendition. Images with current thumbnails are
+        skipped, so a rerun carries on where an interrupted run stopped.
+        """
+        project = job.project
+        folder = project_root / project
+        if not folder.is_dir():
+            raise JobError("Project not found")
+        thumbs_dir = folder / THUMBS_DIR_NAME
+        names = job.params.get("files")
+        if names is None:
+            candidates = [
+                file_path for file_path in _list_media_files(folder, "photos") if can_thumbnail(file_path)
+            ]
+        else:
+            candidates = [folder / name for name in names]
+        files = _stale_thumbnails(folder, candidates)
+        rehash = []
+        previews = []
+        if names is None:
+            regenerating = {file_path.name for file_path in files}
+            _refresh_index(folder)
+            rehash = [
+                name for name in media_index.images_without_phash(project)
+                if name not in regenerating
+                and (thumbs_dir / thumbnail_name(name, min(THUMBNAIL_SIZES))).exists()
+            ]
+            previews = [
+                name for name in media_index.images_without_placeholder(project)
+                if name not in regenerating
+                and (thumbs_dir / thumbnail_name(name, min(THUMBNAIL_SIZES))).exists()
+            ]
+        job.set_progress(len(files) + len(rehash) + len(previews))
+
+        # Set once every task submitted below has been accounted for
+        tasks = []
+        remaining = [0]
+        lock = threading.Lock()
+        finished = threading.Event()
+
+        def task_done() -> None:
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    finished.set()
+
+        def on_done(file_path: Path, future) -> None:
+            try:
+                if future.cancelled():
+                    return
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Failed to generate thumbnail for {file_path}: {e}")
+                    result = None
+                if result:
+                    megapixels, seconds = result[3]
+                    metrics.inc("bestshot_thumbnails_generated_total")
+                    metrics.inc("bestshot_thumbnail_seconds_total", value=seconds)
+                    metrics.inc("bestshot_thumbnail_megapixels_total", value=megapixels)
+                    if megapixels:
+                        metrics.observe("bestshot_thumbnail_seconds_per_megapixel", seconds / megapixels)
+                    media_index.store_exif(project, [(file_path.name, *result[2])])
+                    media_index.set_thumbnails(project, {
+                        file_path.name: (ALL_THUMBNAILS_MASK, thumbnail_version(thumbs_dir, file_path.name)),
+                    })
+                    media_index.store_perceptual_hashes(project, {file_path.name: result[1]})
+                    _apply_media_meta(folder, *media_meta.update(
+                        folder, {file_path.name: {"placeholder": result[4]}}
+                    ))
+                    # Clients swap the card over to its thumbnails
+                    row = media_index.media_rows(project, [file_path.name]).get(file_path.name)
+                    if row is not None:
+                        _publish(project, "media.updated", items=[_serialize_row(row, project)])
+                    job.advance(done=1)
+                else:
+                    metrics.inc("bestshot_thumbnail_failures_total")
+                    job.advance(failed=1)
+            finally:
+                task_done()
+
+        def on_hashed(names: List[str], future) -> None:
+            try:
+                if future.cancelled():
+                    return
+                try:
+                    results = future.result()
+                except Exception as e:
+                    print(f"Failed to hash thumbnails in {folder}: {e}")
+                    results = [None] * len(names)
+                hashes = {name: value for name, value in zip(names, results) if value is not None}
+                media_index.store_perceptual_hashes(project, hashes)
+                job.advance(done=len(hashes), failed=len(names) - len(hashes))
+            finally:
+                task_done()
+
+        def on_previewed(names: List[str], future) -> None:
+            try:
+                if future.cancelled():
+                    return
+                try:
+                    results = future.result()
+                except Exception as e:
+                    print(f"Failed to make placeholders in {folder}: {e}")
+                    results = [None] * len(names)
+                changes = {name: {"placeholder": value} for name, value in zip(names, results) if value}
+                if changes:
+                    _apply_media_meta(folder, *media_meta.update(folder, changes))
+                    rows = media_index.media_rows(project, list(changes)).values()
+                    _publish(project, "media.updated", items=[_serialize_row(row, project) for row in rows])
+                job.advance(done=len(changes), failed=len(names) - len(changes))
+            finally:
+                task_done()
+
+        smallest = min(THUMBNAIL_SIZES)
+        batches = [rehash[start:start + DIGEST_BATCH_SIZE] for start in range(0, len(rehash), DIGEST_BATCH_SIZE)]
+        preview_batches = [
+            previews[start:start + DIGEST_BATCH_SIZE] for start in range(0, len(previews), DIGEST_BATCH_SIZE)
+        ]
+        remaining[0] = len(files) + len(batches) + len(preview_batches)
+        if not remaining[0]:
             return None
-        
-        thumbs_dir.mkdir(exist_ok=True)
-        thumb_name = f"{file_path.stem}_thumb.webp"
-        thumb_path = thumbs_dir / thumb_name
-        
+        for file_path in files:
+            tasks.append(process_pool.submit(
+                generate_thumbnail, file_path, thumbs_dir,
+                on_done=lambda future, file_path=file_path: on_done(file_path, future),
+            ))
+        for batch in batches:
+            tasks.append(process_pool.submit(
+                dhash_files, [thumbs_dir / thumbnail_name(name, smallest) for name in batch],
+                on_done=lambda future, batch=batch: on_hashed(batch, future),
+            ))
+        for batch in preview_batches:
+            tasks.append(process_pool.submit(
+                placeholder_files, [thumbs_dir / thumbnail_name(name, smallest) for name in batch],
+                on_done=lambda future, batch=batch: on_previewed(batch, future),
+            ))
         try:
-            with Image.open(file_path) as img:
-                # Apply EXIF orientation if present (fixes rotation for vertical photos)
+            while not finished.wait(1):
+                job.check()
+        except JobCancelled:
+            # Images already being thumbnailed finish; the rest are dropped
+            for task in tasks:
+                task.cancel()
+            raise
+        return None
+
+    def _enqueue_digests(folders: List[Path]) -> Tuple[Optional[str], int]:
+        """Queue hashing of every file without a current content digest.
+
+        Returns ``(job_id, queued)``. Files whose size and mtime are unchanged
+        since they were last hashed keep their digest and are skipped.
+        """
+        queued = 0
+        for folder in folders:
+            _refresh_index(folder)
+            # Files rewritten in place leave the folder mtime alone, so stat them all
+            media_index.sync_files(folder.name, _scan_media_files(folder))
+            queued += len(media_index.undigested_files(folder.name))
+        if not queued:
+            return None, 0
+        return job_runner.submit("digests", None, {"projects": [folder.name for folder in folders]}), queued
+
+    def _run_batches(job: Job, fn: Callable, batches: List[Tuple[Path, List[str]]],
+                     store: Callable[[Path, List[str], List], int]) -> None:
+        """Run ``fn`` over each ``(folder, names)`` batch on the process pool and wait for all.
+
+        ``store`` saves a batch's results, ``None`` for a file that failed,
+        and returns how many it saved.
+        """
+        if not batches:
+            return
+        remaining = [len(batches)]
+        lock = threading.Lock()
+        finished = threading.Event()
+
+        def on_done(folder: Path, names: List[str], future) -> None:
+            try:
+                if future.cancelled():
+                    return
                 try:
-                    img = ImageOps.exif_transpose(img)
-                except Exception:
-                    # If exif_transpose fails, continue without rotation
-                    pass
-                
-                # Convert to RGB if necessary (for PNG with transparency, etc.)
-                if img.mode in ('RGBA', 'LA', 'P'):
-                    background = Image.new('RGB', img.size, (0, 0, 0))
-                    if img.mode == 'P':
-                        img = img.convert('RGBA')
-                    background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                    img = background
-                elif img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # Maintain aspect ratio
-                img.thumbnail(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
-                img.save(thumb_path, 'WEBP', quality=80)
-            return thumb_name
-        except Exception as e:
-            print(f"Failed to generate thumbnail for {file_path}: {e}")
-            return None
-
-    def _extract_exif(file_path: Path) -> Dict:
-        """Extract EXIF data from an image file."""
-        if not PILLOW_AVAILABLE:
-            return {}
-        
-        if file_path.suffix.lower() not in IMAGE_EXTENSIONS:
-            return {}
-        
-        # Skip formats that don't typically have EXIF
-        if file_path.suffix.lower() in {".gif", ".bmp", ".webp", ".heic"}:
-            return {}
-        
+                    results = future.result()
+                except Exception as e:
+                    print(f"Failed to run {fn.__name__} in {folder}: {e}")
+                    results = [None] * len(names)
+                stored = store(folder, names, results)
+                job.advance(done=stored, failed=len(names) - stored)
+            finally:
+                with lock:
+                    remaining[0] -= 1
+                    if remaining[0] == 0:
+                        finished.set()
+
+        tasks = [
+            process_pool.submit(
+                fn, [folder / name for name in names],
+                on_done=lambda future, folder=folder, names=names: on_done(folder, names, future),
+            )
+            for folder, names in batches
+        ]
         try:
-            with Image.open(file_path) as img:
-                exif_data = img._getexif()
-                if not exif_data:
-                    return {}
-                
-                exif_dict = {}
-                for tag_id, value in exif_data.items():
-                    tag = ExifTags.TAGS.get(tag_id, tag_id)
-                    
-                    # Only include useful tags
-                    if tag in ['Make', 'Model', 'DateTime', 'DateTimeOriginal', 
-                               'ExposureTime', 'FNumber', 'ISOSpeedRatings', 'ISO',
-                               'FocalLength', 'LensModel', 'LensMake',
-                               'ExposureProgram', 'WhiteBalance', 'Flash',
-                               'ImageWidth', 'ImageHeight', 'Orientation']:
-                        # Convert bytes to string if needed
-                        if isinstance(value, bytes):
-                            try:
-                                value = value.decode('utf-8', errors='ignore')
-                            except:
-                                continue
-                        # Handle tuples (like FocalLength)
-                        if isinstance(value, tuple) and len(value) == 2:
-                            try:
-                                value = round(value[0] / value[1], 2)
-                            except:
-                                pass
-                        exif_dict[tag] = value
-                
-                return exif_dict
-        except Exception as e:
-            print(f"Failed to extract EXIF from {file_path}: {e}")
-            return {}
-
-    def _get_file_info(file_path: Path) -> Dict:
-        """Get file information including size and dates."""
-        stat = file_path.stat()
+            while not finished.wait(1):
+                job.check()
+        except JobCancelled:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    def _digest_job(job: Job) -> None:
+        """Hash the job's ``files`` on the process pool, or every undigested file of its ``projects``.
+
+        Digests are stored batch by batch, so a rerun carries on with the
+        files an interrupted run did not get to.
+        """
+        projects = job.params["projects"] if job.project is None else [job.project]
+        batches = []
+        for project in projects:
+            folder = project_root / project
+            if not folder.is_dir():
+                continue
+            undigested = media_index.undigested_files(project)
+            names = job.params.get("files")
+            if names is not None:
+                wanted = set(names)
+                undigested = [name for name in undigested if name in wanted]
+            for start in range(0, len(undigested), DIGEST_BATCH_SIZE):
+                batches.append((folder, undigested[start:start + DIGEST_BATCH_SIZE]))
+        job.set_progress(sum(len(names) for _, names in batches))
+
+        def store(folder: Path, names: List[str], results: List) -> int:
+            digests = [(name, *result) for name, result in zip(names, results) if result]
+            media_index.store_digests(folder.name, digests)
+            return len(digests)
+
+        _run_batches(job, digest_files, batches, store)
+        return None
+
+    def _enqueue_exif(folder: Path, names: List[str]) -> Optional[str]:
+        """Queue reading the EXIF of the named images; return the job id."""
+        if not names:
+            return None
+        return job_runner.submit("exif", folder.name, {"files": names})
+
+    def _exif_job(job: Job) -> None:
+        """Read the EXIF of the job's ``files`` on the process pool, skipping those already read."""
+        folder = project_root / job.project
+        if not folder.is_dir():
+            raise JobError("Project not found")
+        wanted = set(job.params["files"])
+        names = [name for name in media_index.files_without_exif(job.project) if name in wanted]
+        job.set_progress(len(names))
+
+        def store(folder: Path, names: List[str], results: List) -> int:
+            entries = [(name, *result) for name, result in zip(names, results) if result]
+            media_index.store_exif(folder.name, entries)
+            return len(entries)
+
+        _run_batches(job, exif_files, [
+            (folder, names[start:start + DIGEST_BATCH_SIZE])
+            for start in range(0, len(names), DIGEST_BATCH_SIZE)
+        ], store)
+        return None
+
+    def _exif_payload(folder: Path, row) -> dict:
+        """EXIF and file info for an indexed file, reading EXIF now if it never was."""
+        if row["exif"] is not None:
+            exif = json.loads(row["exif"])
+        elif row["type"] == "image":
+            exif = extract_exif(folder / row["name"])
+            media_index.store_exif(folder.name, [(row["name"], row["size"], row["mtime"], exif)])
+        else:
+            exif = {}
         return {
-            "size": stat.st_size,
-            "created": datetime.fromtimestamp(stat.st_ctime).isoformat(),
-            "modified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
+            "exif": exif,
+            "fileInfo": {
+                "size": row["size"],
+                "created": datetime.fromtimestamp(row["ctime"]).isoformat(),
+                "modified": datetime.fromtimestamp(row["mtime"]).isoformat(),
+            },
+        }
+
+    def _serialize_row(row, project: str) -> dict:
+        name = row["name"]
+        item = {
+            "name": name,
+            "rank": row["position"],
+            "isRanked": row["position"] is not None,
+            "url": f"/api/projects/{project}/files/{name}",
+            "type": row["type"],
+            "tags": json.loads(row["tags"]),
+            "comment": row["comment"],
+            "size": row["size"],
+            "created": datetime.fromtimestamp(row["ctime"]).isoformat(),
+            "modified": datetime.fromtimestamp(row["mtime"]).isoformat(),
+            "taken": datetime.fromtimestamp(row["taken"]).isoformat() if row["taken"] is not None else None,
+            "rating": {
+                "score": round(row["rating"], 1),
+                "low": round(row["rating_low"], 1),
+                "high": round(row["rating_high"], 1),
+                "votes": row["votes"],
+            } if row["rating"] is not None else None,
         }
+        sizes = thumbnail_sizes(row["has_thumb"])
+        if sizes:
+            # Content-addressed when the renditions' version is known
+            thumbs_url = f"/api/projects/{project}/thumbs"
+            if row["thumb_version"]:
+                thumbs_url += f"/v/{row['thumb_version']}"
+            item["thumbUrls"] = {
+                str(size): f"{thumbs_url}/{thumbnail_name(name, size)}"
+                for size in sizes
+            }
+            # thumbUrl stays the default rendition, or the closest one available
+            item["thumbUrl"] = item["thumbUrls"].get(
+                str(DEFAULT_THUMBNAIL_SIZE), item["thumbUrls"][str(sizes[-1])]
+            )
+        if row["placeholder"]:
+            # Painted in the card until the thumbnail arrives
+            item["placeholder"] = row["placeholder"]
+        return item
+
+    def _query_media_page(
+        folders: List[Path],
+        media_type: str = "all",
+        sort_by: str = "rank",
+        query: str = "",
+        tags: Optional[List[str]] = None,
+        cursor: Optional[str] = None,
+        limit: Optional[int] = None,
+        include_project: bool = False,
+    ) -> tuple:
+        """Return ``(items, next_cursor, total)`` for one page of media across folders.
+
+        ``total`` counts every item matching the filters, not just this page.
+        """
+        _refresh_projects(folders)
+        projects = [folder.name for folder in folders]
+        type_filter = {"photos": "image", "videos": "video"}.get(media_type)
+        tags = tags or []
+        after = _decode_cursor(cursor, sort_by) if cursor else None
+        with _timed("query"):
+            rows, key_columns = media_index.query_media(
+                projects, type_filter, sort_by, query=query, tags=tags, after=after,
+                limit=limit + 1 if limit is not None else None,
+            )
+            total = media_index.count_media(projects, type_filter, query, tags)
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = _encode_cursor(sort_by, [rows[-1][column] for column in key_columns])
+        items = []
+        with _timed("serialize"):
+            for row in rows:
+                item = _serialize_row(row, row["project"])
+                if include_project:
+                    item["project"] = row["project"]
+                items.append(item)
+        return items, next_cursor, total
 
     def _serialize_media(folder: Path, media_type: str = "all", sort_by: str = "rank") -> List[dict]:
         """Serialize media files with type information."""
-        files = _list_media_files(folder, media_type)
-        current_files = {file.name: file for file in files}
-        rankings = [name for name in _load_rankings(folder) if name in current_files]
-        ranked_set = set(rankings)
-        remaining = [name for name in current_files if name not in rankings]
-        
-        # Default ordering (ranked first, then unranked by name)
-        ordered = rankings + sorted(remaining)
-        
-        media_meta = _load_media_meta(folder)
-        thumbs_dir = folder / THUMBS_DIR_NAME
-        
-        serialized = []
-        for idx, name in enumerate(ordered, start=1):
-            file_path = current_files[name]
-            suffix = file_path.suffix.lower()
-            is_video = suffix in VIDEO_EXTENSIONS
-            file_meta = media_meta.get(name, {})
-            is_ranked = name in ranked_set
-            
-            # Check for thumbnail
-            thumb_name = f"{file_path.stem}_thumb.webp"
-            has_thumb = (thumbs_dir / thumb_name).exists() if thumbs_dir.exists() else False
-            
-            # Get file info
-            file_info = _get_file_info(file_path)
-            
-            item = {
-                "name": name,
-                "rank": idx if is_ranked else None,
-                "isRanked": is_ranked,
-                "url": f"/api/projects/{folder.name}/files/{name}",
-                "type": "video" if is_video else "image",
-                "tags": file_meta.get("tags", []),
-                "comment": file_meta.get("comment", ""),
-                "size": file_info["size"],
-                "created": file_info["created"],
-                "modified": file_info["modified"],
-            }
-            
-            if has_thumb:
-                item["thumbUrl"] = f"/api/projects/{folder.name}/thumbs/{thumb_name}"
-            
-            serialized.append(item)
-        
-        # Apply sorting
-        if sort_by == "name":
-            serialized.sort(key=lambda x: x["name"].lower())
-        elif sort_by == "name_desc":
-            serialized.sort(key=lambda x: x["name"].lower(), reverse=True)
-        elif sort_by == "date":
-            serialized.sort(key=lambda x: x["modified"])
-        elif sort_by == "date_desc":
-            serialized.sort(key=lambda x: x["modified"], reverse=True)
-        elif sort_by == "size":
-            serialized.sort(key=lambda x: x["size"])
-        elif sort_by == "size_desc":
-            serialized.sort(key=lambda x: x["size"], reverse=True)
-        # Default "rank" sorting is already applied
-        
-        return serialized
+        items, _, _ = _query_media_page([folder], media_type, sort_by)
+        return items
+
+    def _listing_args() -> dict:
+        """Parse the shared query parameters of the media listing endpoints."""
+        # Support filtering by media type: 'all', 'photos', or 'videos'
+        media_type = request.args.get("media", "all")
+        if media_type not in ("all", "photos", "videos"):
+            media_type = "all"
+        sort_by = request.args.get("sort", "rank")
+        if sort_by not in SORT_OPTIONS:
+            sort_by = "rank"
+        limit = request.args.get("limit")
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except ValueError:
+                abort(400, description="limit must be an integer")
+            if limit < 1:
+                abort(400, description="limit must be positive")
+            limit = min(limit, MAX_PAGE_SIZE)
+        return {
+            "media_type": media_type,
+            "sort_by": sort_by,
+            "query": request.args.get("q", "").strip(),
+            "tags": [
+                tag.strip().lower() for tag in request.args.getlist("tag") if tag.strip()
+            ],
+            "cursor": request.args.get("cursor") or None,
+            "limit": limit,
+        }
 
     def _next_available_name(folder: Path, filename: str) -> str:
         candidate = filename
@@ -439,6 +1392,196 @@ def create_app() -> Flask:
             counter += 1
         return candidate
 
+    # ============ Background Jobs ============
+    # Operations that can outgrow a request run as jobs (see jobs.py). The
+    # request that starts one waits a moment, so small ones still answer at
+    # once; the rest answer 202 and are followed through /api/jobs/<id>.
+
+    def _project_key(project: str) -> str:
+        """Prefix of a project's files in the shared archive and sprite caches."""
+        return hashlib.sha256(project.encode()).hexdigest()[:16]
+
+    def _archive_path(folder: Path, files: List[Path]) -> Path:
+        """Where the ZIP archive of a project's ``files`` is cached.
+
+        The name carries a digest of every file's name, size and mtime, so
+        the cached archive goes out of date as soon as the project changes.
+        """
+        digest = hashlib.sha256()
+        for file_path in files:
+            try:
+                stat = file_path.stat()
+            except FileNotFoundError:
+                continue
+            digest.update(f"{file_path.name}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+        return archives_dir / f"{_project_key(folder.name)}-{digest.hexdigest()[:32]}.zip"
+
+    def _remove_archives(project: str, keep: Optional[Path] = None) -> None:
+        """Delete a project's cached archives, except ``keep``."""
+        for archive in archives_dir.glob(f"{_project_key(project)}-*.zip"):
+            if archive != keep:
+                archive.unlink(missing_ok=True)
+
+    def _archive_job(job: Job) -> Dict:
+        """Build the cached ZIP archive of a project's media files."""
+        folder = project_root / job.project
+        if not folder.is_dir():
+            raise JobError("Project not found")
+        files = _list_media_files(folder, "all")
+        if not files:
+            raise JobError("No media files to download")
+        archive = _archive_path(folder, files)
+        archives_dir.mkdir(parents=True, exist_ok=True)
+        # Written under the job's id, so a rerun after a restart starts it over
+        part = archive.with_name(f".{job.id}.part")
+        for stale in archives_dir.glob(".*.part"):
+            try:
+                if stale != part and time.time() - stale.stat().st_mtime > ARCHIVE_PART_MAX_AGE:
+                    stale.unlink()
+            except FileNotFoundError:
+                pass
+        if not archive.exists():
+            job.set_progress(len(files))
+            try:
+                _write_zip_archive(
+                    files, part,
+                    lambda added: job.advance(done=1) if added else job.advance(failed=1),
+                    job.check,
+                )
+                os.replace(part, archive)
+            finally:
+                part.unlink(missing_ok=True)
+        else:
+            job.set_progress(len(files), done=len(files))
+        _remove_archives(folder.name, keep=archive)
+        return {"size": archive.stat().st_size, "files": len(files)}
+
+    def _delete_job(job: Job) -> Dict:
+        """Delete files from a project, a batch at a time.
+
+        What is gone is checkpointed after every batch, so a rerun neither
+        loses track of it nor leaves the index holding files that were
+        deleted just before the interruption.
+        """
+        folder = project_root / job.project
+        if not folder.is_dir():
+            raise JobError("Project not found")
+        project = folder.name
+        filenames = job.params["files"]
+        deleted = list((job.checkpoint or {}).get("deleted", []))
+        done = set(deleted)
+        names = [name for name in filenames if name not in done]
+        job.set_progress(len(filenames), done=len(deleted))
+        for start in range(0, len(names), DELETE_BATCH_SIZE):
+            job.check()
+            chunk = names[start:start + DELETE_BATCH_SIZE]
+            # Files a crashed run deleted after its last checkpoint are still indexed
+            known = media_index.file_states(project, chunk) if job.attempt > 1 else {}
+            batch = []
+            for filename in chunk:
+                file_path = (folder / filename).resolve()
+                if folder not in file_path.parents:
+                    continue
+                if file_path.exists():
+                    file_path.unlink()
+                elif filename not in known:
+                    continue
+                _remove_thumbnails(folder, file_path.name)
+                batch.append(filename)
+            if batch:
+                media_index.remove_files(project, batch)
+                version = _unrank_files(folder, batch)
+                _remove_media_meta(folder, batch)
+                _publish(project, "media.deleted", names=batch, rankingVersion=version)
+                deleted.extend(batch)
+                job.save({"deleted": deleted})
+            job.advance(done=len(batch), failed=len(chunk) - len(batch))
+        return {"deleted": deleted}
+
+    def _move_job(job: Job) -> Dict:
+        """Move a file, with its thumbnails and metadata, to another project.
+
+        The new name and the file's metadata are checkpointed before the
+        file moves, so a rerun finishes the move instead of losing them.
+        """
+        source_folder = project_root / job.project
+        target_project = job.params["targetProject"]
+        target_folder = project_root / target_project
+        filename = job.params["filename"]
+        if not target_folder.is_dir():
+            raise JobError("Target project not found")
+        source_file = source_folder / filename
+        job.set_progress(1)
+        checkpoint = job.checkpoint
+        if checkpoint is None:
+            if not source_file.exists():
+                raise JobError("File not found")
+            checkpoint = {
+                "newName": _next_available_name(target_folder, filename),
+                "record": media_meta.get(source_folder, filename),
+            }
+            job.save(checkpoint)
+        target_file = checkpoint["newName"]
+        final_target = target_folder / target_file
+        if source_file.exists():
+            # Copies over the partial copy of an interrupted move between file systems
+            shutil.move(str(source_file), str(final_target))
+        elif not final_target.exists():
+            raise JobError("File not found")
+        media_index.remove_files(source_folder.name, [filename])
+
+        # Move thumbnails if they exist
+        source_thumbs_dir = source_folder / THUMBS_DIR_NAME
+        target_thumbs_dir = target_folder / THUMBS_DIR_NAME
+        target_thumb_names = thumbnail_names(target_file)
+        for size, thumb_name in thumbnail_names(filename).items():
+            source_thumb = source_thumbs_dir / thumb_name
+            if source_thumb.exists():
+                target_thumbs_dir.mkdir(exist_ok=True)
+                target_thumb = target_thumbs_dir / target_thumb_names[size]
+                shutil.move(str(source_thumb), str(target_thumb))
+        _index_file(target_folder, final_target)
+
+        # Move metadata
+        _apply_media_meta(target_folder, *media_meta.update(target_folder, {target_file: checkpoint["record"]}))
+        _remove_media_meta(source_folder, [filename])
+
+        # Remove from source rankings
+        version = _unrank_files(source_folder, [filename])
+        _publish(source_folder.name, "media.deleted", names=[filename], rankingVersion=version)
+        _publish(target_folder.name, "media.added", names=[target_file])
+        job.advance(done=1)
+        return {"moved": filename, "newName": target_file, "targetProject": target_project}
+
+    job_runner = JobRunner(job_store, {
+        "archive": _archive_job,
+        "delete": _delete_job,
+        "digests": _digest_job,
+        "exif": _exif_job,
+        "move": _move_job,
+        "thumbnails": _thumbnail_job,
+    })
+
+    def _job_response(job_id: str, **data) -> Response:
+        """Answer a request that started a job.
+
+        A job that finishes within JOB_INLINE_WAIT answers 200 with its
+        result, like a plain request. Otherwise the answer is 202 with the
+        job id, for the client to follow through /api/jobs/<id>.
+        """
+        job = job_runner.wait(job_id, JOB_INLINE_WAIT)
+        if job["status"] == "completed":
+            return jsonify({"job": job_id, **(job["result"] or {}), **data})
+        if job["status"] == "failed":
+            abort(500, description=job["error"] or "Job failed")
+        if job["status"] == "cancelled":
+            abort(409, description="Job was cancelled")
+        response = jsonify({"job": job_id, "status": job["status"], **data})
+        response.status_code = 202
+        response.headers["Location"] = f"/api/jobs/{job_id}"
+        response.headers["Retry-After"] = str(JOB_RETRY_AFTER)
+        return response
+
     # ============ Health Check ============
     @app.get("/health")
     def health_check():
@@ -449,13 +1592,61 @@ def create_app() -> Flask:
             "version": "1.1.0"
         })
 
+    @app.get("/metrics")
+    def get_metrics():
+        """Counters and histograms of every worker, in the Prometheus text format."""
+        return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+    # ============ Profiles ============
+    def _require_profile_access() -> None:
+        """With a profile token configured, profiles are only shown to requests bearing it."""
+        if profiler.token is not None and request.headers.get("Authorization") != f"Bearer {profiler.token}":
+            abort(403, description="Profiles need the profile token")
+
+    @app.get("/api/profiles")
+    def list_profiles():
+        """Captured profiles, newest first, and the most recent slow requests."""
+        _require_profile_access()
+        try:
+            limit = int(request.args.get("limit", DEFAULT_SLOW_REQUESTS))
+        except ValueError:
+            abort(400, description="limit must be an integer")
+        limit = max(1, min(limit, MAX_SLOW_REQUESTS))
+        return jsonify({
+            "profiles": profiler.profiles(),
+            "slowRequests": profiler.slow_requests(limit),
+            "sampleRate": profiler.sample_rate,
+            "slowRequestSeconds": profiler.slow_seconds,
+        })
+
+    @app.get("/api/profiles/<filename>")
+    def download_profile(filename: str):
+        """Download a profile file (``.prof``, ``.collapsed`` or ``.json``) or the slow-request log."""
+        _require_profile_access()
+        path = profiler.captured_file(filename)
+        if path is None:
+            abort(404, description="Profile not found")
+        return send_from_directory(profiler.directory, path.name, as_attachment=True)
+
     @app.route("/")
     def index() -> str:
         return render_template("index.html")
 
     @app.get("/api/projects")
     def get_projects():
-        return jsonify({"projects": _list_projects()})
+        folders = _project_folders()
+        media_index.prune_projects(folder.name for folder in folders)
+        details = [
+            (folder.stat().st_mtime, _load_metadata(folder).get("description", ""))
+            for folder in folders
+        ]
+        etag = _listing_etag(folders, details)
+        not_modified = _not_modified(etag)
+        if not_modified:
+            return not_modified
+        with _timed("serialize"):
+            projects = _list_projects(folders, details)
+        return _listing_response({"projects": projects}, etag)
 
     @app.post("/api/projects")
     def create_project():
@@ -467,6 +1658,7 @@ def create_app() -> Flask:
             abort(400, description="Project already exists")
         folder.mkdir(parents=True, exist_ok=True)
         _save_metadata(folder, {"description": description})
+        _publish(folder.name, "project.created", description=description)
         return jsonify({"name": folder.name, "description": description}), 201
 
     @app.get("/api/projects/<project_name>/images")
@@ -474,24 +1666,28 @@ def create_app() -> Flask:
         folder = _project_path(project_name)
         if not folder.exists():
             abort(404, description="Project not found")
-        # Support filtering by media type: 'all', 'photos', or 'videos'
-        media_type = request.args.get("media", "all")
-        if media_type not in ("all", "photos", "videos"):
-            media_type = "all"
-        # Support sorting
-        sort_by = request.args.get("sort", "rank")
-        if sort_by not in ("rank", "name", "name_desc", "date", "date_desc", "size", "size_desc"):
-            sort_by = "rank"
+        args = _listing_args()
         metadata = _load_metadata(folder)
-        media_items = _serialize_media(folder, media_type, sort_by)
-        return jsonify(
+        # Read before the page: a move landing in between makes this version
+        # stale, so the client's next edit fails its precondition and reloads.
+        ranking_version = media_meta.ranking_version(folder)
+        etag = _listing_etag([folder], metadata, ranking_version)
+        not_modified = _not_modified(etag)
+        if not_modified:
+            return not_modified
+        media_items, next_cursor, total = _query_media_page([folder], **args)
+        return _listing_response(
             {
                 "project": folder.name,
                 "description": metadata.get("description", ""),
                 "images": media_items,
-                "mediaType": media_type,
-                "sortBy": sort_by,
-            }
+                "mediaType": args["media_type"],
+                "sortBy": args["sort_by"],
+                "nextCursor": next_cursor,
+                "total": total,
+                "rankingVersion": ranking_version,
+            },
+            etag,
         )
 
     @app.put("/api/projects/<project_name>")
@@ -511,12 +1707,18 @@ def create_app() -> Flask:
             if new_folder.exists():
                 abort(400, description="A project with that name already exists")
             # Rename the folder
+            media_meta.close(folder)
             folder.rename(new_folder)
+            media_index.rename_project(folder.name, new_folder.name)
+            _remove_archives(folder.name)
+            _remove_sprites(folder.name)
+            _publish(folder.name, "project.renamed", name=new_folder.name)
             folder = new_folder
         
         # Handle description update
         description = str(payload.get("description", "") or "").strip()
         _save_metadata(folder, {"description": description})
+        _publish(folder.name, "project.updated", description=description)
         return jsonify({"name": folder.name, "description": description})
 
     @app.post("/api/projects/<project_name>/upload")
@@ -524,6 +1726,9 @@ def create_app() -> Flask:
         folder = _project_path(project_name)
         if not folder.exists():
             abort(404, description="Project not found")
+        # Spool file bodies straight into the project, hashing them as they arrive
+        prune_stale_uploads(folder)
+        request.upload_dir = uploads_dir(folder)
         if "files" not in request.files:
             abort(400, description="No files provided")
         
@@ -533,7 +1738,8 @@ def create_app() -> Flask:
         
         saved = []
         duplicates = []
-        thumbs_dir = folder / THUMBS_DIR_NAME
+        hashes = {}
+        indexed = []
         
         for file in request.files.getlist("files"):
             if not file:
@@ -544,48 +1750,198 @@ def create_app() -> Flask:
             if Path(filename).suffix.lower() not in ALLOWED_EXTENSIONS:
                 continue
             
-            # Read file content for hash
-            content = file.read()
-            file.seek(0)  # Reset for saving
+            # The hashes were computed while the body was written to disk
+            content_hash, digest = file.stream.hexdigests()
             
             # Check for duplicates
-            if check_duplicates:
-                content_hash = _get_content_hash(content)
-                if content_hash in existing_hashes:
-                    duplicates.append({
-                        "filename": filename,
-                        "existingFile": existing_hashes[content_hash]
-                    })
-                    continue
+            if check_duplicates and content_hash in existing_hashes:
+                duplicates.append({
+                    "filename": filename,
+                    "existingFile": existing_hashes[content_hash]
+                })
+                continue
             
             safe_name = _next_available_name(folder, filename)
             file_path = folder / safe_name
-            file.save(file_path)
+            file.stream.commit(file_path)
+            indexed.append((file_path, digest))
             
             # Store hash for future duplicate detection
-            if check_duplicates:
-                content_hash = _get_content_hash(content)
-                _set_file_hash(folder, safe_name, content_hash)
-                existing_hashes[content_hash] = safe_name
-            
-            # Generate thumbnail for images
-            if file_path.suffix.lower() in IMAGE_EXTENSIONS:
-                _generate_thumbnail(file_path, thumbs_dir)
+            hashes[safe_name] = content_hash
+            existing_hashes[content_hash] = safe_name
             
             saved.append(safe_name)
         
+        _index_files(folder, indexed)
+        if hashes:
+            _set_file_hashes(folder, hashes)
+        if saved:
+            _publish(folder.name, "media.added", names=saved)
+        
         response_data = {"saved": saved}
         if duplicates:
             response_data["duplicates"] = duplicates
+        # Thumbnails are generated in the background once the files are on disk
+        thumbnail_job = _enqueue_thumbnails(folder, [folder / name for name in saved])
+        if thumbnail_job:
+            response_data["thumbnailJob"] = thumbnail_job
         
         return jsonify(response_data), 201
 
+    # ============ Resumable Uploads ============
+    def _upload_location(folder: Path, upload_id: str) -> str:
+        return f"/api/projects/{quote(folder.name)}/uploads/{upload_id}"
+
+    def _upload_int_header(name: str) -> int:
+        try:
+            value = int(request.headers.get(name, ""))
+        except ValueError:
+            abort(400, description=f"{name} header is required")
+        if value < 0:
+            abort(400, description=f"Invalid {name} header")
+        return value
+
+    @app.post("/api/projects/<project_name>/uploads")
+    def create_upload(project_name: str):
+        """Start a resumable upload (tus creation): returns its URL in Location."""
+        folder = _project_path(project_name)
+        if not folder.exists():
+            abort(404, description="Project not found")
+        length = _upload_int_header("Upload-Length")
+        metadata = parse_upload_metadata(request.headers.get("Upload-Metadata", ""))
+        filename = secure_filename(metadata.get("filename", ""))
+        if not filename:
+            abort(400, description="Upload-Metadata must include a filename")
+        if Path(filename).suffix.lower() not in ALLOWED_EXTENSIONS:
+            abort(400, description="Unsupported file type")
+        
+        upload_id = resumable_uploads.create(folder, filename, length)
+        response = Response(status=201)
+        response.headers["Location"] = _upload_location(folder, upload_id)
+        response.headers["Tus-Resumable"] = TUS_VERSION
+        return response
+
+    @app.get("/api/projects/<project_name>/uploads/<upload_id>")
+    def get_upload(project_name: str, upload_id: str):
+        """Report how much of a resumable upload has arrived (HEAD works too)."""
+        folder = _project_path(project_name)
+        upload = resumable_uploads.get(folder, upload_id)
+        if upload is None:
+            abort(404, description="Upload not found")
+        response = jsonify({
+            "filename": upload["filename"],
+            "offset": upload["offset"],
+            "length": upload["length"],
+        })
+        response.headers["Upload-Offset"] = str(upload["offset"])
+        response.headers["Upload-Length"] = str(upload["length"])
+        response.headers["Tus-Resumable"] = TUS_VERSION
+        response.headers["Cache-Control"] = "no-store"
+        return response
+
+    @app.patch("/api/projects/<project_name>/uploads/<upload_id>")
+    def append_upload(project_name: str, upload_id: str):
+        """Append a chunk at Upload-Offset; the file is saved once every byte has arrived."""
+        folder = _project_path(project_name)
+        if request.mimetype != "application/offset+octet-stream":
+            abort(415, description="Content-Type must be application/offset+octet-stream")
+        offset = _upload_int_header("Upload-Offset")
+        try:
+            with resumable_uploads.lock(folder, upload_id) as upload:
+                if upload is None:
+                    abort(404, description="Upload not found")
+                if offset != upload["offset"]:
+                    abort(409, description=f"Upload is at offset {upload['offset']}")
+                offset = resumable_uploads.append(folder, upload_id, upload, request.stream)
+                if offset < upload["length"]:
+                    response = Response(status=204)
+                else:
+                    safe_name = _next_available_name(folder, upload["filename"])
+                    file_path = folder / safe_name
+                    content_hash, digest = resumable_uploads.finish(folder, upload_id, file_path)
+                    _index_file(folder, file_path, digest)
+                    _set_file_hashes(folder, {safe_name: content_hash})
+                    _publish(folder.name, "media.added", names=[safe_name])
+                    response_data = {"saved": [safe_name]}
+                    thumbnail_job = _enqueue_thumbnails(folder, [file_path])
+                    if thumbnail_job:
+                        response_data["thumbnailJob"] = thumbnail_job
+                    response = jsonify(response_data)
+        except UploadBusyError:
+            abort(423, description="Another request is writing to this upload")
+        response.headers["Upload-Offset"] = str(offset)
+        response.headers["Tus-Resumable"] = TUS_VERSION
+        return response
+
+    @app.delete("/api/projects/<project_name>/uploads/<upload_id>")
+    def delete_upload(project_name: str, upload_id: str):
+        """Abandon a resumable upload and discard what has arrived so far."""
+        folder = _project_path(project_name)
+        if not resumable_uploads.delete(folder, upload_id):
+            abort(404, description="Upload not found")
+        response = Response(status=204)
+        response.headers["Tus-Resumable"] = TUS_VERSION
+        return response
+
+    def _find_fingerprint(folder: Path, size: int, fingerprint: str) -> Optional[str]:
+        """Find a file with this size and sampled fingerprint, fingerprinting candidates on demand."""
+        match = None
+        computed = {}
+        for name, known in media_index.files_of_size(folder.name, size):
+            if known is None:
+                try:
+                    known = computed[name] = file_fingerprint(folder / name)
+                except OSError:
+                    continue
+            if known == fingerprint:
+                match = name
+                break
+        if computed:
+            media_index.store_fingerprints(folder.name, computed)
+        return match
+
+    def _check_duplicate_hashes(folder: Path):
+        """Answer a hash-first duplicate check from the index, without any file bodies.
+
+        Each entry is ``{filename, size, hash}`` with the file's full MD5, or
+        ``{filename, size, fingerprint}`` with its sampled fingerprint.
+        """
+        payload = request.get_json(silent=True) or {}
+        entries = payload.get("files")
+        if not isinstance(entries, list):
+            abort(400, description="files must be a list")
+        
+        _refresh_index(folder)
+        duplicates = []
+        new_files = []
+        for entry in entries:
+            if not isinstance(entry, dict) or not isinstance(entry.get("filename"), str):
+                abort(400, description="Each file needs a filename")
+            size = entry.get("size")
+            existing = None
+            if isinstance(entry.get("hash"), str):
+                existing = media_index.find_hash(folder.name, entry["hash"].lower())
+            elif isinstance(entry.get("fingerprint"), str) and isinstance(size, int):
+                existing = _find_fingerprint(folder, size, entry["fingerprint"].lower())
+            
+            if existing:
+                duplicates.append({"filename": entry["filename"], "existingFile": existing})
+            else:
+                new_files.append({"filename": entry["filename"]})
+        
+        return jsonify({
+            "duplicates": duplicates,
+            "newFiles": new_files
+        })
+
     @app.post("/api/projects/<project_name>/check-duplicates")
     def check_duplicates(project_name: str):
         """Check if files would be duplicates before uploading."""
         folder = _project_path(project_name)
         if not folder.exists():
             abort(404, description="Project not found")
+        if request.is_json:
+            return _check_duplicate_hashes(folder)
         if "files" not in request.files:
             abort(400, description="No files provided")
         
@@ -629,10 +1985,72 @@ def create_app() -> Flask:
         order = payload.get("order")
         if not isinstance(order, list):
             abort(400, description="Order must be a list")
-        current_files = {file.name for file in _list_media_files(folder, "all")}
+        expected_version = _ranking_precondition()
+        _refresh_index(folder)
+        current_files = set(media_index.file_names(folder.name))
         cleaned_order = [name for name in order if name in current_files]
-        _save_rankings(folder, cleaned_order)
-        return jsonify({"order": cleaned_order})
+        try:
+            keys, version = media_meta.set_order(folder, cleaned_order, expected_version)
+        except RankingConflict:
+            abort(412, description="Rankings have changed; reload and try again")
+        media_index.store_rankings(folder.name, keys)
+        media_index.store_signatures(folder.name, ranking_mtime=version)
+        _publish(folder.name, "rank.replaced", rankingVersion=version)
+        return _ranking_response({"order": list(keys)}, version)
+
+    @app.post("/api/projects/<project_name>/rank/move")
+    def move_ranking(project_name: str):
+        """Move one file directly before or after another in the ranking.
+
+        Only the moved file gets a new rank key. When the reference file is
+        not ranked yet, the unranked files listed up to and including it are
+        ranked first, in listing order, just as the gallery shows them.
+        """
+        folder = _project_path(project_name)
+        if not folder.exists():
+            abort(404, description="Project not found")
+        payload = request.get_json(silent=True) or {}
+        name = payload.get("name")
+        before = payload.get("before")
+        after = payload.get("after")
+        if not isinstance(name, str) or not name:
+            abort(400, description="name is required")
+        if before is not None and after is not None:
+            abort(400, description="Give either before or after, not both")
+        reference = before if before is not None else after
+        if reference is not None and not isinstance(reference, str):
+            abort(400, description="before and after must be file names")
+        if reference == name:
+            abort(400, description="A file cannot be moved relative to itself")
+        type_filter = {"photos": "image", "videos": "video"}.get(payload.get("media"))
+        expected_version = _ranking_precondition()
+        
+        _refresh_index(folder)
+        current_files = media_index.existing_names(folder.name, [name, reference])
+        if name not in current_files:
+            abort(404, description="File not found")
+        if reference is not None and reference not in current_files:
+            abort(404, description="Reference file not found")
+        append = []
+        if reference is not None:
+            append = media_index.unranked_names_through(folder.name, reference, type_filter)
+        try:
+            keys, version = media_meta.move(
+                folder, name, before=before, after=after, append=append,
+                expected_version=expected_version,
+            )
+        except RankingConflict:
+            abort(412, description="Rankings have changed; reload and try again")
+        except LookupError:
+            abort(409, description="Reference file is not ranked")
+        media_index.move_ranks(folder.name, keys)
+        media_index.store_signatures(folder.name, ranking_mtime=version)
+        rank = media_index.rank_position(folder.name, name)
+        _publish(
+            folder.name, "rank.moved", name=name, before=before, after=after,
+            ranked=append, rank=rank, rankingVersion=version,
+        )
+        return _ranking_response({"name": name, "rank": rank}, version)
 
     @app.delete("/api/projects/<project_name>/rankings")
     def clear_rankings(project_name: str):
@@ -640,7 +2058,180 @@ def create_app() -> Flask:
         folder = _project_path(project_name)
         if not folder.exists():
             abort(404, description="Project not found")
-        _save_rankings(folder, [])
+        try:
+            _, version = media_meta.set_order(folder, [], _ranking_precondition())
+        except RankingConflict:
+            abort(412, description="Rankings have changed; reload and try again")
+        media_index.store_rankings(folder.name, {})
+        media_index.store_signatures(folder.name, ranking_mtime=version)
+        _publish(folder.name, "rank.replaced", rankingVersion=version)
+        return _ranking_response({"cleared": True}, version)
+
+    # ============ Comparison Sessions ============
+    # The server drives the comparison (see comparison.py) and keeps the
+    # session in the project, so it can be resumed from any device.
+
+    @app.post("/api/projects/<project_name>/compare")
+    def start_comparison(project_name: str):
+        """Start a comparison session, replacing any unfinished one.
+
+        ``scope`` is ``all`` to rank every file from scratch, or
+        ``unranked`` to place only unranked files into the existing ranking.
+        ``media`` restricts the session to photos or videos.
+        """
+        folder = _project_path(project_name)
+        if not folder.exists():
+            abort(404, description="Project not found")
+        payload = request.get_json(silent=True) or {}
+        scope = payload.get("scope", "all")
+        if scope not in SCOPES:
+            abort(400, description=f"scope must be one of {', '.join(SCOPES)}")
+        media = payload.get("media", "all")
+        if media not in ("all", "photos", "videos"):
+            abort(400, description="media must be all, photos or videos")
+        type_filter = {"photos": "image", "videos": "video"}.get(media)
+        _refresh_index(folder)
+        ranked, unranked = media_index.comparison_items(folder.name, type_filter)
+        if len(ranked) + len(unranked) < 2:
+            abort(400, description="Need at least 2 items to compare")
+        if scope == "unranked":
+            if not unranked:
+                abort(400, description="Need at least 1 unranked item to compare")
+            session = media_meta.start_comparison(folder, scope, media, ranked, unranked)
+        else:
+            session = media_meta.start_comparison(folder, scope, media, [], ranked + unranked)
+        return jsonify(_comparison_payload(folder, session)), 201
+
+    @app.get("/api/projects/<project_name>/compare")
+    @app.get("/api/projects/<project_name>/compare/next")
+    def get_comparison(project_name: str):
+        """The project's comparison session and the next question to answer."""
+        folder = _project_path(project_name)
+        if not folder.exists():
+            abort(404, description="Project not found")
+        session = media_meta.comparison(folder)
+        if session is None:
+            abort(404, description="No comparison in progress")
+        return jsonify(_comparison_payload(folder, session))
+
+    @app.post("/api/projects/<project_name>/compare/answer")
+    def answer_comparison(project_name: str):
+        """Answer the question at ``step``: ``left``, ``right`` or ``tie``."""
+        folder = _project_path(project_name)
+        if not folder.exists():
+            abort(404, description="Project not found")
+        payload = request.get_json(silent=True) or {}
+        step = payload.get("step")
+        winner = payload.get("winner")
+        if not isinstance(step, int) or isinstance(step, bool):
+            abort(400, description="step must be an integer")
+        if winner not in ANSWERS:
+            abort(400, description=f"winner must be one of {', '.join(ANSWERS)}")
+        try:
+            session = media_meta.answer_comparison(folder, step, winner, _voter(payload))
+        except ComparisonConflict:
+            abort(409, description="That question was already answered")
+        except LookupError:
+            abort(404, description="No comparison question to answer")
+        _publish(folder.name, "ratings.changed")
+        return jsonify(_comparison_payload(folder, session))
+
+    @app.post("/api/projects/<project_name>/compare/finish")
+    def finish_comparison(project_name: str):
+        """Write the session's order into the ranking and end the session.
+
+        A session can be finished early: the files placed so far are ranked.
+        """
+        folder = _project_path(project_name)
+        if not folder.exists():
+            abort(404, description="Project not found")
+        expected_version = _ranking_precondition()
+        _refresh_index(folder)
+        try:
+            keys, version = media_meta.finish_comparison(
+                folder, media_index.file_names(folder.name), expected_version
+            )
+        except RankingConflict:
+            abort(412, description="Rankings have changed; reload and try again")
+        except LookupError:
+            abort(404, description="No comparison in progress")
+        media_index.store_rankings(folder.name, keys)
+        media_index.store_signatures(folder.name, ranking_mtime=version)
+        _publish(folder.name, "rank.replaced", rankingVersion=version)
+        return _ranking_response({"order": list(keys)}, version)
+
+    @app.delete("/api/projects/<project_name>/compare")
+    def discard_comparison(project_name: str):
+        """End the session without changing the ranking."""
+        folder = _project_path(project_name)
+        if not folder.exists():
+            abort(404, description="Project not found")
+        if not media_meta.discard_comparison(folder):
+            abort(404, description="No comparison in progress")
+        return jsonify({"discarded": True})
+
+    # ============ Votes and Ratings ============
+    # Everyone's pairwise answers go into one log per project. Ratings fitted
+    # to it (see rating.py) are listed with each file and sortable as "rating".
+
+    @app.post("/api/projects/<project_name>/votes")
+    def add_vote(project_name: str):
+        """Record one vote: ``winner`` is ``left``, ``right`` or ``tie``."""
+        folder = _project_path(project_name)
+        if not folder.exists():
+            abort(404, description="Project not found")
+        payload = request.get_json(silent=True) or {}
+        left = payload.get("left")
+        right = payload.get("right")
+        winner = payload.get("winner")
+        if not isinstance(left, str) or not isinstance(right, str) or not left or not right:
+            abort(400, description="left and right must be file names")
+        if left == right:
+            abort(400, description="A file cannot be compared with itself")
+        if winner not in OUTCOMES:
+            abort(400, description=f"winner must be one of {', '.join(OUTCOMES)}")
+        voter = _voter(payload)
+        _refresh_index(folder)
+        if len(media_index.existing_names(folder.name, [left, right])) < 2:
+            abort(404, description="File not found")
+        version = media_meta.add_vote(folder, left, right, winner, voter)
+        _publish(folder.name, "ratings.changed")
+        return jsonify({"recorded": True, "version": version}), 201
+
+    @app.get("/api/projects/<project_name>/votes/next")
+    def next_vote(project_name: str):
+        """The pair whose vote would tell the rating model most, with the vote totals."""
+        folder = _project_path(project_name)
+        if not folder.exists():
+            abort(404, description="Project not found")
+        type_filter = {"photos": "image", "videos": "video"}.get(request.args.get("media"))
+        _refresh_index(folder)
+        ratings = {
+            name: rating or unrated()
+            for name, rating in media_index.ratings(folder.name, type_filter).items()
+        }
+        pair = next_pair(ratings)
+        if pair is None:
+            abort(400, description="Need at least 2 items to compare")
+        rows = media_index.media_rows(folder.name, pair)
+        votes, voters = media_meta.vote_counts(folder)
+        return jsonify({
+            "left": _serialize_row(rows[pair[0]], folder.name),
+            "right": _serialize_row(rows[pair[1]], folder.name),
+            "votes": votes,
+            "voters": voters,
+        })
+
+    @app.delete("/api/projects/<project_name>/votes")
+    def clear_votes(project_name: str):
+        """Forget every vote, and with them the ratings."""
+        folder = _project_path(project_name)
+        if not folder.exists():
+            abort(404, description="Project not found")
+        version = media_meta.clear_votes(folder)
+        media_index.store_ratings(folder.name, {})
+        media_index.store_signatures(folder.name, votes_mtime=version)
+        _publish(folder.name, "ratings.changed")
         return jsonify({"cleared": True})
 
     @app.get("/api/projects/<project_name>/files/<path:filename>")
@@ -653,7 +2244,12 @@ def create_app() -> Flask:
             abort(400, description="Invalid file path")
         if not file_path.exists():
             abort(404, description="File not found")
-        return send_from_directory(folder, filename)
+        if sendfile_mode:
+            return _send_file(folder, filename)
+        # The content digest, once known, makes a strong validator
+        stat = file_path.stat()
+        digest = media_index.file_digest(folder.name, filename, stat.st_size, stat.st_mtime)
+        return _send_file(folder, filename, etag=digest or True)
 
     @app.get("/api/projects/<project_name>/thumbs/<path:filename>")
     def serve_thumbnail(project_name: str, filename: str):
@@ -667,7 +2263,159 @@ def create_app() -> Flask:
             abort(400, description="Invalid file path")
         if not file_path.exists():
             abort(404, description="Thumbnail not found")
-        return send_from_directory(thumbs_dir, filename)
+        return _send_file(thumbs_dir, filename)
+
+    @app.get("/api/projects/<project_name>/thumbs/v/<version>/<filename>")
+    def serve_versioned_thumbnail(project_name: str, version: str, filename: str):
+        """Serve a thumbnail rendition by content version, cacheable forever.
+
+        A version that no longer matches the renditions on disk (a listing
+        fetched just before they were regenerated) still gets the current
+        file, but without the immutable cache policy.
+        """
+        response = serve_thumbnail(project_name, filename)
+        folder = _project_path(project_name)
+        if rendition_version(folder / THUMBS_DIR_NAME, filename) == version:
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        return response
+
+    # ============ Sprite Sheets ============
+    # A page of the gallery can fetch its thumbnails as one image. Sheets are
+    # cached under a digest of their members' renditions, so a change to the
+    # page or to any of its thumbnails gives a sheet under a new name, and
+    # names can be cached as immutable. A page without a cached sheet is
+    # answered at once without one, and its sheet is built in the background
+    # on a thread of its own, never queued behind thumbnail work, for the
+    # next time the page is loaded.
+
+    def _sprite_sheet(folder: Path, names: List[str], size: int) -> Optional[Dict]:
+        """The cached sprite sheet of the ``size`` renditions of ``names``.
+
+        Returns the sheet's URL, its size and where each file is on it, or
+        None when it is not built yet; it is then queued to be built.
+        """
+        thumbs_dir = folder / THUMBS_DIR_NAME
+        digest = hashlib.sha256(f"{size}\n".encode())
+        for name in names:
+            try:
+                stat = os.stat(thumbs_dir / thumbnail_name(name, size))
+            except OSError:
+                continue
+            digest.update(f"{name}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+        sheet_name = f"{digest.hexdigest()[:32]}.webp"
+        sheet_path = sprites_dir / f"{_project_key(folder.name)}-{sheet_name}"
+        map_path = sheet_path.with_suffix(".json")
+        try:
+            sheet = json.loads(map_path.read_text())
+            # Recently used sheets are the last to be pruned
+            os.utime(map_path)
+            return sheet
+        except (OSError, ValueError):
+            pass
+        with sprite_builds_lock:
+            if sheet_name in sprite_builds:
+                return None
+            sprite_builds.add(sheet_name)
+        sprite_pool.submit(_build_sprite_sheet, folder, names, size, sheet_name)
+        return None
+
+    def _build_sprite_sheet(folder: Path, names: List[str], size: int, sheet_name: str) -> None:
+        """Build a sheet queued by ``_sprite_sheet`` and write its map next to it."""
+        sheet_path = sprites_dir / f"{_project_key(folder.name)}-{sheet_name}"
+        map_path = sheet_path.with_suffix(".json")
+        try:
+            built = build_sprite_sheet(folder / THUMBS_DIR_NAME, names, size, sheet_path, SPRITE_COLUMNS)
+        except Exception as e:
+            print(f"Failed to build sprite sheet for {folder.name}: {e}")
+            built = None
+        finally:
+            with sprite_builds_lock:
+                sprite_builds.discard(sheet_name)
+        if built is None:
+            return
+        (width, height), places = built
+        sheet = {
+            "sheet": f"/api/projects/{folder.name}/sprites/{sheet_name}",
+            "width": width,
+            "height": height,
+            "places": places,
+        }
+        tmp_path = map_path.with_name(f".{map_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(json.dumps(sheet))
+        os.replace(tmp_path, map_path)
+        _remove_sprites(folder.name, keep=MAX_PROJECT_SPRITES)
+
+    def _remove_sprites(project: str, keep: int = 0) -> None:
+        """Delete a project's cached sprite sheets, except the ``keep`` most recently used."""
+        maps = sorted(
+            sprites_dir.glob(f"{_project_key(project)}-*.json"),
+            key=lambda path: path.stat().st_mtime if path.exists() else 0,
+            reverse=True,
+        )
+        for stale in maps[keep:]:
+            stale.unlink(missing_ok=True)
+            stale.with_suffix(".webp").unlink(missing_ok=True)
+
+    @app.get("/api/projects/<project_name>/sprites")
+    def get_sprites(project_name: str):
+        """Sprite sheet of the thumbnails on one page of the media listing.
+
+        Takes the listing's query parameters, with pages of at most
+        MAX_SPRITE_ITEMS files, and ``size``, the rendition to build the
+        sheet from. Each file with that rendition is listed with its place
+        on the sheet and the URL of the rendition itself, which tells the
+        client whether the sheet still shows its current thumbnail. A page
+        whose sheet is not built yet gets ``sheet: null`` and no items.
+        """
+        folder = _project_path(project_name)
+        if not folder.exists():
+            abort(404, description="Project not found")
+        try:
+            size = int(request.args.get("size", DEFAULT_SPRITE_SIZE))
+        except ValueError:
+            abort(400, description="size must be an integer")
+        if size not in SPRITE_SIZES:
+            abort(400, description=f"size must be one of {', '.join(map(str, SPRITE_SIZES))}")
+        args = _listing_args()
+        args["limit"] = min(args["limit"] or MAX_SPRITE_ITEMS, MAX_SPRITE_ITEMS)
+        items, next_cursor, _ = _query_media_page([folder], **args)
+        members = {
+            item["name"]: item["thumbUrls"][str(size)]
+            for item in items if str(size) in item.get("thumbUrls", {})
+        }
+        with _timed("sprites"):
+            sheet = _sprite_sheet(folder, list(members), size) if members else None
+        return jsonify({
+            "size": size,
+            "sheet": sheet["sheet"] if sheet else None,
+            "width": sheet["width"] if sheet else 0,
+            "height": sheet["height"] if sheet else 0,
+            "items": {
+                name: {"x": x, "y": y, "width": w, "height": h, "thumbUrl": members[name]}
+                for name, (x, y, w, h) in (sheet["places"].items() if sheet else ())
+                if name in members
+            },
+            "nextCursor": next_cursor,
+        })
+
+    @app.get("/api/projects/<project_name>/sprites/<sheet_name>")
+    def serve_sprite_sheet(project_name: str, sheet_name: str):
+        """Serve a sprite sheet. Its name is a digest of its content, so it is cacheable forever."""
+        folder = _project_path(project_name)
+        if not re.fullmatch(r"[0-9a-f]{32}\.webp", sheet_name):
+            abort(404, description="Sprite sheet not found")
+        filename = f"{_project_key(folder.name)}-{sheet_name}"
+        if not (sprites_dir / filename).is_file():
+            abort(404, description="Sprite sheet not found")
+        response = _send_file(sprites_dir, filename)
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+        return response
 
     @app.get("/api/projects/<project_name>/files/<path:filename>/exif")
     def get_file_exif(project_name: str, filename: str):
@@ -681,13 +2429,28 @@ def create_app() -> Flask:
         if not file_path.exists():
             abort(404, description="File not found")
         
-        exif_data = _extract_exif(file_path)
-        file_info = _get_file_info(file_path)
-        
+        _refresh_index(folder)
+        row = media_index.exif_rows(folder.name, [filename]).get(filename)
+        if row is None:
+            abort(404, description="File not found")
+        return jsonify({"filename": filename, **_exif_payload(folder, row)})
+
+    @app.get("/api/projects/<project_name>/exif")
+    def get_exif_batch(project_name: str):
+        """EXIF and file info for a window of files named by repeated ``name`` params."""
+        folder = _project_path(project_name)
+        if not folder.exists():
+            abort(404, description="Project not found")
+        names = request.args.getlist("name")
+        if not names:
+            abort(400, description="At least one name is required")
+        if len(names) > MAX_EXIF_BATCH:
+            abort(400, description=f"At most {MAX_EXIF_BATCH} names per request")
+        _refresh_index(folder)
+        rows = media_index.exif_rows(folder.name, names)
         return jsonify({
-            "filename": filename,
-            "exif": exif_data,
-            "fileInfo": file_info
+            "files": {name: _exif_payload(folder, row) for name, row in rows.items()},
+            "missing": [name for name in names if name not in rows],
         })
 
     @app.get("/api/projects/<project_name>/files/<path:filename>/download")
@@ -701,11 +2464,16 @@ def create_app() -> Flask:
             abort(400, description="Invalid file path")
         if not file_path.exists():
             abort(404, description="File not found")
-        return send_from_directory(folder, filename, as_attachment=True)
+        return _send_file(folder, filename, as_attachment=True)
 
     @app.get("/api/projects/<project_name>/download")
     def download_project(project_name: str):
-        """Download all media files in a project as a ZIP archive."""
+        """Download all media files in a project as a ZIP archive.
+
+        The cached archive is sent when the project's files are unchanged
+        since it was built. Otherwise the ZIP is streamed as it is written,
+        while a background job builds the archive for the next download.
+        """
         folder = _project_path(project_name)
         if not folder.exists():
             abort(404, description="Project not found")
@@ -714,19 +2482,29 @@ def create_app() -> Flask:
         if not media_files:
             abort(400, description="No media files to download")
         
-        # Create ZIP in memory
-        buffer = BytesIO()
-        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for file_path in media_files:
-                zf.write(file_path, file_path.name)
-        buffer.seek(0)
-        
-        return send_file(
-            buffer,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=f"{project_name}.zip"
-        )
+        archive = _archive_path(folder, media_files)
+        if not archive.exists():
+            job_runner.submit("archive", folder.name, {})
+            return _attachment_response(
+                stream_with_context(_iter_zip_stream(media_files)),
+                "application/zip",
+                f"{folder.name}.zip",
+            )
+        return _send_file(archives_dir, archive.name, as_attachment=True, download_name=f"{folder.name}.zip")
+
+    @app.post("/api/projects/<project_name>/archive")
+    def build_project_archive(project_name: str):
+        """Build a project's ZIP archive ahead of downloading it, unless the current one is cached."""
+        folder = _project_path(project_name)
+        if not folder.exists():
+            abort(404, description="Project not found")
+        media_files = _list_media_files(folder, "all")
+        if not media_files:
+            abort(400, description="No media files to download")
+        download = f"/api/projects/{quote(folder.name)}/download"
+        if _archive_path(folder, media_files).exists():
+            return jsonify({"job": None, "download": download})
+        return _job_response(job_runner.submit("archive", folder.name, {}), download=download)
 
     @app.post("/api/projects/<project_name>/download-selected")
     def download_selected(project_name: str):
@@ -741,20 +2519,16 @@ def create_app() -> Flask:
         if not filenames:
             abort(400, description="No files specified")
         
-        # Create ZIP in memory
-        buffer = BytesIO()
-        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for filename in filenames:
-                file_path = (folder / filename).resolve()
-                if folder in file_path.parents and file_path.exists():
-                    zf.write(file_path, file_path.name)
-        buffer.seek(0)
+        selected = []
+        for filename in filenames:
+            file_path = (folder / filename).resolve()
+            if folder in file_path.parents and file_path.exists():
+                selected.append(file_path)
         
-        return send_file(
-            buffer,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=f"{project_name}_selected.zip"
+        return _attachment_response(
+            stream_with_context(_iter_zip_stream(selected)),
+            "application/zip",
+            f"{project_name}_selected.zip",
         )
 
     @app.put("/api/projects/<project_name>/media/<path:filename>/tags")
@@ -777,6 +2551,7 @@ def create_app() -> Flask:
             tag.strip().lower() for tag in tags if isinstance(tag, str) and tag.strip()
         ))
         _set_media_tags(folder, filename, clean_tags)
+        _publish(folder.name, "tags.changed", updated=[{"name": filename, "tags": clean_tags}])
         return jsonify({"name": filename, "tags": clean_tags})
 
     @app.put("/api/projects/<project_name>/media/<path:filename>/comment")
@@ -793,6 +2568,7 @@ def create_app() -> Flask:
         payload = request.get_json(silent=True) or {}
         comment = str(payload.get("comment", "") or "").strip()
         _set_media_comment(folder, filename, comment)
+        _publish(folder.name, "comment.changed", name=filename, comment=comment)
         return jsonify({"name": filename, "comment": comment})
 
     @app.post("/api/projects/<project_name>/batch-tags")
@@ -810,38 +2586,24 @@ def create_app() -> Flask:
         if not filenames:
             abort(400, description="No files specified")
         
-        media_meta = _load_media_meta(folder)
-        updated = []
-        
+        names = []
         for filename in filenames:
             file_path = (folder / filename).resolve()
             if folder not in file_path.parents or not file_path.exists():
                 continue
-            
-            if filename not in media_meta:
-                media_meta[filename] = {}
-            
-            current_tags = set(media_meta[filename].get("tags", []))
-            
-            # Add new tags
-            for tag in add_tags:
-                if isinstance(tag, str) and tag.strip():
-                    current_tags.add(tag.strip().lower())
-            
-            # Remove tags
-            for tag in remove_tags:
-                if isinstance(tag, str):
-                    current_tags.discard(tag.strip().lower())
-            
-            media_meta[filename]["tags"] = list(current_tags)
-            updated.append({"name": filename, "tags": list(current_tags)})
-        
-        _save_media_meta(folder, media_meta)
+            names.append(filename)
+        
+        add = [tag.strip().lower() for tag in add_tags if isinstance(tag, str) and tag.strip()]
+        remove = [tag.strip().lower() for tag in remove_tags if isinstance(tag, str)]
+        records, revision = media_meta.edit_tags(folder, names, add, remove)
+        _apply_media_meta(folder, records, revision)
+        updated = [{"name": name, "tags": record["tags"]} for name, record in records.items()]
+        _publish(folder.name, "tags.changed", updated=updated)
         return jsonify({"updated": updated})
 
     @app.delete("/api/projects/<project_name>/batch-delete")
     def batch_delete_files(project_name: str):
-        """Batch delete multiple media files."""
+        """Batch delete multiple media files, as a background job."""
         folder = _project_path(project_name)
         if not folder.exists():
             abort(404, description="Project not found")
@@ -851,39 +2613,33 @@ def create_app() -> Flask:
         
         if not filenames:
             abort(400, description="No files specified")
+        if not isinstance(filenames, list) or not all(isinstance(name, str) for name in filenames):
+            abort(400, description="files must be a list of file names")
         
-        deleted = []
-        media_meta = _load_media_meta(folder)
-        rankings = _load_rankings(folder)
-        thumbs_dir = folder / THUMBS_DIR_NAME
-        
-        for filename in filenames:
-            file_path = (folder / filename).resolve()
-            if folder not in file_path.parents or not file_path.exists():
-                continue
-            
-            # Delete the file
-            file_path.unlink()
-            
-            # Delete thumbnail if exists
-            thumb_path = thumbs_dir / f"{file_path.stem}_thumb.webp"
-            if thumb_path.exists():
-                thumb_path.unlink()
-            
-            # Remove from rankings
-            if filename in rankings:
-                rankings.remove(filename)
-            
-            # Remove from media metadata
-            if filename in media_meta:
-                del media_meta[filename]
-            
-            deleted.append(filename)
-        
-        _save_rankings(folder, rankings)
-        _save_media_meta(folder, media_meta)
-        
-        return jsonify({"deleted": deleted})
+        return _job_response(job_runner.submit("delete", folder.name, {"files": filenames}))
+
+    @app.get("/api/projects/<project_name>/near-duplicates")
+    def get_near_duplicates(project_name: str):
+        """Group images that look nearly identical, such as bursts of the same shot."""
+        folder = _project_path(project_name)
+        if not folder.exists():
+            abort(404, description="Project not found")
+        try:
+            max_distance = int(request.args.get("maxDistance", DEFAULT_MAX_DISTANCE))
+        except ValueError:
+            abort(400, description="maxDistance must be an integer")
+        if not 0 <= max_distance <= MAX_DISTANCE_LIMIT:
+            abort(400, description=f"maxDistance must be between 0 and {MAX_DISTANCE_LIMIT}")
+        
+        _refresh_index(folder)
+        clusters = cluster_pairs(media_index.near_duplicate_pairs(folder.name, max_distance))
+        hashed, unhashed = media_index.phash_coverage(folder.name)
+        return jsonify({
+            "clusters": [{"files": files} for files in clusters],
+            "maxDistance": max_distance,
+            "hashedImages": hashed,
+            "unhashedImages": unhashed,
+        })
 
     @app.get("/api/projects/<project_name>/tags")
     def get_project_tags(project_name: str):
@@ -891,11 +2647,7 @@ def create_app() -> Flask:
         folder = _project_path(project_name)
         if not folder.exists():
             abort(404, description="Project not found")
-        media_meta = _load_media_meta(folder)
-        all_tags = set()
-        for file_meta in media_meta.values():
-            all_tags.update(file_meta.get("tags", []))
-        return jsonify({"tags": sorted(all_tags)})
+        return jsonify({"tags": media_meta.tags(folder)})
 
     @app.get("/api/projects/<project_name>/export")
     def export_project_data(project_name: str):
@@ -945,7 +2697,12 @@ def create_app() -> Flask:
         folder = _project_path(project_name)
         if not folder.exists():
             abort(404, description="Project not found")
+        media_meta.close(folder)
         shutil.rmtree(folder)
+        media_index.drop_project(folder.name)
+        _remove_archives(folder.name)
+        _remove_sprites(folder.name)
+        _publish(folder.name, "project.deleted")
         return jsonify({"deleted": project_name}), 200
 
     @app.delete("/api/projects/<project_name>/files/<path:filename>")
@@ -962,30 +2719,27 @@ def create_app() -> Flask:
         
         # Delete the file
         file_path.unlink()
+        media_index.remove_files(folder.name, [filename])
         
-        # Delete thumbnail if exists
-        thumbs_dir = folder / THUMBS_DIR_NAME
-        thumb_path = thumbs_dir / f"{file_path.stem}_thumb.webp"
-        if thumb_path.exists():
-            thumb_path.unlink()
+        # Delete thumbnails if they exist
+        _remove_thumbnails(folder, file_path.name)
         
         # Remove from rankings if present
-        rankings = _load_rankings(folder)
-        if filename in rankings:
-            rankings.remove(filename)
-            _save_rankings(folder, rankings)
+        version = _unrank_files(folder, [filename])
         
         # Remove from media metadata if present
-        media_meta = _load_media_meta(folder)
-        if filename in media_meta:
-            del media_meta[filename]
-            _save_media_meta(folder, media_meta)
+        _remove_media_meta(folder, [filename])
+        _publish(folder.name, "media.deleted", names=[filename], rankingVersion=version)
         
         return jsonify({"deleted": filename}), 200
 
     @app.post("/api/projects/<project_name>/generate-thumbnails")
     def generate_project_thumbnails(project_name: str):
-        """Generate thumbnails for all images in a project."""
+        """Queue thumbnail generation for images whose thumbnail is missing or stale.
+
+        The project is scanned by the job itself, which also hashes images
+        with current thumbnails that lack a perceptual hash.
+        """
         folder = _project_path(project_name)
         if not folder.exists():
             abort(404, description="Project not found")
@@ -993,16 +2747,116 @@ def create_app() -> Flask:
         if not PILLOW_AVAILABLE:
             abort(500, description="Pillow not available for thumbnail generation")
         
-        thumbs_dir = folder / THUMBS_DIR_NAME
-        media_files = _list_media_files(folder, "photos")
-        
-        generated = []
-        for file_path in media_files:
-            thumb_name = _generate_thumbnail(file_path, thumbs_dir)
-            if thumb_name:
-                generated.append(thumb_name)
-        
-        return jsonify({"generated": generated, "count": len(generated)})
+        job_id = job_runner.submit("thumbnails", folder.name, {})
+        response = jsonify({"job": job_id})
+        response.status_code = 202
+        response.headers["Location"] = f"/api/jobs/{job_id}"
+        return response
+
+    @app.get("/api/jobs/<job_id>")
+    def get_job(job_id: str):
+        """Report the progress of a background job."""
+        job = job_store.get(job_id)
+        if job is None:
+            abort(404, description="Job not found")
+        return jsonify(job)
+
+    @app.post("/api/jobs/<job_id>/cancel")
+    def cancel_job(job_id: str):
+        """Cancel a queued job, or ask a running one to stop after its current step."""
+        if job_store.get(job_id) is None:
+            abort(404, description="Job not found")
+        if not job_runner.cancel(job_id):
+            abort(409, description="Only queued or running jobs started by a request can be cancelled")
+        return jsonify(job_store.get(job_id))
+
+    # ============ Change Feed ============
+    # Mutating routes publish what they changed (see events.py). Clients follow
+    # the feed to apply small deltas instead of reloading whole listings.
+
+    def _event_frame(event: dict) -> str:
+        return f"id: {event['seq']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+    @app.get("/api/events")
+    def get_events():
+        """Events after ``since`` (or the Last-Event-ID header), oldest first.
+
+        An ``EventSource`` gets a ``text/event-stream`` that stays open for a
+        while and is then closed, so the browser reconnects from its last
+        event id. Other clients get JSON and may ``wait`` up to
+        MAX_EVENT_WAIT seconds for the first event (long polling). Without
+        ``since`` only newer events are sent. ``project`` limits the feed to
+        one project. When the events after ``since`` are no longer kept, a
+        ``reset`` event (or ``"reset": true``) tells the client to reload.
+        """
+        since = request.args.get("since") or request.headers.get("Last-Event-ID")
+        if since is None:
+            since = event_log.latest()
+        else:
+            try:
+                since = int(since)
+            except ValueError:
+                abort(400, description="since must be an event sequence number")
+            if since < 0:
+                abort(400, description="since must be an event sequence number")
+        project = request.args.get("project") or None
+        reset = event_log.missed(since)
+        if reset:
+            since = event_log.latest()
+
+        if request.accept_mimetypes.best_match(["application/json", EVENT_STREAM_MIMETYPE]) != EVENT_STREAM_MIMETYPE:
+            try:
+                wait = min(max(float(request.args.get("wait", 0)), 0), MAX_EVENT_WAIT)
+            except ValueError:
+                abort(400, description="wait must be a number of seconds")
+            deadline = time.monotonic() + wait
+            seen = since
+            events = event_log.since(since, project, EVENT_BATCH_SIZE)
+            while not events and not reset and time.monotonic() < deadline:
+                newest = event_log.wait(seen, deadline - time.monotonic())
+                if newest <= seen:
+                    break
+                seen = newest
+                events = event_log.since(since, project, EVENT_BATCH_SIZE)
+            response = jsonify({
+                "events": events,
+                "seq": events[-1]["seq"] if events else since,
+                "reset": reset,
+            })
+            response.cache_control.no_store = True
+            return response
+
+        def generate() -> Iterator[str]:
+            cursor = since
+            yield f"retry: {EVENT_RETRY_MS}\n\n"
+            if reset:
+                yield _event_frame({
+                    "seq": cursor, "type": "reset", "project": None, "data": {}, "created": time.time(),
+                })
+            deadline = time.monotonic() + EVENT_STREAM_SECONDS
+            quiet_since = time.monotonic()
+            seen = cursor
+            while time.monotonic() < deadline:
+                events = event_log.since(cursor, project, EVENT_BATCH_SIZE)
+                for event in events:
+                    yield _event_frame(event)
+                if events:
+                    cursor = events[-1]["seq"]
+                    quiet_since = time.monotonic()
+                    continue
+                if time.monotonic() - quiet_since >= EVENT_HEARTBEAT_SECONDS:
+                    # Comments keep proxies from closing an idle stream
+                    yield ": keep-alive\n\n"
+                    quiet_since = time.monotonic()
+                # Sleep until the log grows, however many other streams wait too
+                seen = max(seen, event_log.wait(seen, min(
+                    deadline, quiet_since + EVENT_HEARTBEAT_SECONDS,
+                ) - time.monotonic()))
+
+        response = Response(generate(), mimetype=EVENT_STREAM_MIMETYPE)
+        response.cache_control.no_cache = True
+        response.headers["X-Accel-Buffering"] = "no"
+        return response
 
     @app.post("/api/projects/<project_name>/move-file")
     def move_file_between_projects(project_name: str):
@@ -1033,69 +2887,82 @@ def create_app() -> Flask:
         if target_file.exists():
             abort(400, description="File already exists in target project")
         
-        # Move the file
-        target_file = _next_available_name(target_folder, filename)
-        final_target = target_folder / target_file
-        shutil.move(str(source_file), str(final_target))
-        
-        # Move thumbnail if exists
-        source_thumbs_dir = source_folder / THUMBS_DIR_NAME
-        target_thumbs_dir = target_folder / THUMBS_DIR_NAME
-        thumb_name = f"{source_file.stem}_thumb.webp"
-        source_thumb = source_thumbs_dir / thumb_name
-        if source_thumb.exists():
-            target_thumbs_dir.mkdir(exist_ok=True)
-            target_thumb_name = f"{Path(target_file).stem}_thumb.webp"
-            target_thumb = target_thumbs_dir / target_thumb_name
-            shutil.move(str(source_thumb), str(target_thumb))
-        
-        # Move metadata
-        source_meta = _load_media_meta(source_folder)
-        target_meta = _load_media_meta(target_folder)
-        if filename in source_meta:
-            target_meta[target_file] = source_meta[filename]
-            del source_meta[filename]
-            _save_media_meta(source_folder, source_meta)
-            _save_media_meta(target_folder, target_meta)
-        
-        # Remove from source rankings
-        source_rankings = _load_rankings(source_folder)
-        if filename in source_rankings:
-            source_rankings.remove(filename)
-            _save_rankings(source_folder, source_rankings)
-        
-        return jsonify({"moved": filename, "newName": target_file, "targetProject": target_project})
+        # Moving between file systems copies the file, so it runs as a job
+        return _job_response(job_runner.submit("move", source_folder.name, {
+            "filename": filename, "targetProject": target_folder.name,
+        }))
 
     @app.get("/api/all-media")
     def get_all_media():
-        """Get all media from all projects combined."""
-        media_type = request.args.get("media", "all")
-        if media_type not in ("all", "photos", "videos"):
-            media_type = "all"
-        sort_by = request.args.get("sort", "rank")
-        
-        all_media = []
-        for folder in sorted(project_root.iterdir()):
-            if not folder.is_dir():
-                continue
-            items = _serialize_media(folder, media_type, sort_by)
-            for item in items:
-                item["project"] = folder.name
-                # Update URL to include project name
-                item["url"] = f"/api/projects/{folder.name}/files/{item['name']}"
-                if "thumbUrl" in item:
-                    # thumbUrl already includes the correct path from _serialize_media
-                    # Just ensure it's properly formatted
-                    thumb_name = item["thumbUrl"].split("/")[-1]
-                    item["thumbUrl"] = f"/api/projects/{folder.name}/thumbs/{thumb_name}"
-            all_media.extend(items)
-        
-        return jsonify({
+        """Get all media from all projects combined.
+
+        Items are sorted across projects (rank order lists project by
+        project). ``format=ndjson`` streams every item instead of a page.
+        """
+        args = _listing_args()
+        folders = _project_folders()
+        if request.args.get("format") == "ndjson":
+            return _stream_media(
+                folders, args["media_type"], args["sort_by"], args["query"], args["tags"]
+            )
+        etag = _listing_etag(folders)
+        not_modified = _not_modified(etag)
+        if not_modified:
+            return not_modified
+        all_media, next_cursor, total = _query_media_page(folders, include_project=True, **args)
+        return _listing_response({
             "project": "All Projects",
             "description": "Media from all projects",
             "images": all_media,
-            "mediaType": media_type,
-            "sortBy": sort_by,
+            "mediaType": args["media_type"],
+            "sortBy": args["sort_by"],
+            "nextCursor": next_cursor,
+            "total": total,
+        }, etag)
+
+    # ============ Library Duplicates ============
+    @app.post("/api/duplicates/backfill")
+    def backfill_digests():
+        """Queue content hashing for files across all projects that lack a current digest."""
+        job_id, queued = _enqueue_digests(_project_folders())
+        return jsonify({"job": job_id, "queued": queued}), 202
+
+    @app.get("/api/duplicates")
+    def get_duplicates():
+        """Report identical files stored more than once, the most wasted space first."""
+        cross_project = request.args.get("crossProject", "false").lower() == "true"
+        try:
+            limit = int(request.args.get("limit", DEFAULT_DUPLICATE_GROUPS))
+            offset = int(request.args.get("offset", 0))
+        except ValueError:
+            abort(400, description="limit and offset must be integers")
+        if limit < 1 or offset < 0:
+            abort(400, description="limit must be positive and offset non-negative")
+        limit = min(limit, MAX_PAGE_SIZE)
+        
+        for folder in _project_folders():
+            _refresh_index(folder)
+        groups, summary = media_index.duplicate_groups(cross_project, limit, offset)
+        return jsonify({
+            "groups": [
+                {
+                    "digest": group["digest"],
+                    "size": group["size"],
+                    "files": [
+                        {
+                            "project": project,
+                            "name": name,
+                            "url": f"/api/projects/{project}/files/{name}",
+                        }
+                        for project, name in group["files"]
+                    ],
+                }
+                for group in groups
+            ],
+            "total": summary["groups"],
+            "wastedBytes": summary["wasted_bytes"],
+            "hashedFiles": summary["hashed_files"],
+            "unhashedFiles": summary["unhashed_files"],
         })
 
     # Serve PWA manifest
@@ -1108,6 +2975,133 @@ def create_app() -> Flask:
     def serve_service_worker():
         return send_from_directory(STATIC_DIR, "sw.js")
 
+    # ============ Watched Files ============
+    # Files copied into the project folders from outside the app are found by
+    # the watcher (see watcher.py) and ingested batch by batch.
+
+    def _thumbnails_stale(folder: Path, file_path: Path) -> bool:
+        """Whether any thumbnail rendition of a file is missing or older than the file."""
+        thumbs_dir = folder / THUMBS_DIR_NAME
+        source_mtime = file_path.stat().st_mtime
+        for thumb_name in thumbnail_names(file_path.name).values():
+            try:
+                if (thumbs_dir / thumb_name).stat().st_mtime < source_mtime:
+                    return True
+            except FileNotFoundError:
+                return True
+        return False
+
+    def _ingest_files(folder: Path, names: Iterable[str], hash_files: bool = True) -> None:
+        """Index, thumbnail and hash files that appeared or changed on disk.
+
+        Files the index already holds at their current size and mtime, with a
+        digest, were written by the app itself and are left alone.
+        """
+        project = folder.name
+        names = sorted(names)
+        known = media_index.file_states(project, names)
+        added, updated = [], []
+        for name in names:
+            file_path = folder / name
+            try:
+                stat = file_path.stat()
+            except FileNotFoundError:
+                continue
+            state = known.get(name)
+            if state and state[:2] == (stat.st_size, stat.st_mtime) and state[2]:
+                continue
+            (updated if state else added).append(name)
+        ingested = added + updated
+        _index_files(folder, [(folder / name, None) for name in ingested])
+        if not ingested:
+            return
+        thumbnailed = [
+            folder / name for name in ingested
+            if _media_type_for(name) == "image" and _thumbnails_stale(folder, folder / name)
+        ]
+        _enqueue_thumbnails(folder, thumbnailed)
+        # Thumbnailing reads EXIF too; the rest have it read on its own
+        skip = {file_path.name for file_path in thumbnailed}
+        _enqueue_exif(folder, [
+            name for name in media_index.files_without_exif(project)
+            if name in set(ingested) and name not in skip
+        ])
+        if hash_files:
+            job_runner.submit("digests", project, {"files": ingested})
+        if added:
+            _publish(project, "media.added", names=added)
+        if updated:
+            rows = media_index.media_rows(project, updated)
+            _publish(project, "media.updated", items=[_serialize_row(row, project) for row in rows.values()])
+
+    def _forget_files(folder: Path, names: Iterable[str]) -> None:
+        """Clean up after files removed on disk, unless the app removed them itself."""
+        project = folder.name
+        names = [
+            name for name in media_index.file_states(project, names)
+            if not (folder / name).exists()
+        ]
+        if not names:
+            return
+        media_index.remove_files(project, names)
+        for name in names:
+            _remove_thumbnails(folder, name)
+        version = _unrank_files(folder, names)
+        _remove_media_meta(folder, names)
+        _publish(project, "media.deleted", names=names, rankingVersion=version)
+
+    def _rename_file(folder: Path, old: str, new: str) -> bool:
+        """Carry a file renamed on disk over to its new name; False if it wasn't a plain rename."""
+        project = folder.name
+        if (folder / old).exists() or not (folder / new).exists():
+            return False
+        thumbs_dir = folder / THUMBS_DIR_NAME
+        new_thumb_names = thumbnail_names(new)
+        for size, thumb_name in thumbnail_names(old).items():
+            if (thumbs_dir / thumb_name).exists():
+                (thumbs_dir / thumb_name).replace(thumbs_dir / new_thumb_names[size])
+        media_index.rename_file(project, old, new)
+        _, version = media_meta.rename(folder, old, new)
+        # A rename keeps the size and mtime, so the digest, hashes and EXIF stay
+        _index_file(folder, folder / new)
+        _publish(project, "media.deleted", names=[old], rankingVersion=version)
+        _publish(project, "media.added", names=[new])
+        return True
+
+    def _ingest_changes(project: str, changes: Changes) -> None:
+        folder = project_root / project
+        if not folder.is_dir():
+            return
+        for old, new in changes.renamed.items():
+            if not _rename_file(folder, old, new):
+                changes.remove(old)
+                changes.change(new)
+        _forget_files(folder, changes.removed)
+        _ingest_files(folder, changes.changed)
+
+    def _resync_project(project: str) -> None:
+        """Ingest files that are missing from the index or changed since it last saw them.
+
+        Used when changes may have been missed, such as while no process was
+        watching. Nothing is removed: a folder that is briefly unreadable must
+        not cost its tags and rankings. Content hashing is left to the backfill.
+        """
+        folder = project_root / project
+        if not folder.is_dir():
+            return
+        known = media_index.file_states(project)
+        _ingest_files(folder, [
+            name for name, (_, size, mtime, _) in _scan_media_files(folder).items()
+            if known.get(name, (None, None))[:2] != (size, mtime)
+        ], hash_files=False)
+
+    FolderWatcher(
+        project_root, ALLOWED_EXTENSIONS, _ingest_changes, _resync_project,
+        mode=watch_mode, poll_interval=watch_interval,
+        lock_path=project_root / INDEX_DIR_NAME / WATCHER_LOCK_FILENAME,
+    ).start()
+    job_runner.start()
+
     return app
 
 
@@ -0,0 +1,1175 @@
+"""SQLite-backed index of project media.
+
+The index is a cache of what lives in the project folders: one row per media
+file holding its type, size, timestamps, thumbnail state and placeholder,
+tags, comment, hash, rank and rating, plus per-project signatures (directory
+and thumbnail mtimes, and the metadata store's revision, ranking version and
+vote version) used to decide cheaply whether a folder needs to be rescanned. Every write
+to a project's rows also gives it a new change version, which listings use
+as their ETag.
+
+The database is shared by every worker process, so it runs in WAL mode and
+every mutation is a short transaction.
+"""
+from __future__ import annotations
+
+import heapq
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from itertools import chain, islice
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Support both `python app/main.py` and importing the `app` package
+try:
+    from .exif import capture_time
+    from .similarity import MAX_DISTANCE_LIMIT, chunk_probes, hamming
+except ImportError:
+    from exif import capture_time
+    from similarity import MAX_DISTANCE_LIMIT, chunk_probes, hamming
+
+# Each entry upgrades the schema by one version (tracked in PRAGMA user_version).
+_MIGRATIONS = [
+    """
+    CREATE TABLE projects (
+        name TEXT PRIMARY KEY,
+        dir_mtime INTEGER,
+        thumbs_mtime INTEGER,
+        ranking_mtime INTEGER,
+        meta_mtime INTEGER
+    );
+    CREATE TABLE media (
+        project TEXT NOT NULL,
+        name TEXT NOT NULL,
+        type TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mtime REAL NOT NULL,
+        ctime REAL NOT NULL,
+        has_thumb INTEGER NOT NULL DEFAULT 0,
+        tags TEXT NOT NULL DEFAULT '[]',
+        comment TEXT NOT NULL DEFAULT '',
+        hash TEXT,
+        rank INTEGER,
+        PRIMARY KEY (project, name)
+    );
+    CREATE INDEX media_rank ON media (project, rank);
+    CREATE INDEX media_hash ON media (hash);
+    """,
+    # Paginated listings: a case-insensitive name key, dense 1-based rank
+    # positions (overall and within the item's media type) and one index per
+    # sort order so that each page is read straight off an index.
+    """
+    ALTER TABLE media ADD COLUMN name_key TEXT NOT NULL DEFAULT '';
+    ALTER TABLE media ADD COLUMN position INTEGER;
+    ALTER TABLE media ADD COLUMN type_position INTEGER;
+    UPDATE media SET name_key = py_lower(name);
+    CREATE INDEX media_rank_order ON media (project, (rank IS NULL), COALESCE(rank, 0), name);
+    CREATE INDEX media_name_key ON media (project, name_key, name);
+    CREATE INDEX media_mtime ON media (project, mtime, name);
+    CREATE INDEX media_size ON media (project, size, name);
+    CREATE INDEX media_type ON media (project, type);
+    UPDATE projects SET ranking_mtime = NULL;
+    """,
+    # has_thumb becomes a bitmask of the thumbnail renditions present
+    """
+    UPDATE projects SET thumbs_mtime = NULL;
+    """,
+    # Sampled content fingerprints for hash-first duplicate checks, computed
+    # lazily and cleared whenever a file's size or mtime changes.
+    """
+    ALTER TABLE media ADD COLUMN fingerprint TEXT;
+    """,
+    # Library-wide SHA-256 content digests, cleared like fingerprints
+    """
+    ALTER TABLE media ADD COLUMN digest TEXT;
+    CREATE INDEX media_digest ON media (digest);
+    """,
+    # Perceptual hashes with one covering index per 16-bit chunk (multi-index
+    # hashing), and the near-duplicate pairs found when each hash was stored.
+    """
+    ALTER TABLE media ADD COLUMN phash INTEGER;
+    CREATE INDEX media_phash_0 ON media (project, (phash & 65535), phash, name)
+        WHERE phash IS NOT NULL;
+    CREATE INDEX media_phash_1 ON media (project, ((phash >> 16) & 65535), phash, name)
+        WHERE phash IS NOT NULL;
+    CREATE INDEX media_phash_2 ON media (project, ((phash >> 32) & 65535), phash, name)
+        WHERE phash IS NOT NULL;
+    CREATE INDEX media_phash_3 ON media (project, ((phash >> 48) & 65535), phash, name)
+        WHERE phash IS NOT NULL;
+    CREATE TABLE near_duplicates (
+        project TEXT NOT NULL,
+        a TEXT NOT NULL,
+        b TEXT NOT NULL,
+        hash_a INTEGER NOT NULL,
+        hash_b INTEGER NOT NULL,
+        distance INTEGER NOT NULL,
+        PRIMARY KEY (project, a, b)
+    );
+    CREATE INDEX near_duplicates_b ON near_duplicates (project, b);
+    """,
+    # Rank order comes from the fractional keys of the metadata store (the
+    # integer rank column is no longer used). Positions get indexes so that
+    # a move only shifts the rows between its old and new place.
+    """
+    ALTER TABLE media ADD COLUMN rank_key TEXT;
+    DROP INDEX media_rank;
+    DROP INDEX media_rank_order;
+    CREATE INDEX media_rank_key_order ON media (project, (rank_key IS NULL), COALESCE(rank_key, ''), name);
+    CREATE INDEX media_ranked ON media (project, rank_key, name) WHERE rank_key IS NOT NULL;
+    CREATE INDEX media_type_rank_key ON media (project, type, rank_key, name)
+        WHERE rank_key IS NOT NULL;
+    CREATE INDEX media_position ON media (project, position) WHERE position IS NOT NULL;
+    CREATE INDEX media_type_position ON media (project, type, type_position)
+        WHERE type_position IS NOT NULL;
+    UPDATE media SET rank = NULL, position = NULL, type_position = NULL;
+    UPDATE projects SET ranking_mtime = NULL;
+    """,
+    # Listing validators: a change counter shared by every project (so a
+    # recreated project never reuses an old version), a random id telling
+    # this database apart from a rebuilt one, and a version token per file's
+    # thumbnails for content-addressed thumbnail URLs.
+    """
+    CREATE TABLE changes (instance TEXT NOT NULL, counter INTEGER NOT NULL);
+    INSERT INTO changes VALUES (lower(hex(randomblob(8))), 0);
+    ALTER TABLE projects ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE media ADD COLUMN thumb_version TEXT;
+    UPDATE projects SET thumbs_mtime = NULL;
+    """,
+    # EXIF read once per image (cleared like digests) and the capture time
+    # taken from it. Rescanning every folder queues extraction for them all.
+    """
+    ALTER TABLE media ADD COLUMN exif TEXT;
+    ALTER TABLE media ADD COLUMN taken REAL;
+    CREATE INDEX media_taken ON media (project, COALESCE(taken, mtime), name);
+    UPDATE projects SET dir_mtime = NULL;
+    """,
+    # Ratings fitted to the metadata store's vote log, with their 95%
+    # intervals and vote counts, and the vote version they were fitted at.
+    """
+    ALTER TABLE projects ADD COLUMN votes_mtime INTEGER;
+    ALTER TABLE media ADD COLUMN rating REAL;
+    ALTER TABLE media ADD COLUMN rating_low REAL;
+    ALTER TABLE media ADD COLUMN rating_high REAL;
+    ALTER TABLE media ADD COLUMN votes INTEGER;
+    CREATE INDEX media_rating ON media (project, (rating IS NULL), COALESCE(rating, 0) DESC, name);
+    """,
+    # Tiny image previews, copied from the metadata store with tags and
+    # comments; every project reloads its metadata to pick them up.
+    """
+    ALTER TABLE media ADD COLUMN placeholder TEXT;
+    UPDATE projects SET meta_mtime = NULL;
+    """,
+]
+
+SIGNATURE_COLUMNS = ("dir_mtime", "thumbs_mtime", "ranking_mtime", "meta_mtime", "votes_mtime")
+
+# Keyset columns per sort mode; the name tiebreak keeps every ordering total.
+SORT_KEYS = {
+    "rank": (("(rank_key IS NULL)", "ASC"), ("COALESCE(rank_key, '')", "ASC"), ("name", "ASC")),
+    "name": (("name_key", "ASC"), ("name", "ASC")),
+    "name_desc": (("name_key", "DESC"), ("name", "DESC")),
+    "date": (("mtime", "ASC"), ("name", "ASC")),
+    "date_desc": (("mtime", "DESC"), ("name", "DESC")),
+    "size": (("size", "ASC"), ("name", "ASC")),
+    "size_desc": (("size", "DESC"), ("name", "DESC")),
+    # Capture time, falling back to mtime for files without one
+    "taken": (("COALESCE(taken, mtime)", "ASC"), ("name", "ASC")),
+    "taken_desc": (("COALESCE(taken, mtime)", "DESC"), ("name", "DESC")),
+    # Highest rated first; files nobody has voted on last
+    "rating": (("(rating IS NULL)", "ASC"), ("COALESCE(rating, 0)", "DESC"), ("name", "ASC")),
+}
+
+
+# Rows read per project at a time when merging projects' listings
+MERGE_BATCH_SIZE = 500
+
+
+def _order_keys(sort_by: str) -> Tuple[Tuple[str, str], ...]:
+    """Keyset columns of a listing that may span projects.
+
+    Rank positions only mean something within a project, so rank order lists
+    project by project. Every other order is global, with the project as the
+    final tiebreak.
+    """
+    if sort_by == "rank":
+        return (("project", "ASC"),) + SORT_KEYS["rank"]
+    return SORT_KEYS[sort_by] + (("project", "ASC"),)
+
+
+class _Descending:
+    """Reverses the order of a sort key value, for DESC columns in a merge."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value) -> None:
+        self.value = value
+
+    def __lt__(self, other: "_Descending") -> bool:
+        return other.value < self.value
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, _Descending) and self.value == other.value
+
+
+def _like_pattern(text: str) -> str:
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _renumber(conn: sqlite3.Connection, project: str) -> None:
+    """Recompute the dense rank positions of a project's ranked items."""
+    conn.execute(
+        "UPDATE media SET position = NULL, type_position = NULL "
+        "WHERE project = ? AND rank_key IS NULL AND position IS NOT NULL",
+        (project,),
+    )
+    conn.execute(
+        """
+        UPDATE media SET position = numbered.position, type_position = numbered.type_position
+        FROM (
+            SELECT name,
+                ROW_NUMBER() OVER (ORDER BY rank_key, name) AS position,
+                ROW_NUMBER() OVER (PARTITION BY type ORDER BY rank_key, name) AS type_position
+            FROM media WHERE project = ? AND rank_key IS NOT NULL
+        ) AS numbered
+        WHERE media.project = ? AND media.name = numbered.name
+        """,
+        (project, project),
+    )
+
+
+def _any_ranked(conn: sqlite3.Connection, project: str, names: Iterable[str]) -> bool:
+    """Whether any of ``names`` has a rank, so that positions need renumbering."""
+    return conn.execute(
+        "SELECT EXISTS (SELECT 1 FROM media WHERE project = ? AND rank_key IS NOT NULL "
+        "AND name IN (SELECT value FROM json_each(?)))",
+        (project, json.dumps(list(names))),
+    ).fetchone()[0] == 1
+
+
+def _touch(conn: sqlite3.Connection, project: str) -> None:
+    """Give a project a new change version after its rows were modified."""
+    conn.execute("UPDATE changes SET counter = counter + 1")
+    conn.execute(
+        "INSERT INTO projects (name, version) VALUES (?, (SELECT counter FROM changes)) "
+        "ON CONFLICT (name) DO UPDATE SET version = excluded.version",
+        (project,),
+    )
+
+
+def _shift_positions(conn: sqlite3.Connection, column: str, scope_sql: str, params: list,
+                     old: Optional[int], new: int) -> None:
+    """Make room at ``new`` for an item leaving ``old`` (None if it was unranked)."""
+    if old is None:
+        conn.execute(
+            f"UPDATE media SET {column} = {column} + 1 WHERE {scope_sql} AND {column} >= ?",
+            params + [new],
+        )
+    elif new < old:
+        conn.execute(
+            f"UPDATE media SET {column} = {column} + 1 WHERE {scope_sql} AND {column} >= ? AND {column} < ?",
+            params + [new, old],
+        )
+    elif new > old:
+        conn.execute(
+            f"UPDATE media SET {column} = {column} - 1 WHERE {scope_sql} AND {column} > ? AND {column} <= ?",
+            params + [old, new],
+        )
+
+
+def _media_filter_sql(projects: List[str], media_type: Optional[str]) -> Tuple[str, list]:
+    sql = f"project IN ({', '.join('?' for _ in projects)})"
+    params = list(projects)
+    if media_type:
+        sql += " AND type = ?"
+        params.append(media_type)
+    return sql, params
+
+
+def _search_filter_sql(query: str, tags: Iterable[str]) -> Tuple[str, list]:
+    """Build ``AND ...`` SQL matching a filename/tag substring and exact tags."""
+    sql = ""
+    params: list = []
+    if query:
+        sql += (
+            " AND (name LIKE ? ESCAPE '\\' OR EXISTS "
+            "(SELECT 1 FROM json_each(tags) WHERE value LIKE ? ESCAPE '\\'))"
+        )
+        params.extend([_like_pattern(query)] * 2)
+    for tag in tags:
+        sql += " AND EXISTS (SELECT 1 FROM json_each(tags) WHERE value = ?)"
+        params.append(tag)
+    return sql, params
+
+
+def _keyset_condition(keys: Tuple[Tuple[str, str], ...], values: list) -> Tuple[str, list]:
+    """Build ``WHERE`` SQL selecting rows strictly after ``values`` in ``keys`` order."""
+    clauses = []
+    params: list = []
+    for i, (expr, direction) in enumerate(keys):
+        op = ">" if direction == "ASC" else "<"
+        parts = [f"{prev} = ?" for prev, _ in keys[:i]] + [f"{expr} {op} ?"]
+        clauses.append("(" + " AND ".join(parts) + ")")
+        params.extend(values[:i + 1])
+    return "(" + " OR ".join(clauses) + ")", params
+
+
+class MediaIndex:
+    """Thin storage layer over the index database."""
+
+    def __init__(self, db_path: Path) -> None:
+        self.db_path = db_path
+        self._local = threading.local()
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._migrate(conn)
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread, reopened after a fork (gunicorn workers).
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(str(self.db_path), timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.create_function("py_lower", 1, str.lower, deterministic=True)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = self._connection()
+        with conn:
+            yield conn
+
+    def _migrate(self, conn: sqlite3.Connection) -> None:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for target, script in enumerate(_MIGRATIONS[version:], start=version + 1):
+            conn.executescript(f"BEGIN; {script}; PRAGMA user_version = {target}; COMMIT;")
+
+    # ============ Project signatures ============
+
+    def project_signatures(self, project: str) -> Optional[Dict[str, Optional[int]]]:
+        """Return the stored mtimes for a project, or None if it was never indexed."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM projects WHERE name = ?", (project,)).fetchone()
+        if row is None:
+            return None
+        return {column: row[column] for column in SIGNATURE_COLUMNS}
+
+    def store_signatures(self, project: str, **signatures: Optional[int]) -> None:
+        unknown = set(signatures) - set(SIGNATURE_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown signature columns: {sorted(unknown)}")
+        with self._connect() as conn:
+            conn.execute("INSERT OR IGNORE INTO projects (name) VALUES (?)", (project,))
+            for column, value in signatures.items():
+                conn.execute(f"UPDATE projects SET {column} = ? WHERE name = ?", (value, project))
+
+    def invalidate(self, project: str) -> None:
+        """Forget every signature so the next refresh rescans the project."""
+        self.store_signatures(project, **{column: None for column in SIGNATURE_COLUMNS})
+
+    # ============ Files ============
+
+    def sync_files(self, project: str, files: Dict[str, Tuple[str, int, float, float]]) -> List[str]:
+        """Replace the file rows of a project with ``{name: (type, size, mtime, ctime)}``.
+
+        Returns the names of the files that were added or changed.
+        """
+        with self._connect() as conn:
+            known = {
+                row["name"]: (row["type"], row["size"], row["mtime"], row["ctime"])
+                for row in conn.execute(
+                    "SELECT name, type, size, mtime, ctime FROM media WHERE project = ?", (project,)
+                )
+            }
+            removed = [(project, name) for name in known if name not in files]
+            conn.executemany("DELETE FROM media WHERE project = ? AND name = ?", removed)
+            changed = [
+                (project, name, *info, name.lower())
+                for name, info in files.items()
+                if known.get(name) != info
+            ]
+            conn.executemany(_UPSERT_FILE, changed)
+            if removed or changed:
+                _renumber(conn, project)
+                _touch(conn, project)
+        return [row[1] for row in changed]
+
+    def upsert_file(self, project: str, name: str, media_type: str, size: int,
+                    mtime: float, ctime: float) -> None:
+        self.upsert_files(project, {name: (media_type, size, mtime, ctime)})
+
+    def upsert_files(self, project: str, files: Dict[str, Tuple[str, int, float, float]]) -> None:
+        """Add or update the rows of some files, ``{name: (type, size, mtime, ctime)}``, in one write."""
+        if not files:
+            return
+        with self._connect() as conn:
+            conn.executemany(
+                _UPSERT_FILE,
+                [(project, name, *info, name.lower()) for name, info in files.items()],
+            )
+            # New files are unranked; positions only move if a ranked one changed type
+            if _any_ranked(conn, project, files):
+                _renumber(conn, project)
+            _touch(conn, project)
+
+    def remove_files(self, project: str, names: Iterable[str]) -> None:
+        names = list(names)
+        if not names:
+            return
+        with self._connect() as conn:
+            ranked = _any_ranked(conn, project, names)
+            conn.executemany(
+                "DELETE FROM media WHERE project = ? AND name = ?",
+                [(project, name) for name in names],
+            )
+            if ranked:
+                _renumber(conn, project)
+            _touch(conn, project)
+
+    def rename_file(self, project: str, old: str, new: str) -> bool:
+        """Give a file's row its new name, keeping its digest, hashes, EXIF and thumbnail state.
+
+        A row already at ``new`` is replaced. Returns False if ``old`` was not indexed.
+        """
+        with self._connect() as conn:
+            ranked = _any_ranked(conn, project, [old, new])
+            conn.execute("DELETE FROM media WHERE project = ? AND name = ?", (project, new))
+            renamed = conn.execute(
+                "UPDATE media SET name = ?, name_key = ? WHERE project = ? AND name = ?",
+                (new, new.lower(), project, old),
+            ).rowcount
+            pairs = conn.execute(
+                "SELECT a, b, hash_a, hash_b, distance FROM near_duplicates "
+                "WHERE project = ? AND (a IN (?, ?) OR b IN (?, ?))",
+                (project, old, new, old, new),
+            ).fetchall()
+            conn.execute(
+                "DELETE FROM near_duplicates WHERE project = ? AND (a IN (?, ?) OR b IN (?, ?))",
+                (project, old, new, old, new),
+            )
+            moved = []
+            for a, b, hash_a, hash_b, distance in pairs:
+                if new in (a, b):
+                    continue  # the replaced file's pairs go with it
+                a, b = (new if a == old else a), (new if b == old else b)
+                # Pairs are stored in name order
+                if a > b:
+                    a, b, hash_a, hash_b = b, a, hash_b, hash_a
+                moved.append((project, a, b, hash_a, hash_b, distance))
+            conn.executemany(
+                "INSERT OR REPLACE INTO near_duplicates (project, a, b, hash_a, hash_b, distance) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                moved,
+            )
+            if ranked:
+                # Names break ties between equal rank keys
+                _renumber(conn, project)
+            _touch(conn, project)
+        return bool(renamed)
+
+    def set_thumbnails(self, project: str, thumbs: Dict[str, Tuple[int, Optional[str]]]) -> None:
+        """Store ``{name: (mask, version)}``: which thumbnail renditions exist, as a
+        bitmask, and the version token of their current content."""
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE media SET has_thumb = ?, thumb_version = ? WHERE project = ? AND name = ?",
+                [(mask, version, project, name) for name, (mask, version) in thumbs.items()],
+            )
+            _touch(conn, project)
+
+    def thumbnail_states(self, project: str) -> Dict[str, Tuple[int, Optional[str]]]:
+        """``{name: (mask, version)}`` as last stored by ``set_thumbnails``."""
+        with self._connect() as conn:
+            return {
+                row["name"]: (row["has_thumb"], row["thumb_version"])
+                for row in conn.execute(
+                    "SELECT name, has_thumb, thumb_version FROM media WHERE project = ?", (project,)
+                )
+            }
+
+    def file_names(self, project: str) -> List[str]:
+        with self._connect() as conn:
+            return [
+                row["name"]
+                for row in conn.execute(
+                    "SELECT name FROM media WHERE project = ? ORDER BY name", (project,)
+                )
+            ]
+
+    def existing_names(self, project: str, names: Iterable[str]) -> List[str]:
+        """Those of ``names`` that are files of the project."""
+        with self._connect() as conn:
+            return [
+                name for name in names
+                if conn.execute(
+                    "SELECT 1 FROM media WHERE project = ? AND name = ?", (project, name)
+                ).fetchone()
+            ]
+
+    # ============ Rankings and metadata ============
+
+    def store_rankings(self, project: str, keys: Dict[str, str]) -> None:
+        """Replace a project's rank keys with ``{name: key}``."""
+        with self._connect() as conn:
+            conn.execute("UPDATE media SET rank_key = NULL WHERE project = ?", (project,))
+            conn.executemany(
+                "UPDATE media SET rank_key = ? WHERE project = ? AND name = ?",
+                [(key, project, name) for name, key in keys.items()],
+            )
+            _renumber(conn, project)
+            _touch(conn, project)
+
+    def unranked_names_through(self, project: str, name: str,
+                               media_type: Optional[str] = None) -> List[str]:
+        """Unranked files listed up to and including ``name`` in rank order; empty if it is ranked."""
+        sql = (
+            "SELECT name FROM media WHERE project = ? AND (rank_key IS NULL) = 1 "
+            "AND COALESCE(rank_key, '') = '' AND name <= ?"
+        )
+        params: list = [project, name]
+        if media_type:
+            sql += " AND type = ?"
+            params.append(media_type)
+        with self._connect() as conn:
+            ranked = conn.execute(
+                "SELECT rank_key IS NOT NULL FROM media WHERE project = ? AND name = ?",
+                (project, name),
+            ).fetchone()
+            if ranked is None or ranked[0]:
+                return []
+            return [row["name"] for row in conn.execute(sql + " ORDER BY name", params)]
+
+    def rank_position(self, project: str, name: str) -> Optional[int]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT position FROM media WHERE project = ? AND name = ?", (project, name)
+            ).fetchone()
+        return row["position"] if row else None
+
+    def comparison_items(self, project: str,
+                         media_type: Optional[str] = None) -> Tuple[List[str], List[str]]:
+        """Names of the ranked files in rank order, and of the unranked ones by name."""
+        filter_sql, params = _media_filter_sql([project], media_type)
+        with self._connect() as conn:
+            ranked = [
+                row["name"]
+                for row in conn.execute(
+                    f"SELECT name FROM media WHERE {filter_sql} AND rank_key IS NOT NULL "
+                    "ORDER BY rank_key, name",
+                    params,
+                )
+            ]
+            unranked = [
+                row["name"]
+                for row in conn.execute(
+                    f"SELECT name FROM media WHERE {filter_sql} AND rank_key IS NULL ORDER BY name",
+                    params,
+                )
+            ]
+        return ranked, unranked
+
+    def media_rows(self, project: str, names: Iterable[str]) -> Dict[str, sqlite3.Row]:
+        """``{name: row}``, shaped like ``query_media`` rows, for those of ``names`` that exist."""
+        rows = {}
+        with self._connect() as conn:
+            for name in names:
+                row = conn.execute(
+                    f"SELECT {_ROW_COLUMNS}, position FROM media WHERE project = ? AND name = ?",
+                    (project, name),
+                ).fetchone()
+                if row is not None:
+                    rows[name] = row
+        return rows
+
+    def move_ranks(self, project: str, keys: Dict[str, str]) -> None:
+        """Give a few files new rank keys, in order, shifting only the positions in between."""
+        with self._connect() as conn:
+            # Take the write lock before reading the positions to shift
+            conn.execute("BEGIN IMMEDIATE")
+            for name, key in keys.items():
+                row = conn.execute(
+                    "SELECT type, position, type_position FROM media WHERE project = ? AND name = ?",
+                    (project, name),
+                ).fetchone()
+                if row is None:
+                    continue
+                position = 1 + conn.execute(
+                    "SELECT COUNT(*) FROM media WHERE project = ? AND rank_key IS NOT NULL "
+                    "AND (rank_key, name) < (?, ?) AND name != ?",
+                    (project, key, name, name),
+                ).fetchone()[0]
+                type_position = 1 + conn.execute(
+                    "SELECT COUNT(*) FROM media WHERE project = ? AND type = ? AND rank_key IS NOT NULL "
+                    "AND (rank_key, name) < (?, ?) AND name != ?",
+                    (project, row["type"], key, name, name),
+                ).fetchone()[0]
+                _shift_positions(conn, "position", "project = ?", [project],
+                                 row["position"], position)
+                _shift_positions(conn, "type_position", "project = ? AND type = ?",
+                                 [project, row["type"]], row["type_position"], type_position)
+                conn.execute(
+                    "UPDATE media SET rank_key = ?, position = ?, type_position = ? "
+                    "WHERE project = ? AND name = ?",
+                    (key, position, type_position, project, name),
+                )
+            _touch(conn, project)
+
+    def store_media_meta(self, project: str, media_meta: Dict[str, Dict]) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE media SET tags = '[]', comment = '', hash = NULL, placeholder = NULL "
+                "WHERE project = ?",
+                (project,),
+            )
+            conn.executemany(
+                "UPDATE media SET tags = ?, comment = ?, hash = ?, placeholder = ? "
+                "WHERE project = ? AND name = ?",
+                [
+                    (
+                        json.dumps(meta.get("tags", [])),
+                        meta.get("comment", ""),
+                        meta.get("hash"),
+                        meta.get("placeholder"),
+                        project,
+                        name,
+                    )
+                    for name, meta in media_meta.items()
+                    if isinstance(meta, dict)
+                ],
+            )
+            _touch(conn, project)
+
+    def update_media_meta(self, project: str, records: Dict[str, Dict]) -> None:
+        """Apply the metadata of a few files without touching the rest of the project."""
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE media SET tags = ?, comment = ?, hash = ?, placeholder = ? "
+                "WHERE project = ? AND name = ?",
+                [
+                    (json.dumps(meta["tags"]), meta["comment"], meta["hash"], meta["placeholder"],
+                     project, name)
+                    for name, meta in records.items()
+                ],
+            )
+            _touch(conn, project)
+
+    # ============ Ratings ============
+
+    def store_ratings(self, project: str, ratings: Dict[str, Tuple[float, float, float, int]]) -> None:
+        """Replace a project's ratings with ``{name: (rating, low, high, votes)}``."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE media SET rating = NULL, rating_low = NULL, rating_high = NULL, votes = NULL "
+                "WHERE project = ? AND rating IS NOT NULL",
+                (project,),
+            )
+            conn.executemany(
+                "UPDATE media SET rating = ?, rating_low = ?, rating_high = ?, votes = ? "
+                "WHERE project = ? AND name = ?",
+                [(*rating, project, name) for name, rating in ratings.items()],
+            )
+            _touch(conn, project)
+
+    def ratings(self, project: str, media_type: Optional[str] = None
+                ) -> Dict[str, Optional[Tuple[float, float, float, int]]]:
+        """``{name: (rating, low, high, votes)}`` of every file, None for files without votes."""
+        filter_sql, params = _media_filter_sql([project], media_type)
+        with self._connect() as conn:
+            return {
+                row["name"]: (
+                    (row["rating"], row["rating_low"], row["rating_high"], row["votes"])
+                    if row["rating"] is not None else None
+                )
+                for row in conn.execute(
+                    f"SELECT name, rating, rating_low, rating_high, votes FROM media WHERE {filter_sql}",
+                    params,
+                )
+            }
+
+    # ============ EXIF ============
+
+    def files_without_exif(self, project: str) -> List[str]:
+        """Names of images in ``project`` whose EXIF has not been read yet."""
+        with self._connect() as conn:
+            return [
+                row["name"]
+                for row in conn.execute(
+                    "SELECT name FROM media WHERE project = ? AND type = 'image' AND exif IS NULL "
+                    "ORDER BY name",
+                    (project,),
+                )
+            ]
+
+    def store_exif(self, project: str, entries: Iterable[Tuple[str, int, float, Dict]]) -> None:
+        """Store ``(name, size, mtime, exif)`` entries and the capture times they give.
+
+        Like digests, EXIF is only kept if the indexed size and mtime still
+        match the ones it was read at.
+        """
+        with self._connect() as conn:
+            updated = conn.executemany(
+                "UPDATE media SET exif = ?, taken = ? "
+                "WHERE project = ? AND name = ? AND size = ? AND mtime = ?",
+                [
+                    (json.dumps(exif), capture_time(exif), project, name, size, mtime)
+                    for name, size, mtime, exif in entries
+                ],
+            ).rowcount
+            if updated:
+                _touch(conn, project)
+
+    def exif_rows(self, project: str, names: Iterable[str]) -> Dict[str, sqlite3.Row]:
+        """``{name: row}`` with the size, times and stored EXIF of those of ``names`` that exist."""
+        rows = {}
+        with self._connect() as conn:
+            for name in names:
+                row = conn.execute(
+                    "SELECT name, type, size, mtime, ctime, exif FROM media WHERE project = ? AND name = ?",
+                    (project, name),
+                ).fetchone()
+                if row is not None:
+                    rows[name] = row
+        return rows
+
+    # ============ Duplicates ============
+
+    def find_hash(self, project: str, file_hash: str) -> Optional[str]:
+        """Name of a file in ``project`` with this content hash, if any."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT name FROM media WHERE hash = ? AND project = ? LIMIT 1",
+                (file_hash, project),
+            ).fetchone()
+        return row["name"] if row else None
+
+    def files_of_size(self, project: str, size: int) -> List[Tuple[str, Optional[str]]]:
+        """``(name, fingerprint)`` of every file in ``project`` with exactly ``size`` bytes."""
+        with self._connect() as conn:
+            return [
+                (row["name"], row["fingerprint"])
+                for row in conn.execute(
+                    "SELECT name, fingerprint FROM media WHERE project = ? AND size = ?",
+                    (project, size),
+                )
+            ]
+
+    def store_fingerprints(self, project: str, fingerprints: Dict[str, str]) -> None:
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE media SET fingerprint = ? WHERE project = ? AND name = ?",
+                [(fingerprint, project, name) for name, fingerprint in fingerprints.items()],
+            )
+
+    def file_states(self, project: str,
+                    names: Optional[Iterable[str]] = None) -> Dict[str, Tuple[int, float, Optional[str]]]:
+        """``{name: (size, mtime, digest)}`` of the named files, or of every file of ``project``."""
+        with self._connect() as conn:
+            if names is None:
+                rows = conn.execute(
+                    "SELECT name, size, mtime, digest FROM media WHERE project = ?", (project,)
+                ).fetchall()
+            else:
+                rows = [
+                    row for name in names
+                    for row in conn.execute(
+                        "SELECT name, size, mtime, digest FROM media WHERE project = ? AND name = ?",
+                        (project, name),
+                    )
+                ]
+        return {row["name"]: (row["size"], row["mtime"], row["digest"]) for row in rows}
+
+    def undigested_files(self, project: str) -> List[str]:
+        """Names of files in ``project`` without a content digest."""
+        with self._connect() as conn:
+            return [
+                row["name"]
+                for row in conn.execute(
+                    "SELECT name FROM media WHERE project = ? AND digest IS NULL ORDER BY name",
+                    (project,),
+                )
+            ]
+
+    def store_digests(self, project: str, digests: Iterable[Tuple[str, int, float, str]]) -> None:
+        """Store ``(name, size, mtime, digest)`` entries.
+
+        A digest is only kept if the indexed size and mtime still match the
+        ones it was computed at.
+        """
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE media SET digest = ? WHERE project = ? AND name = ? AND size = ? AND mtime = ?",
+                [(digest, project, name, size, mtime) for name, size, mtime, digest in digests],
+            )
+
+    def file_digest(self, project: str, name: str, size: int, mtime: float) -> Optional[str]:
+        """The stored digest of a file, if it was computed at this size and mtime."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT digest FROM media WHERE project = ? AND name = ? AND size = ? AND mtime = ?",
+                (project, name, size, mtime),
+            ).fetchone()
+        return row["digest"] if row else None
+
+    def duplicate_groups(self, cross_project: bool = False, limit: int = 100,
+                         offset: int = 0) -> Tuple[List[Dict], Dict[str, int]]:
+        """Groups of files sharing a digest, the most wasted bytes first.
+
+        Returns ``(groups, summary)``. Each group is ``{digest, size, files}``
+        with ``files`` as ``(project, name)`` pairs. ``summary`` counts
+        ``groups``, ``wasted_bytes``, ``hashed_files`` and ``unhashed_files``.
+        """
+        having = "COUNT(*) > 1"
+        if cross_project:
+            having += " AND COUNT(DISTINCT project) > 1"
+        groups_sql = f"""
+            SELECT digest, MAX(size) AS size, COUNT(*) AS copies
+            FROM media WHERE digest IS NOT NULL
+            GROUP BY digest HAVING {having}
+        """
+        with self._connect() as conn:
+            page = conn.execute(
+                f"SELECT * FROM ({groups_sql}) ORDER BY size * (copies - 1) DESC, digest LIMIT ? OFFSET ?",
+                (limit, offset),
+            ).fetchall()
+            totals = conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(size * (copies - 1)), 0) FROM ({groups_sql})"
+            ).fetchone()
+            coverage = conn.execute(
+                "SELECT COUNT(digest), COUNT(*) - COUNT(digest) FROM media"
+            ).fetchone()
+            members: Dict[str, List[Tuple[str, str]]] = {}
+            digests = [row["digest"] for row in page]
+            if digests:
+                placeholders = ", ".join("?" * len(digests))
+                for row in conn.execute(
+                    f"SELECT digest, project, name FROM media WHERE digest IN ({placeholders}) "
+                    "ORDER BY project, name",
+                    digests,
+                ):
+                    members.setdefault(row["digest"], []).append((row["project"], row["name"]))
+        groups = [
+            {"digest": row["digest"], "size": row["size"], "files": members.get(row["digest"], [])}
+            for row in page
+        ]
+        summary = {
+            "groups": totals[0],
+            "wasted_bytes": totals[1],
+            "hashed_files": coverage[0],
+            "unhashed_files": coverage[1],
+        }
+        return groups, summary
+
+    def images_without_phash(self, project: str) -> List[str]:
+        with self._connect() as conn:
+            return [
+                row["name"]
+                for row in conn.execute(
+                    "SELECT name FROM media WHERE project = ? AND type = 'image' AND phash IS NULL",
+                    (project,),
+                )
+            ]
+
+    def images_without_placeholder(self, project: str) -> List[str]:
+        """Images with thumbnails but no placeholder, such as those thumbnailed before placeholders existed."""
+        with self._connect() as conn:
+            return [
+                row["name"]
+                for row in conn.execute(
+                    "SELECT name FROM media WHERE project = ? AND type = 'image' AND has_thumb != 0 "
+                    "AND placeholder IS NULL",
+                    (project,),
+                )
+            ]
+
+    def store_perceptual_hashes(self, project: str, hashes: Dict[str, int]) -> None:
+        """Store perceptual hashes and record every neighbour within ``MAX_DISTANCE_LIMIT``.
+
+        The hash is written before neighbours are looked up, inside one write
+        transaction. Two workers storing similar images at the same time
+        therefore still find each other.
+        """
+        with self._connect() as conn:
+            for name, value in hashes.items():
+                stored = _to_signed64(value)
+                updated = conn.execute(
+                    "UPDATE media SET phash = ? WHERE project = ? AND name = ?",
+                    (stored, project, name),
+                )
+                if not updated.rowcount:
+                    continue
+                candidates = {}
+                for chunk_sql, values in zip(_PHASH_CHUNK_SQL, chunk_probes(value, MAX_DISTANCE_LIMIT)):
+                    placeholders = ", ".join("?" * len(values))
+                    for row in conn.execute(
+                        f"SELECT name, phash FROM media WHERE project = ? AND phash IS NOT NULL "
+                        f"AND {chunk_sql} IN ({placeholders})",
+                        [project, *values],
+                    ):
+                        candidates[row["name"]] = row["phash"]
+                candidates.pop(name, None)
+
+                conn.execute(
+                    "DELETE FROM near_duplicates WHERE project = ? AND (a = ? OR b = ?)",
+                    (project, name, name),
+                )
+                pairs = []
+                for other, other_stored in candidates.items():
+                    distance = hamming(value, _to_unsigned64(other_stored))
+                    if distance > MAX_DISTANCE_LIMIT:
+                        continue
+                    if name < other:
+                        pairs.append((project, name, other, stored, other_stored, distance))
+                    else:
+                        pairs.append((project, other, name, other_stored, stored, distance))
+                conn.executemany(
+                    "INSERT OR REPLACE INTO near_duplicates (project, a, b, hash_a, hash_b, distance) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    pairs,
+                )
+
+    def near_duplicate_pairs(self, project: str, max_distance: int) -> List[Tuple[str, str]]:
+        """Pairs of images within ``max_distance`` whose stored hashes are still current."""
+        with self._connect() as conn:
+            return [
+                (row["a"], row["b"])
+                for row in conn.execute(
+                    """
+                    SELECT d.a, d.b FROM near_duplicates d
+                    JOIN media ma ON ma.project = d.project AND ma.name = d.a AND ma.phash = d.hash_a
+                    JOIN media mb ON mb.project = d.project AND mb.name = d.b AND mb.phash = d.hash_b
+                    WHERE d.project = ? AND d.distance <= ?
+                    """,
+                    (project, max_distance),
+                )
+            ]
+
+    def phash_coverage(self, project: str) -> Tuple[int, int]:
+        """``(hashed, unhashed)`` image counts for a project."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT COUNT(phash), COUNT(*) - COUNT(phash) FROM media "
+                "WHERE project = ? AND type = 'image'",
+                (project,),
+            ).fetchone()
+        return row[0], row[1]
+
+    # ============ Queries ============
+
+    def _select_media(self, projects: List[str], keys: Tuple[Tuple[str, str], ...],
+                      media_type: Optional[str], query: str, tags: Iterable[str],
+                      after: Optional[list], limit: Optional[int]) -> List[sqlite3.Row]:
+        filter_sql, params = _media_filter_sql(projects, media_type)
+        search_sql, search_params = _search_filter_sql(query, tags)
+        params.extend(search_params)
+        if after is not None:
+            condition, condition_params = _keyset_condition(keys, after)
+            search_sql += f" AND {condition}"
+            params.extend(condition_params)
+
+        position = "type_position" if media_type else "position"
+        key_columns = ", ".join(f"{expr} AS k{i}" for i, (expr, _) in enumerate(keys))
+        order = ", ".join(f"{expr} {direction}" for expr, direction in keys)
+        sql = (
+            f"SELECT {_ROW_COLUMNS}, {position} AS position, {key_columns} FROM media "
+            f"WHERE {filter_sql}{search_sql} ORDER BY {order}"
+        )
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._connect() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def _project_rows(self, project: str, keys: Tuple[Tuple[str, str], ...],
+                      media_type: Optional[str], query: str, tags: Iterable[str],
+                      after: Optional[list], batch: int) -> Iterator[sqlite3.Row]:
+        """Every matching row of one project in ``keys`` order, read ``batch`` rows at a time."""
+        while True:
+            rows = self._select_media([project], keys, media_type, query, tags, after, batch)
+            yield from rows
+            if len(rows) < batch:
+                return
+            after = [rows[-1][f"k{i}"] for i in range(len(keys))]
+
+    def iter_media(
+        self,
+        projects: List[str],
+        media_type: Optional[str] = None,
+        sort_by: str = "rank",
+        query: str = "",
+        tags: Iterable[str] = (),
+        after: Optional[list] = None,
+        batch: int = MERGE_BATCH_SIZE,
+    ) -> Iterator[sqlite3.Row]:
+        """Every matching row across ``projects``, in ``query_media`` order, read lazily.
+
+        Each project is read off its own index in batches. Rank order lists
+        project by project, so the projects are read one after another;
+        other orders k-way merge the projects' sorted streams. Memory stays
+        at one batch per project however many rows there are.
+        """
+        keys = _order_keys(sort_by)
+        tags = list(tags)
+        streams = [
+            self._project_rows(project, keys, media_type, query, tags, after, batch)
+            for project in sorted(projects)
+        ]
+        if sort_by == "rank":
+            return chain.from_iterable(streams)
+        descending = [direction == "DESC" for _, direction in keys]
+
+        def merge_key(row: sqlite3.Row) -> tuple:
+            return tuple(
+                _Descending(row[f"k{i}"]) if desc else row[f"k{i}"]
+                for i, desc in enumerate(descending)
+            )
+
+        return heapq.merge(*streams, key=merge_key)
+
+    def query_media(
+        self,
+        projects: List[str],
+        media_type: Optional[str] = None,
+        sort_by: str = "rank",
+        query: str = "",
+        tags: Iterable[str] = (),
+        after: Optional[list] = None,
+        limit: Optional[int] = None,
+    ) -> Tuple[List[sqlite3.Row], List[str]]:
+        """Return a page of media rows and the names of their sort key columns.
+
+        Rows are ordered by ``sort_by`` across all projects, except that rank
+        order lists project by project. Rows carry ``position``: their
+        1-based place among the ranked items of their project (within
+        ``media_type`` when one is given). ``after`` holds the key values of
+        the last row of the previous page, as returned in each row's ``k0``,
+        ``k1``... columns.
+        """
+        if not projects:
+            return [], []
+        keys = _order_keys(sort_by)
+        if sort_by == "rank" or len(projects) == 1:
+            rows = self._select_media(projects, keys, media_type, query, tags, after, limit)
+        else:
+            # One indexed read of at most ``limit`` rows per project, merged
+            merged = self.iter_media(
+                projects, media_type, sort_by, query, tags, after,
+                batch=limit if limit is not None else MERGE_BATCH_SIZE,
+            )
+            rows = list(islice(merged, limit))
+        return rows, [f"k{i}" for i in range(len(keys))]
+
+    def count_media(self, projects: List[str], media_type: Optional[str] = None,
+                    query: str = "", tags: Iterable[str] = ()) -> int:
+        """Count the rows ``query_media`` would return without a cursor or limit."""
+        if not projects:
+            return 0
+        base_sql, params = _media_filter_sql(projects, media_type)
+        search_sql, search_params = _search_filter_sql(query, tags)
+        with self._connect() as conn:
+            return conn.execute(
+                f"SELECT COUNT(*) FROM media WHERE {base_sql}{search_sql}",
+                params + search_params,
+            ).fetchone()[0]
+
+    def media_counts(self) -> Dict[str, Dict[str, int]]:
+        """Return ``{project: {type: count}}`` for every indexed project."""
+        counts: Dict[str, Dict[str, int]] = {}
+        with self._connect() as conn:
+            for row in conn.execute(
+                "SELECT project, type, COUNT(*) AS n FROM media GROUP BY project, type"
+            ):
+                counts.setdefault(row["project"], {})[row["type"]] = row["n"]
+        return counts
+
+    def change_tag(self, projects: List[str]) -> str:
+        """Opaque tag that changes whenever the indexed rows of any of ``projects`` do."""
+        with self._connect() as conn:
+            instance = conn.execute("SELECT instance FROM changes").fetchone()[0]
+            versions = {
+                row["name"]: row["version"]
+                for row in conn.execute("SELECT name, version FROM projects")
+            }
+        return instance + ";" + ";".join(
+            f"{project}={versions.get(project, 0)}" for project in projects
+        )
+
+    # ============ Projects ============
+
+    def rename_project(self, old: str, new: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM media WHERE project = ?", (new,))
+            conn.execute("DELETE FROM projects WHERE name = ?", (new,))
+            conn.execute("UPDATE media SET project = ? WHERE project = ?", (new, old))
+            conn.execute("UPDATE projects SET name = ? WHERE name = ?", (new, old))
+            conn.execute("DELETE FROM near_duplicates WHERE project = ?", (new,))
+            conn.execute("UPDATE near_duplicates SET project = ? WHERE project = ?", (new, old))
+            _touch(conn, new)
+
+    def drop_project(self, project: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM media WHERE project = ?", (project,))
+            conn.execute("DELETE FROM projects WHERE name = ?", (project,))
+            conn.execute("DELETE FROM near_duplicates WHERE project = ?", (project,))
+
+    def prune_projects(self, existing: Iterable[str]) -> None:
+        """Drop rows for projects whose folders no longer exist."""
+        existing = set(existing)
+        with self._connect() as conn:
+            stale = [
+                row["name"]
+                for row in conn.execute("SELECT name FROM projects")
+                if row["name"] not in existing
+            ]
+        for project in stale:
+            self.drop_project(project)
+
+
+_ROW_COLUMNS = (
+    "project, name, type, size, mtime, ctime, taken, has_thumb, thumb_version, placeholder, tags, "
+    "comment, hash, rank_key, rating, rating_low, rating_high, votes"
+)
+
+_UPSERT_FILE = """
+    INSERT INTO media (project, name, type, size, mtime, ctime, name_key)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (project, name) DO UPDATE SET
+        type = excluded.type,
+        size = excluded.size,
+        mtime = excluded.mtime,
+        ctime = excluded.ctime,
+        name_key = excluded.name_key,
+        fingerprint = CASE WHEN size = excluded.size AND mtime = excluded.mtime
+            THEN fingerprint END,
+        digest = CASE WHEN size = excluded.size AND mtime = excluded.mtime
+            THEN digest END,
+        phash = CASE WHEN size = excluded.size AND mtime = excluded.mtime
+            THEN phash END,
+        exif = CASE WHEN size = excluded.size AND mtime = excluded.mtime
+            THEN exif END,
+        taken = CASE WHEN size = excluded.size AND mtime = excluded.mtime
+            THEN taken END
+"""
+
+# Must match the expressions of the media_phash_* indexes
+_PHASH_CHUNK_SQL = (
+    "(phash & 65535)",
+    "((phash >> 16) & 65535)",
+    "((phash >> 32) & 65535)",
+    "((phash >> 48) & 65535)",
+)
+
+
+def _to_signed64(value: int) -> int:
+    """SQLite integers are signed, so 64-bit hashes are stored two's-complement."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _to_unsigned64(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
@@ -0,0 +1,724 @@
+"""Per-file metadata (tags, comments, upload hashes, placeholders) and rank order, stored inside each project.
+
+Every project keeps its metadata in ``.bestshot/media-meta.db``, a small
+SQLite database in WAL mode. Edits update a single row inside a short write
+transaction, so each change costs the same whatever the size of the project.
+Concurrent edits from several worker processes are serialised by SQLite
+rather than overwriting each other.
+
+Rankings are kept as fractional keys (see ``ranking.py``), so moving one
+file rewrites one row. They have their own version counter, which clients
+send back as a precondition so that two devices reordering at the same time
+do not overwrite each other's changes.
+
+A comparison session (see ``comparison.py``) is kept alongside the
+rankings, so it can be resumed from any device and its result written in
+the same transaction that retires it. Every comparison answer is also
+appended to a log of votes, the input of the ratings in ``rating.py``.
+
+Each metadata write bumps a revision counter, each ranking write bumps
+the ranking version, and each vote bumps the vote version. The media index compares both with the values it last
+loaded to decide what needs reloading.
+
+Projects that still have ``.media-meta.json`` or ``.ranking.json`` files are
+migrated the first time their store is opened. The JSON files are then
+renamed with a ``.migrated`` suffix and kept as a backup.
+"""
+from __future__ import annotations
+
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Support both `python app/main.py` and importing the `app` package
+try:
+    from . import comparison
+    from .ranking import key_between, sequential_keys
+except ImportError:
+    import comparison
+    from ranking import key_between, sequential_keys
+
+META_DIR_NAME = ".bestshot"
+META_DB_FILENAME = "media-meta.db"
+LEGACY_META_FILENAME = ".media-meta.json"
+LEGACY_RANKING_FILENAME = ".ranking.json"
+
+# Each entry upgrades the schema by one version (tracked in PRAGMA user_version).
+# Some versions also import a legacy JSON file (see ``_LEGACY_IMPORTS``).
+_MIGRATIONS = [
+    """
+    CREATE TABLE media_meta (
+        name TEXT PRIMARY KEY,
+        tags TEXT NOT NULL DEFAULT '[]',
+        comment TEXT NOT NULL DEFAULT '',
+        hash TEXT
+    );
+    CREATE INDEX media_meta_hash ON media_meta (hash);
+    CREATE TABLE revision (value INTEGER NOT NULL);
+    INSERT INTO revision (value) VALUES (0);
+    """,
+    """
+    CREATE TABLE rankings (
+        name TEXT PRIMARY KEY,
+        key TEXT NOT NULL
+    );
+    CREATE INDEX rankings_key ON rankings (key, name);
+    ALTER TABLE revision ADD COLUMN rankings INTEGER NOT NULL DEFAULT 0;
+    """,
+    """
+    CREATE TABLE comparison (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        scope TEXT NOT NULL,
+        media TEXT NOT NULL,
+        state TEXT NOT NULL,
+        started REAL NOT NULL,
+        updated REAL NOT NULL
+    );
+    """,
+    """
+    CREATE TABLE votes (
+        id INTEGER PRIMARY KEY,
+        left TEXT NOT NULL,
+        right TEXT NOT NULL,
+        outcome TEXT NOT NULL CHECK (outcome IN ('left', 'right', 'tie')),
+        voter TEXT,
+        created REAL NOT NULL
+    );
+    ALTER TABLE revision ADD COLUMN votes INTEGER NOT NULL DEFAULT 0;
+    """,
+    # A tiny preview of each image, made along with its thumbnails
+    """
+    ALTER TABLE media_meta ADD COLUMN placeholder TEXT;
+    """,
+]
+
+_UPSERT_META = """
+    INSERT INTO media_meta (name, tags, comment, hash, placeholder) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (name) DO UPDATE SET
+        tags = excluded.tags,
+        comment = excluded.comment,
+        hash = excluded.hash,
+        placeholder = excluded.placeholder
+"""
+
+
+def _empty_record() -> Dict:
+    return {"tags": [], "comment": "", "hash": None, "placeholder": None}
+
+
+def _record(row: sqlite3.Row) -> Dict:
+    return {
+        "tags": json.loads(row["tags"]),
+        "comment": row["comment"],
+        "hash": row["hash"],
+        "placeholder": row["placeholder"],
+    }
+
+
+def _clean_record(meta) -> Optional[Dict]:
+    """Coerce an entry of a legacy JSON file into a record, or None if unusable."""
+    if not isinstance(meta, dict):
+        return None
+    tags = meta.get("tags", [])
+    file_hash = meta.get("hash")
+    return {
+        "tags": [tag for tag in tags if isinstance(tag, str)] if isinstance(tags, list) else [],
+        "comment": str(meta.get("comment", "") or ""),
+        "hash": file_hash if isinstance(file_hash, str) else None,
+    }
+
+
+def _read_legacy_json(path: Path):
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def _import_legacy_meta(conn: sqlite3.Connection, folder: Path) -> None:
+    data = _read_legacy_json(folder / LEGACY_META_FILENAME)
+    if not isinstance(data, dict):
+        return
+    rows = []
+    for name, meta in data.items():
+        record = _clean_record(meta)
+        if record is not None:
+            rows.append((name, json.dumps(record["tags"]), record["comment"], record["hash"]))
+    # Runs as part of the first migration, before later columns exist
+    conn.executemany("INSERT INTO media_meta (name, tags, comment, hash) VALUES (?, ?, ?, ?)", rows)
+
+
+def _import_legacy_rankings(conn: sqlite3.Connection, folder: Path) -> None:
+    data = _read_legacy_json(folder / LEGACY_RANKING_FILENAME)
+    if not isinstance(data, list):
+        return
+    order = list(dict.fromkeys(str(name) for name in data))
+    conn.executemany(
+        "INSERT INTO rankings (name, key) VALUES (?, ?)",
+        zip(order, sequential_keys(len(order))),
+    )
+
+
+# Schema version -> (legacy file, importer) run as part of that migration
+_LEGACY_IMPORTS = {
+    1: (LEGACY_META_FILENAME, _import_legacy_meta),
+    2: (LEGACY_RANKING_FILENAME, _import_legacy_rankings),
+}
+
+
+def _file_identity(path: Path) -> Optional[Tuple[int, int, int]]:
+    # The ctime catches a file recreated under a recycled inode number; it
+    # also moves on checkpoints, which merely costs a reconnect.
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_dev, stat.st_ino, stat.st_ctime_ns
+
+
+def _bump_revision(conn: sqlite3.Connection) -> int:
+    conn.execute("UPDATE revision SET value = value + 1")
+    return conn.execute("SELECT value FROM revision").fetchone()[0]
+
+
+def _ranking_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("SELECT rankings FROM revision").fetchone()[0]
+
+
+def _bump_ranking_version(conn: sqlite3.Connection) -> int:
+    conn.execute("UPDATE revision SET rankings = rankings + 1")
+    return _ranking_version(conn)
+
+
+def _record_vote(conn: sqlite3.Connection, left: str, right: str, outcome: str,
+                 voter: Optional[str]) -> int:
+    conn.execute(
+        "INSERT INTO votes (left, right, outcome, voter, created) VALUES (?, ?, ?, ?, ?)",
+        (left, right, outcome, voter, time.time()),
+    )
+    conn.execute("UPDATE revision SET votes = votes + 1")
+    return conn.execute("SELECT votes FROM revision").fetchone()[0]
+
+
+def _check_ranking_version(conn: sqlite3.Connection, expected: Optional[int]) -> None:
+    if expected is None:
+        return
+    current = conn.execute("SELECT rankings FROM revision").fetchone()[0]
+    if current != expected:
+        raise RankingConflict(current)
+
+
+def _replace_rankings(conn: sqlite3.Connection, order: List[str]) -> Dict[str, str]:
+    order = list(dict.fromkeys(order))
+    keys = dict(zip(order, sequential_keys(len(order))))
+    conn.execute("DELETE FROM rankings")
+    conn.executemany("INSERT INTO rankings (name, key) VALUES (?, ?)", keys.items())
+    return keys
+
+
+def _load_comparison(conn: sqlite3.Connection) -> Optional[Dict]:
+    row = conn.execute("SELECT * FROM comparison").fetchone()
+    if row is None:
+        return None
+    return {
+        "scope": row["scope"],
+        "media": row["media"],
+        "state": json.loads(row["state"]),
+        "started": row["started"],
+        "updated": row["updated"],
+    }
+
+
+def _save_comparison(conn: sqlite3.Connection, session: Dict) -> None:
+    session["updated"] = time.time()
+    conn.execute(
+        "INSERT OR REPLACE INTO comparison (id, scope, media, state, started, updated) "
+        "VALUES (1, ?, ?, ?, ?, ?)",
+        (session["scope"], session["media"], json.dumps(session["state"]),
+         session["started"], session["updated"]),
+    )
+
+
+def _observed(operation: str):
+    """Report how long a store method took to the store's observer, if it has one."""
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.observer is None:
+                return method(self, *args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.observer(operation, time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+
+class RankingConflict(Exception):
+    """The rankings changed since the version an edit was based on."""
+
+    def __init__(self, version: int) -> None:
+        super().__init__(f"Rankings are at version {version}")
+        self.version = version
+
+
+class ComparisonConflict(Exception):
+    """An answer was given to a question the session has moved past."""
+
+    def __init__(self, step: int) -> None:
+        super().__init__(f"The comparison is at step {step}")
+        self.step = step
+
+
+class MediaMetaStore:
+    """Per-file metadata of every project, one database per project folder."""
+
+    def __init__(self, observer: Optional[Callable[[str, float], None]] = None) -> None:
+        """``observer`` is called with ``"read"`` or ``"write"`` and the seconds each call took."""
+        self._local = threading.local()
+        self.observer = observer
+
+    @staticmethod
+    def db_path(folder: Path) -> Path:
+        return folder / META_DIR_NAME / META_DB_FILENAME
+
+    def _connection(self, folder: Path) -> sqlite3.Connection:
+        # One connection per thread and project, reopened after a fork
+        # (gunicorn workers) or when the database file was replaced, for
+        # example because the project was deleted and created again.
+        if getattr(self._local, "pid", None) != os.getpid():
+            self._local.conns = {}
+            self._local.pid = os.getpid()
+        path = self.db_path(folder)
+        cached = self._local.conns.get(path)
+        if cached is not None and cached[1] == _file_identity(path):
+            return cached[0]
+        if cached is not None:
+            cached[0].close()
+        conn = self._open(folder, path)
+        self._local.conns[path] = (conn, _file_identity(path))
+        return conn
+
+    def _open(self, folder: Path, path: Path) -> sqlite3.Connection:
+        # Never creates the project folder itself: a missing project raises
+        path.parent.mkdir(exist_ok=True)
+        conn = sqlite3.connect(str(path), timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if conn.execute("PRAGMA user_version").fetchone()[0] < len(_MIGRATIONS):
+            self._migrate(conn, folder)
+        return conn
+
+    def _migrate(self, conn: sqlite3.Connection, folder: Path) -> None:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Re-read under the write lock: another worker may have just migrated
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            imported = []
+            for target, script in enumerate(_MIGRATIONS[version:], start=version + 1):
+                for statement in script.split(";"):
+                    if statement.strip():
+                        conn.execute(statement)
+                if target in _LEGACY_IMPORTS:
+                    filename, importer = _LEGACY_IMPORTS[target]
+                    importer(conn, folder)
+                    imported.append(folder / filename)
+                conn.execute(f"PRAGMA user_version = {target}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        for legacy in imported:
+            if legacy.exists():
+                os.replace(legacy, legacy.with_name(legacy.name + ".migrated"))
+
+    @contextmanager
+    def _write(self, folder: Path) -> Iterator[sqlite3.Connection]:
+        """A write transaction.
+
+        ``BEGIN IMMEDIATE`` takes the write lock up front. Read-modify-write
+        edits therefore cannot interleave with another process's edits.
+        """
+        conn = self._connection(folder)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def close(self, folder: Path) -> None:
+        """Close this thread's connection to a project's store (before renaming or deleting it)."""
+        conns = getattr(self._local, "conns", {})
+        cached = conns.pop(self.db_path(folder), None)
+        if cached is not None:
+            cached[0].close()
+
+    # ============ Reads ============
+
+    @_observed("read")
+    def revision(self, folder: Path) -> int:
+        """Counter bumped by every write to the project's metadata."""
+        return self._connection(folder).execute("SELECT value FROM revision").fetchone()[0]
+
+    @_observed("read")
+    def load(self, folder: Path) -> Tuple[Dict[str, Dict], int]:
+        """Every record of a project, with the revision they were read at."""
+        conn = self._connection(folder)
+        conn.execute("BEGIN")
+        try:
+            records = {row["name"]: _record(row) for row in conn.execute("SELECT * FROM media_meta")}
+            revision = conn.execute("SELECT value FROM revision").fetchone()[0]
+        finally:
+            conn.execute("COMMIT")
+        return records, revision
+
+    @_observed("read")
+    def get(self, folder: Path, name: str) -> Dict:
+        row = self._connection(folder).execute(
+            "SELECT * FROM media_meta WHERE name = ?", (name,)
+        ).fetchone()
+        return _record(row) if row else _empty_record()
+
+    @_observed("read")
+    def hashes(self, folder: Path) -> Dict[str, str]:
+        """Map each stored upload hash to the file it belongs to."""
+        return {
+            row["hash"]: row["name"]
+            for row in self._connection(folder).execute(
+                "SELECT name, hash FROM media_meta WHERE hash IS NOT NULL"
+            )
+        }
+
+    @_observed("read")
+    def tags(self, folder: Path) -> List[str]:
+        """Every distinct tag used in the project, sorted."""
+        return [
+            row[0]
+            for row in self._connection(folder).execute(
+                "SELECT DISTINCT value FROM media_meta, json_each(media_meta.tags) ORDER BY value"
+            )
+        ]
+
+    # ============ Writes ============
+    # Each write returns the updated records and the new revision, so callers
+    # can apply the change to the media index row by row.
+
+    @_observed("write")
+    def update(self, folder: Path, changes: Dict[str, Dict]) -> Tuple[Dict[str, Dict], int]:
+        """Set some fields (``tags``, ``comment``, ``hash``, ``placeholder``) of some files."""
+        records = {}
+        with self._write(folder) as conn:
+            for name, fields in changes.items():
+                row = conn.execute("SELECT * FROM media_meta WHERE name = ?", (name,)).fetchone()
+                record = _record(row) if row else _empty_record()
+                record.update(fields)
+                conn.execute(
+                    _UPSERT_META,
+                    (name, json.dumps(record["tags"]), record["comment"], record["hash"],
+                     record["placeholder"]),
+                )
+                records[name] = record
+            revision = _bump_revision(conn)
+        return records, revision
+
+    @_observed("write")
+    def edit_tags(self, folder: Path, names: Iterable[str], add: Iterable[str],
+                  remove: Iterable[str]) -> Tuple[Dict[str, Dict], int]:
+        """Add and remove tags on several files, keeping each file's tag order."""
+        add = list(dict.fromkeys(add))
+        remove = set(remove)
+        records = {}
+        with self._write(folder) as conn:
+            for name in names:
+                row = conn.execute("SELECT * FROM media_meta WHERE name = ?", (name,)).fetchone()
+                record = _record(row) if row else _empty_record()
+                tags = [tag for tag in record["tags"] if tag not in remove]
+                tags += [tag for tag in add if tag not in tags and tag not in remove]
+                record["tags"] = tags
+                conn.execute(
+                    _UPSERT_META,
+                    (name, json.dumps(tags), record["comment"], record["hash"], record["placeholder"]),
+                )
+                records[name] = record
+            revision = _bump_revision(conn)
+        return records, revision
+
+    @_observed("write")
+    def delete(self, folder: Path, names: Iterable[str]) -> int:
+        """Forget the metadata of some files; returns the new revision."""
+        with self._write(folder) as conn:
+            conn.executemany("DELETE FROM media_meta WHERE name = ?", [(name,) for name in names])
+            revision = _bump_revision(conn)
+        return revision
+
+    @_observed("write")
+    def rename(self, folder: Path, old: str, new: str) -> Tuple[int, int]:
+        """Carry a file's metadata, rank, votes and comparison place over to its new name.
+
+        Anything recorded for a file that already had the new name is
+        replaced. Returns the new revision and ranking version; the latter
+        only changes when either name was ranked.
+        """
+        with self._write(folder) as conn:
+            conn.execute("DELETE FROM media_meta WHERE name = ?", (new,))
+            conn.execute("UPDATE media_meta SET name = ? WHERE name = ?", (new, old))
+            reranked = conn.execute(
+                "DELETE FROM rankings WHERE name = ?", (new,)
+            ).rowcount + conn.execute(
+                "UPDATE rankings SET name = ? WHERE name = ?", (new, old)
+            ).rowcount
+            renamed_votes = conn.execute(
+                "UPDATE votes SET left = ? WHERE left = ?", (new, old)
+            ).rowcount + conn.execute(
+                "UPDATE votes SET right = ? WHERE right = ?", (new, old)
+            ).rowcount
+            if renamed_votes:
+                conn.execute("UPDATE revision SET votes = votes + 1")
+            session = _load_comparison(conn)
+            if session is not None:
+                comparison.rename(session["state"], old, new)
+                _save_comparison(conn, session)
+            revision = _bump_revision(conn)
+            version = _bump_ranking_version(conn) if reranked else _ranking_version(conn)
+        return revision, version
+
+    # ============ Rankings ============
+    # Ranking writes return the keys they set and the new ranking version.
+    # ``expected_version`` makes a write conditional: it raises
+    # ``RankingConflict`` if another edit landed first.
+
+    @_observed("read")
+    def ranking_version(self, folder: Path) -> int:
+        return _ranking_version(self._connection(folder))
+
+    @_observed("read")
+    def rankings(self, folder: Path) -> Tuple[List[Tuple[str, str]], int]:
+        """``(name, key)`` of every ranked file in order, with the ranking version."""
+        conn = self._connection(folder)
+        conn.execute("BEGIN")
+        try:
+            order = [
+                (row["name"], row["key"])
+                for row in conn.execute("SELECT name, key FROM rankings ORDER BY key, name")
+            ]
+            version = conn.execute("SELECT rankings FROM revision").fetchone()[0]
+        finally:
+            conn.execute("COMMIT")
+        return order, version
+
+    @_observed("write")
+    def set_order(self, folder: Path, order: List[str],
+                  expected_version: Optional[int] = None) -> Tuple[Dict[str, str], int]:
+        """Replace the whole ranking with ``order``."""
+        with self._write(folder) as conn:
+            _check_ranking_version(conn, expected_version)
+            keys = _replace_rankings(conn, order)
+            version = _bump_ranking_version(conn)
+        return keys, version
+
+    @_observed("write")
+    def move(self, folder: Path, name: str, before: Optional[str] = None,
+             after: Optional[str] = None, append: Iterable[str] = (),
+             expected_version: Optional[int] = None) -> Tuple[Dict[str, str], int]:
+        """Rank ``name`` directly before ``before`` or after ``after``, or last if neither is given.
+
+        ``append`` names unranked files to rank at the end first, in order,
+        so that an unranked file can serve as the reference. Raises
+        ``LookupError`` if the reference file is not ranked.
+        """
+        if name in (before, after):
+            raise ValueError("A file cannot be moved relative to itself")
+        keys: Dict[str, str] = {}
+        with self._write(folder) as conn:
+            _check_ranking_version(conn, expected_version)
+            last = conn.execute(
+                "SELECT key FROM rankings WHERE name != ? ORDER BY key DESC, name DESC LIMIT 1",
+                (name,),
+            ).fetchone()
+            last_key = last["key"] if last else None
+            for other in append:
+                if other == name:
+                    continue
+                exists = conn.execute("SELECT 1 FROM rankings WHERE name = ?", (other,)).fetchone()
+                if exists is None:
+                    last_key = keys[other] = key_between(last_key, None)
+                    conn.execute("INSERT INTO rankings (name, key) VALUES (?, ?)", (other, last_key))
+
+            reference = before if before is not None else after
+            if reference is None:
+                low, high = last_key, None
+            else:
+                row = conn.execute("SELECT key FROM rankings WHERE name = ?", (reference,)).fetchone()
+                if row is None:
+                    raise LookupError(reference)
+                if before is not None:
+                    neighbour = conn.execute(
+                        "SELECT key FROM rankings WHERE (key, name) < (?, ?) AND name != ? "
+                        "ORDER BY key DESC, name DESC LIMIT 1",
+                        (row["key"], reference, name),
+                    ).fetchone()
+                    low, high = (neighbour["key"] if neighbour else None), row["key"]
+                else:
+                    neighbour = conn.execute(
+                        "SELECT key FROM rankings WHERE (key, name) > (?, ?) AND name != ? "
+                        "ORDER BY key, name LIMIT 1",
+                        (row["key"], reference, name),
+                    ).fetchone()
+                    low, high = row["key"], (neighbour["key"] if neighbour else None)
+            keys[name] = key_between(low, high)
+            conn.execute(
+                "INSERT INTO rankings (name, key) VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET key = excluded.key",
+                (name, keys[name]),
+            )
+            version = _bump_ranking_version(conn)
+        return keys, version
+
+    @_observed("write")
+    def unrank(self, folder: Path, names: Iterable[str]) -> int:
+        """Drop files from the ranking and any comparison session; returns the ranking version.
+
+        The version only changes when one of the files was ranked.
+        """
+        names = list(names)
+        with self._write(folder) as conn:
+            unranked = conn.execute(
+                "DELETE FROM rankings WHERE name IN (SELECT value FROM json_each(?))", (json.dumps(names),)
+            ).rowcount
+            session = _load_comparison(conn)
+            if session is not None:
+                comparison.drop(session["state"], names)
+                _save_comparison(conn, session)
+            version = _bump_ranking_version(conn) if unranked else _ranking_version(conn)
+        return version
+
+    # ============ Comparison sessions ============
+    # A project has at most one session; starting a new one replaces it.
+
+    @_observed("read")
+    def comparison(self, folder: Path) -> Optional[Dict]:
+        """The project's comparison session: ``scope``, ``media``, ``state``, ``started``, ``updated``."""
+        return _load_comparison(self._connection(folder))
+
+    @_observed("write")
+    def start_comparison(self, folder: Path, scope: str, media: str, ranked: List[str],
+                         pending: List[str]) -> Dict:
+        """Start a session placing ``pending`` into the order ``ranked``."""
+        now = time.time()
+        session = {
+            "scope": scope,
+            "media": media,
+            "state": comparison.new_session(ranked, pending),
+            "started": now,
+            "updated": now,
+        }
+        with self._write(folder) as conn:
+            _save_comparison(conn, session)
+        return session
+
+    @_observed("write")
+    def answer_comparison(self, folder: Path, step: int, winner: str,
+                          voter: Optional[str] = None) -> Dict:
+        """Apply an answer to the question at ``step`` and log it as a vote.
+
+        Raises ``LookupError`` if there is no session or nothing left to ask,
+        and ``ComparisonConflict`` if the session has moved past ``step``,
+        for example because the same question was answered on another device.
+        """
+        with self._write(folder) as conn:
+            session = _load_comparison(conn)
+            if session is None:
+                raise LookupError("No comparison session")
+            if session["state"]["step"] != step:
+                raise ComparisonConflict(session["state"]["step"])
+            pair = comparison.question(session["state"])
+            comparison.answer(session["state"], winner)
+            _record_vote(conn, *pair, winner, voter)
+            _save_comparison(conn, session)
+        return session
+
+    @_observed("write")
+    def finish_comparison(self, folder: Path, existing: Iterable[str],
+                          expected_version: Optional[int] = None) -> Tuple[Dict[str, str], int]:
+        """Write the session's order into the ranking and end the session.
+
+        Unplaced files stay in the order they had when the whole project was
+        being compared, and stay unranked when only new files were. Files
+        not in ``existing`` are left out. Raises ``LookupError`` if there is
+        no session.
+        """
+        existing = set(existing)
+        with self._write(folder) as conn:
+            _check_ranking_version(conn, expected_version)
+            session = _load_comparison(conn)
+            if session is None:
+                raise LookupError("No comparison session")
+            order = comparison.final_order(session["state"], session["scope"] == "all")
+            ranking = [row["name"] for row in conn.execute("SELECT name FROM rankings ORDER BY key, name")]
+            merged = [name for name in comparison.merge(ranking, order) if name in existing]
+            keys = _replace_rankings(conn, merged)
+            conn.execute("DELETE FROM comparison")
+            version = _bump_ranking_version(conn)
+        return keys, version
+
+    @_observed("write")
+    def discard_comparison(self, folder: Path) -> bool:
+        """End the session without changing the ranking; False if there was none."""
+        with self._write(folder) as conn:
+            return conn.execute("DELETE FROM comparison").rowcount > 0
+
+    # ============ Votes ============
+    # An append-only log of pairwise answers from everyone ranking the
+    # project. ``outcome`` names the preferred side, or ``tie``.
+
+    @_observed("read")
+    def votes_version(self, folder: Path) -> int:
+        return self._connection(folder).execute("SELECT votes FROM revision").fetchone()[0]
+
+    @_observed("read")
+    def votes(self, folder: Path) -> Tuple[List[Tuple[str, str, str]], int]:
+        """``(left, right, outcome)`` of every vote in order, with the vote version."""
+        conn = self._connection(folder)
+        conn.execute("BEGIN")
+        try:
+            votes = [
+                (row["left"], row["right"], row["outcome"])
+                for row in conn.execute("SELECT left, right, outcome FROM votes ORDER BY id")
+            ]
+            version = conn.execute("SELECT votes FROM revision").fetchone()[0]
+        finally:
+            conn.execute("COMMIT")
+        return votes, version
+
+    @_observed("read")
+    def vote_counts(self, folder: Path) -> Tuple[int, int]:
+        """How many votes were cast, and by how many distinct voters."""
+        row = self._connection(folder).execute(
+            "SELECT COUNT(*), COUNT(DISTINCT voter) FROM votes"
+        ).fetchone()
+        return row[0], row[1]
+
+    @_observed("write")
+    def add_vote(self, folder: Path, left: str, right: str, outcome: str,
+                 voter: Optional[str] = None) -> int:
+        """Log one vote; returns the new vote version."""
+        with self._write(folder) as conn:
+            return _record_vote(conn, left, right, outcome, voter)
+
+    @_observed("write")
+    def clear_votes(self, folder: Path) -> int:
+        """Forget every vote; returns the new vote version."""
+        with self._write(folder) as conn:
+            conn.execute("DELETE FROM votes")
+            conn.execute("UPDATE revision SET votes = votes + 1")
+            return conn.execute("SELECT votes FROM revision").fetchone()[0]
@@ -0,0 +1,191 @@
+"""Counters and histograms, shared by every worker and exposed to Prometheus.
+
+Each worker adds to its own counters in memory, which costs a dictionary
+update per observation. A background thread flushes the increments every
+few seconds into SQLite next to the media index, adding them to the totals
+there, and ``render`` flushes the serving worker's own increments before
+reading the totals. A scrape therefore sees every worker's counts, at most
+``FLUSH_INTERVAL`` seconds late for the others, and counts from workers
+that have since exited are kept.
+
+Histograms are stored as Prometheus exposes them: one cumulative counter
+per bucket plus ``_sum`` and ``_count``.
+"""
+from __future__ import annotations
+
+import atexit
+import math
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+FLUSH_INTERVAL = 5
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PER_MEGAPIXEL_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    "bestshot_http_requests_total": (
+        "counter", "Requests handled, by route, method and status.", None),
+    "bestshot_http_errors_total": (
+        "counter", "Requests answered with a 4xx or 5xx status, by route, method and status.", None),
+    "bestshot_http_request_duration_seconds": (
+        "histogram", "Time to produce a response, by route and method.", LATENCY_BUCKETS),
+    "bestshot_http_response_bytes_total": (
+        "counter", "Response body bytes sent by the app, by route.", None),
+    "bestshot_thumbnails_generated_total": (
+        "counter", "Images whose thumbnails were generated.", None),
+    "bestshot_thumbnail_failures_total": (
+        "counter", "Images whose thumbnails could not be generated.", None),
+    "bestshot_thumbnail_seconds_total": (
+        "counter", "Time spent generating thumbnails.", None),
+    "bestshot_thumbnail_megapixels_total": (
+        "counter", "Megapixels of the images thumbnails were generated for.", None),
+    "bestshot_thumbnail_seconds_per_megapixel": (
+        "histogram", "Thumbnail generation time per megapixel of the source image.", PER_MEGAPIXEL_BUCKETS),
+    "bestshot_metadata_duration_seconds": (
+        "histogram", "Time spent reading and writing metadata, by store and operation.", LATENCY_BUCKETS),
+}
+
+_MIGRATIONS = [
+    """
+    CREATE TABLE samples (
+        name TEXT NOT NULL,
+        labels TEXT NOT NULL,
+        value REAL NOT NULL,
+        PRIMARY KEY (name, labels)
+    );
+    """,
+]
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(labels: Labels) -> str:
+    return ",".join(f'{key}="{_escape(str(value))}"' for key, value in labels)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(int(value)) if value == int(value) else repr(value)
+
+
+def _sort_key(row) -> tuple:
+    # Buckets in increasing order of their bound, which is always the last label
+    name, labels, _ = row
+    if name.endswith("_bucket"):
+        rest, _, bound = labels.rpartition('le="')
+        return name, rest, float(bound.rstrip('"'))
+    return name, labels, 0.0
+
+
+class Metrics:
+    """Counters and histograms of one project root, aggregated across processes."""
+
+    def __init__(self, db_path: Path) -> None:
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pending: Dict[Tuple[str, str], float] = {}
+        self._pid = os.getpid()
+        self._flusher: Optional[threading.Thread] = None
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for target, script in enumerate(_MIGRATIONS[version:], start=version + 1):
+                conn.executescript(f"BEGIN; {script}; PRAGMA user_version = {target}; COMMIT;")
+        atexit.register(self.flush)
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread, reopened after a fork (gunicorn workers).
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(str(self.db_path), timeout=30)
+            # Losing the last few increments in a power cut is fine
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = self._connection()
+        with conn:
+            yield conn
+
+    def _add(self, name: str, labels: Labels, value: float) -> None:
+        key = (name, _label_text(labels))
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked: the parent's increments are the parent's to flush
+                self._pending = {}
+                self._pid = os.getpid()
+                self._flusher = None
+            self._pending[key] = self._pending.get(key, 0.0) + value
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+                self._flusher.start()
+
+    def inc(self, name: str, labels: Labels = (), value: float = 1.0) -> None:
+        """Add ``value`` to a counter."""
+        self._add(name, labels, value)
+
+    def observe(self, name: str, value: float, labels: Labels = ()) -> None:
+        """Record one observation in a histogram."""
+        for bound in METRICS[name][2]:
+            if value <= bound:
+                self._add(f"{name}_bucket", labels + (("le", _format_value(bound)),), 1)
+        self._add(f"{name}_bucket", labels + (("le", "+Inf"),), 1)
+        self._add(f"{name}_sum", labels, value)
+        self._add(f"{name}_count", labels, 1)
+
+    def _flush_loop(self) -> None:
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self) -> None:
+        """Add this process's increments to the shared totals."""
+        with self._lock:
+            if self._pid != os.getpid() or not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO samples (name, labels, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value",
+                [(name, labels, value) for (name, labels), value in pending.items()],
+            )
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text format."""
+        self.flush()
+        series: Dict[str, List[Tuple[str, str, float]]] = {}
+        rows = self._connection().execute("SELECT name, labels, value FROM samples").fetchall()
+        for name, labels, value in sorted(rows, key=_sort_key):
+            base = name
+            for suffix in ("_bucket", "_sum", "_count"):
+                if name.endswith(suffix) and name[:-len(suffix)] in METRICS:
+                    base = name[:-len(suffix)]
+            series.setdefault(base, []).append((name, labels, value))
+        lines = []
+        for base, (kind, help_text, _) in METRICS.items():
+            lines.append(f"# HELP {base} {help_text}")
+            lines.append(f"# TYPE {base} {kind}")
+            for name, labels, value in series.get(base, []):
+                lines.append(f"{name}{{{labels}}} {_format_value(value)}" if labels
+                             else f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,264 @@
+"""Opt-in request profiling and a log of slow requests.
+
+A request is profiled when it carries the admin token in the ``X-Profile``
+header, or when it is picked at random at the configured sample rate. It
+runs under cProfile, and a background thread also samples its stack every
+few milliseconds. Both are written to the profile directory: ``.prof`` for
+``pstats`` and snakeviz, ``.collapsed`` (one ``frame;frame;frame count``
+line per stack) for flame graph tools such as speedscope or flamegraph.pl,
+and ``.json`` describing the request.
+
+Requests that take longer than the slow threshold are appended to
+``slow-requests.jsonl`` with their route, project size and the stacks they
+spent their time in. The sampling thread starts taking their stack once
+they pass the threshold, so fast requests are never sampled. With profiling
+and the slow log both off, a request costs one attribute check.
+"""
+from __future__ import annotations
+
+import cProfile
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+DEFAULT_SLOW_SECONDS = 3.0
+# How often the stacks of profiled requests, and of requests past the slow
+# threshold, are sampled, and how often other requests are checked against
+# the threshold
+SAMPLE_INTERVAL = 0.005
+WATCH_INTERVAL = 0.1
+# Profiles kept; the oldest are removed first
+MAX_PROFILES = 200
+SLOW_LOG_FILENAME = "slow-requests.jsonl"
+SLOW_LOG_MAX_BYTES = 10 * 1024 * 1024
+# Stacks and innermost frames kept in a slow-request entry
+SUMMARY_STACKS = 5
+SUMMARY_FRAMES = 12
+PROFILE_SUFFIXES = (".prof", ".collapsed", ".json")
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9_-]+")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frame) -> str:
+    """A stack as a collapsed line, outermost frame first."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class _Request:
+    __slots__ = ("thread_id", "started", "profiled", "profile", "stacks")
+
+    def __init__(self, profiled: bool) -> None:
+        self.thread_id = threading.get_ident()
+        self.started = time.perf_counter()
+        self.profiled = profiled
+        self.profile: Optional[cProfile.Profile] = None
+        self.stacks: Counter = Counter()
+
+
+class RequestProfiler:
+    """Profiles flagged or sampled requests and logs slow ones, writing both to ``directory``."""
+
+    def __init__(self, directory: Path, sample_rate: float = 0.0, token: Optional[str] = None,
+                 slow_seconds: float = DEFAULT_SLOW_SECONDS) -> None:
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("PROFILE_SAMPLE_RATE must be between 0 and 1")
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.token = token or None
+        self.slow_seconds = slow_seconds
+        self.enabled = bool(sample_rate or self.token or slow_seconds > 0)
+        self._active: Dict[int, _Request] = {}
+        self._lock = threading.Lock()
+        self._sampler_pid: Optional[int] = None
+        # Set when a profiled request starts, so sampling starts at once
+        self._wake = threading.Event()
+
+    def _start_sampler(self) -> None:
+        # One sampling thread per process, started again after a fork
+        if self._sampler_pid != os.getpid():
+            self._sampler_pid = os.getpid()
+            threading.Thread(target=self._sample_loop, daemon=True).start()
+
+    def _sample_loop(self) -> None:
+        pid = os.getpid()
+        while self._sampler_pid == pid:
+            with self._lock:
+                active = list(self._active.values())
+            now = time.perf_counter()
+            frames = None
+            sampling = False
+            for entry in active:
+                if entry.profiled or (self.slow_seconds > 0 and now - entry.started >= self.slow_seconds):
+                    sampling = True
+                    frames = frames if frames is not None else sys._current_frames()
+                    frame = frames.get(entry.thread_id)
+                    if frame is not None:
+                        entry.stacks[_collapse(frame)] += 1
+            frames = None
+            self._wake.wait(SAMPLE_INTERVAL if sampling else WATCH_INTERVAL)
+            self._wake.clear()
+
+    def begin(self, header: Optional[str]) -> Optional[_Request]:
+        """Start watching the current request; None when it needs no watching."""
+        if not self.enabled:
+            return None
+        profiled = (
+            (self.token is not None and header == self.token)
+            or (self.sample_rate > 0 and random.random() < self.sample_rate)
+        )
+        if not profiled and self.slow_seconds <= 0:
+            return None
+        entry = _Request(profiled)
+        if profiled:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                entry.profile = profile
+            except ValueError:
+                # Another profiler is active on this interpreter; keep the samples only
+                pass
+        with self._lock:
+            self._active[entry.thread_id] = entry
+            self._start_sampler()
+        if profiled:
+            self._wake.set()
+        return entry
+
+    def end(self, entry: _Request, describe: Callable[[], Dict]) -> Optional[str]:
+        """Stop watching a request and record what was captured; returns the profile id, if any.
+
+        ``describe`` says what the request was (method, route, status,
+        project and so on) for the profile and slow-log entry. It is only
+        called when there is something to record.
+        """
+        if entry.profile is not None:
+            entry.profile.disable()
+        duration = time.perf_counter() - entry.started
+        with self._lock:
+            self._active.pop(entry.thread_id, None)
+        slow = self.slow_seconds > 0 and duration >= self.slow_seconds
+        if not entry.profiled and not slow:
+            return None
+        description = {**describe(), "durationMs": round(duration * 1000, 1), "time": time.time()}
+        profile_id = self._write_profile(entry, description) if entry.profiled else None
+        if slow:
+            self._log_slow(entry, description, profile_id)
+        return profile_id
+
+    def discard(self, entry: _Request) -> None:
+        """Stop watching a request without recording it."""
+        if entry.profile is not None:
+            entry.profile.disable()
+        with self._lock:
+            self._active.pop(entry.thread_id, None)
+
+    def _write_profile(self, entry: _Request, description: Dict) -> str:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        route = _UNSAFE.sub("_", description.get("route", "request")).strip("_") or "root"
+        profile_id = (
+            f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{os.getpid()}"
+            f"-{description.get('method', '')}-{route}"
+        )
+        if entry.profile is not None:
+            entry.profile.dump_stats(str(self.directory / f"{profile_id}.prof"))
+        (self.directory / f"{profile_id}.collapsed").write_text(
+            "".join(f"{stack} {count}\n" for stack, count in entry.stacks.most_common())
+        )
+        (self.directory / f"{profile_id}.json").write_text(json.dumps({
+            **description, "id": profile_id, "samples": sum(entry.stacks.values()),
+        }))
+        self._prune()
+        return profile_id
+
+    def _prune(self) -> None:
+        described = sorted(self.directory.glob("*.json"), key=lambda path: path.stat().st_mtime)
+        for stale in described[:max(0, len(described) - MAX_PROFILES)]:
+            for suffix in PROFILE_SUFFIXES:
+                try:
+                    stale.with_suffix(suffix).unlink()
+                except FileNotFoundError:
+                    pass
+
+    def _log_slow(self, entry: _Request, description: Dict, profile_id: Optional[str]) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        log_path = self.directory / SLOW_LOG_FILENAME
+        line = json.dumps({
+            **description,
+            "profile": profile_id,
+            "samples": sum(entry.stacks.values()),
+            "stacks": [
+                {"stack": ";".join(stack.split(";")[-SUMMARY_FRAMES:]), "samples": count}
+                for stack, count in entry.stacks.most_common(SUMMARY_STACKS)
+            ],
+        })
+        # Appends of one line are atomic enough to share the file between workers
+        with open(log_path, "a") as log:
+            log.write(line + "\n")
+        try:
+            if log_path.stat().st_size > SLOW_LOG_MAX_BYTES:
+                os.replace(log_path, log_path.with_name(SLOW_LOG_FILENAME + ".1"))
+        except FileNotFoundError:
+            pass
+
+    # ============ Captured files ============
+
+    def profiles(self) -> List[Dict]:
+        """Descriptions of the captured profiles, newest first, with the names of their files."""
+        if not self.directory.is_dir():
+            return []
+        profiles = []
+        for path in self.directory.glob("*.json"):
+            try:
+                description = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            description["files"] = [
+                path.with_suffix(suffix).name for suffix in PROFILE_SUFFIXES
+                if path.with_suffix(suffix).exists()
+            ]
+            profiles.append(description)
+        profiles.sort(key=lambda description: description.get("time", 0), reverse=True)
+        return profiles
+
+    def captured_file(self, name: str) -> Optional[Path]:
+        """The path of a profile file or slow log named ``name``, or None if there is no such file."""
+        allowed = name.endswith(PROFILE_SUFFIXES) or name in (SLOW_LOG_FILENAME, SLOW_LOG_FILENAME + ".1")
+        if not allowed or "/" in name or "\\" in name or name.startswith("."):
+            return None
+        path = self.directory / name
+        return path if path.is_file() else None
+
+    def slow_requests(self, limit: int) -> List[Dict]:
+        """The most recent slow-request entries, newest first."""
+        try:
+            lines = (self.directory / SLOW_LOG_FILENAME).read_text().splitlines()
+        except FileNotFoundError:
+            return []
+        entries = []
+        for line in reversed(lines):
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+            if len(entries) >= limit:
+                break
+        return entries
@@ -0,0 +1,132 @@
+"""Fractional rank keys.
+
+A project's order is stored as one string key per ranked file, and files
+sort by key. Moving a file only gives it a new key that sorts between its
+new neighbours, so no other file's key changes.
+
+Keys are base-62 digit strings compared as plain ASCII (SQLite's default
+BINARY collation agrees). A key is a variable-length integer part followed
+by an optional fraction. The integer's first character encodes its length:
+``a``-``z`` for 1-26 digits counting up, ``Z``-``A`` for 1-26 digits counting
+down. Appending or prepending increments or decrements the integer, so keys
+grow logarithmically even when new items always go at the same end.
+Inserting between two keys extends the fraction. A fraction never ends in
+the lowest digit, so there is always room for another key in between.
+"""
+from __future__ import annotations
+
+from typing import List, Optional
+
+DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+BASE = len(DIGITS)
+INTEGER_ZERO = "a0"
+SMALLEST_INTEGER = "A" + DIGITS[0] * 26
+_VALUES = {digit: value for value, digit in enumerate(DIGITS)}
+
+
+def key_between(before: Optional[str], after: Optional[str]) -> str:
+    """A key sorting strictly between ``before`` and ``after`` (None for an open end)."""
+    if before is not None and after is not None and before >= after:
+        raise ValueError(f"{before!r} does not sort before {after!r}")
+    if before is None and after is None:
+        return INTEGER_ZERO
+    if before is None:
+        integer = _integer_part(after)
+        if integer == SMALLEST_INTEGER:
+            return integer + _midpoint("", after[len(integer):])
+        if integer < after:
+            return integer
+        return _decrement(integer)
+    integer = _integer_part(before)
+    fraction = before[len(integer):]
+    if after is not None and _integer_part(after) == integer:
+        return integer + _midpoint(fraction, after[len(integer):])
+    following = _increment(integer)
+    if following is not None and (after is None or following < after):
+        return following
+    return integer + _midpoint(fraction, None)
+
+
+def sequential_keys(count: int) -> List[str]:
+    """``count`` increasing keys for a whole new order, using integers only."""
+    keys = []
+    key = INTEGER_ZERO
+    for _ in range(count):
+        keys.append(key)
+        key = _increment(key)
+    return keys
+
+
+def _integer_length(head: str) -> int:
+    if "a" <= head <= "z":
+        return ord(head) - ord("a") + 2
+    if "A" <= head <= "Z":
+        return ord("Z") - ord(head) + 2
+    raise ValueError(f"Invalid rank key head {head!r}")
+
+
+def _integer_part(key: str) -> str:
+    length = _integer_length(key[0])
+    if length > len(key):
+        raise ValueError(f"Invalid rank key {key!r}")
+    return key[:length]
+
+
+def _increment(integer: str) -> Optional[str]:
+    """The next integer, or None past the largest one."""
+    head, digits = integer[0], list(integer[1:])
+    for i in reversed(range(len(digits))):
+        value = _VALUES[digits[i]] + 1
+        if value < BASE:
+            digits[i] = DIGITS[value]
+            return head + "".join(digits)
+        digits[i] = DIGITS[0]
+    if head == "Z":
+        return INTEGER_ZERO
+    if head == "z":
+        return None
+    head = chr(ord(head) + 1)
+    if head > "a":
+        digits.append(DIGITS[0])
+    else:
+        digits.pop()
+    return head + "".join(digits)
+
+
+def _decrement(integer: str) -> str:
+    head, digits = integer[0], list(integer[1:])
+    for i in reversed(range(len(digits))):
+        value = _VALUES[digits[i]] - 1
+        if value >= 0:
+            digits[i] = DIGITS[value]
+            return head + "".join(digits)
+        digits[i] = DIGITS[-1]
+    if head == "a":
+        return "Z" + DIGITS[-1]
+    if head == "A":
+        raise ValueError("No rank key sorts before the smallest integer")
+    head = chr(ord(head) - 1)
+    if head < "Z":
+        digits.append(DIGITS[-1])
+    else:
+        digits.pop()
+    return head + "".join(digits)
+
+
+def _midpoint(low: str, high: Optional[str]) -> str:
+    """A fraction strictly between ``low`` and ``high`` (None for no upper bound)."""
+    if high is not None:
+        # Skip the shared prefix, treating a missing digit of ``low`` as the lowest
+        shared = 0
+        while (low[shared] if shared < len(low) else DIGITS[0]) == high[shared]:
+            shared += 1
+        if shared:
+            return high[:shared] + _midpoint(low[shared:], high[shared:])
+    low_digit = _VALUES[low[0]] if low else 0
+    high_digit = _VALUES[high[0]] if high is not None else BASE
+    if high_digit - low_digit > 1:
+        return DIGITS[(low_digit + high_digit + 1) // 2]
+    # Adjacent digits: keep the lower one and look for room further right
+    if high is not None and len(high) > 1:
+        return high[0]
+    return DIGITS[low_digit] + _midpoint(low[1:], None)
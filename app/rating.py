@@ -0,0 +1,152 @@
+"""Ratings fitted to the pairwise votes of several people.
+
+Every comparison answer in a project is kept as a vote, including ties and
+votes from people who disagree with each other. The ratings are a
+Bradley-Terry model of that log: each file has a strength ``g``, and a file
+beats another with probability ``g_a / (g_a + g_b)``. A tie counts as half a
+win for each side. Contradictory votes simply pull the two strengths
+towards each other.
+
+The model is fitted with Hunter's MM iteration, which needs no matrix
+algebra. Each file also plays one virtual tied game against a reference of
+strength 1, so files with few votes stay near the middle rather than
+running off to infinity. Fitting starts from the previous ratings, so
+after a single new vote it converges in a few passes over the pairs.
+
+Ratings are reported on the familiar Elo scale (1500 for an average file,
+400 points for 10:1 odds). Each has a 95% interval from the Fisher
+information of the fit, which narrows as the file collects votes.
+
+``next_pair`` picks the comparison expected to teach the model most: two
+files whose outcome is uncertain (``p(1 - p)`` is large) and whose ratings
+are themselves uncertain. Ranking this way needs far fewer votes to become
+stable than asking about random pairs.
+"""
+from __future__ import annotations
+
+import math
+import random
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+OUTCOMES = ("left", "right", "tie")
+BASE_RATING = 1500.0
+# Elo points per unit of log-strength: 400 points for 10:1 odds
+ELO_SCALE = 400 / math.log(10)
+# Virtual tied games each file plays against the reference
+PRIOR_GAMES = 1.0
+Z_95 = 1.96
+MAX_ITERATIONS = 200
+TOLERANCE = 1e-6
+# Files with the widest intervals considered as one side of the next pair
+ACTIVE_CANDIDATES = 16
+
+# name -> (rating, low, high, votes)
+Rating = Tuple[float, float, float, int]
+
+
+def to_rating(strength: float) -> float:
+    return BASE_RATING + ELO_SCALE * math.log(strength)
+
+
+def to_strength(rating: float) -> float:
+    return math.exp((rating - BASE_RATING) / ELO_SCALE)
+
+
+def _tally(votes: Iterable[Tuple[str, str, str]]):
+    """Games per pair, and wins per file with ties counted as halves."""
+    games: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    wins: Dict[str, float] = defaultdict(float)
+    for left, right, outcome in votes:
+        if left == right or outcome not in OUTCOMES:
+            continue
+        games[left][right] += 1
+        games[right][left] += 1
+        if outcome == "left":
+            wins[left] += 1
+        elif outcome == "right":
+            wins[right] += 1
+        else:
+            wins[left] += 0.5
+            wins[right] += 0.5
+    return games, wins
+
+
+def fit(votes: Iterable[Tuple[str, str, str]],
+        initial: Optional[Dict[str, float]] = None) -> Dict[str, Rating]:
+    """Ratings of every file that appears in ``votes`` (``(left, right, outcome)``).
+
+    ``initial`` holds earlier ratings to start from.
+    """
+    games, wins = _tally(votes)
+    initial = initial or {}
+    strength = {
+        name: to_strength(initial[name]) if initial.get(name) is not None else 1.0
+        for name in games
+    }
+    for _ in range(MAX_ITERATIONS):
+        change = 0.0
+        for name, opponents in games.items():
+            own = strength[name]
+            expected = PRIOR_GAMES / (own + 1.0)
+            for other, count in opponents.items():
+                expected += count / (own + strength[other])
+            updated = (wins[name] + PRIOR_GAMES / 2) / expected
+            change = max(change, abs(math.log(updated / own)))
+            strength[name] = updated
+        if change < TOLERANCE:
+            break
+
+    ratings = {}
+    for name, opponents in games.items():
+        own = strength[name]
+        # Fisher information of the log-strength, prior game included
+        information = PRIOR_GAMES * own / (own + 1.0) ** 2
+        for other, count in opponents.items():
+            information += count * own * strength[other] / (own + strength[other]) ** 2
+        margin = Z_95 * ELO_SCALE / math.sqrt(information)
+        rating = to_rating(own)
+        ratings[name] = (rating, rating - margin, rating + margin, int(sum(opponents.values())))
+    return ratings
+
+
+def unrated() -> Rating:
+    """The rating of a file nobody has voted on yet: the prior alone."""
+    margin = Z_95 * ELO_SCALE / math.sqrt(PRIOR_GAMES / 4)
+    return BASE_RATING, BASE_RATING - margin, BASE_RATING + margin, 0
+
+
+def _variance(rating: Rating) -> float:
+    return ((rating[2] - rating[1]) / (2 * Z_95 * ELO_SCALE)) ** 2
+
+
+def _information_gain(a: Rating, b: Rating) -> float:
+    # Expected information of one vote about the pair, weighted by how
+    # uncertain the two ratings are
+    p = 1.0 / (1.0 + math.exp((b[0] - a[0]) / ELO_SCALE))
+    return p * (1.0 - p) * (_variance(a) + _variance(b))
+
+
+def next_pair(ratings: Dict[str, Rating]) -> Optional[Tuple[str, str]]:
+    """The most informative pair to ask about next, or None with fewer than two files.
+
+    Only the files with the widest intervals are tried as the first side,
+    which keeps the search linear in the number of files. Equal candidates
+    are picked at random, so people voting at the same time are usually
+    shown different pairs.
+    """
+    if len(ratings) < 2:
+        return None
+    names: List[str] = list(ratings)
+    random.shuffle(names)
+    names.sort(key=lambda name: _variance(ratings[name]), reverse=True)
+    best = None
+    best_gain = -1.0
+    for first in names[:ACTIVE_CANDIDATES]:
+        for second in names:
+            if second == first:
+                continue
+            gain = _information_gain(ratings[first], ratings[second])
+            if gain > best_gain:
+                best, best_gain = (first, second), gain
+    return best
@@ -0,0 +1,113 @@
+"""Near-duplicate detection with perceptual hashes.
+
+Images get a 64-bit difference hash (dHash) when their thumbnails are made.
+Similar-looking shots have hashes a few bits apart, so near-duplicates are
+pairs within a small Hamming distance.
+
+The media index looks up neighbours with multi-index hashing. Each hash is
+split into four 16-bit chunks, each with its own index. Two hashes within
+distance ``d`` must agree to within ``d // 4`` bits in at least one chunk
+(pigeonhole), so a lookup only probes the buckets near each of the new
+hash's chunks. It never scans the whole project.
+"""
+from __future__ import annotations
+
+from itertools import combinations
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Pillow for hashing
+try:
+    from PIL import Image
+    PILLOW_AVAILABLE = True
+except ImportError:
+    PILLOW_AVAILABLE = False
+
+HASH_BITS = 64
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+DEFAULT_MAX_DISTANCE = 6
+# Neighbours are recorded up to this distance when an image is hashed
+MAX_DISTANCE_LIMIT = 10
+
+try:
+    _popcount = int.bit_count
+except AttributeError:  # Python < 3.10
+    def _popcount(value: int) -> int:
+        return bin(value).count("1")
+
+
+def dhash(img) -> int:
+    """64-bit difference hash: whether each pixel of a 9x8 grayscale is brighter than its right neighbour."""
+    small = img.convert("L").resize((9, 8), Image.Resampling.BOX)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(8):
+        offset = row * 9
+        for col in range(8):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def dhash_files(paths: List[Path]) -> List[Optional[int]]:
+    """dHash a batch of (thumbnail) images; None for any that cannot be read."""
+    results = []
+    for path in paths:
+        try:
+            with Image.open(path) as img:
+                results.append(dhash(img))
+        except Exception:
+            results.append(None)
+    return results
+
+
+def hamming(a: int, b: int) -> int:
+    return _popcount(a ^ b)
+
+
+def _flip_masks(radius: int) -> List[int]:
+    """Every chunk-sized mask with at most ``radius`` bits set."""
+    return [
+        sum(1 << bit for bit in bits)
+        for distance in range(radius + 1)
+        for bits in combinations(range(CHUNK_BITS), distance)
+    ]
+
+
+_FLIP_MASKS = [_flip_masks(radius) for radius in range(MAX_DISTANCE_LIMIT // CHUNKS + 1)]
+
+
+def chunk_probes(value: int, max_distance: int) -> List[List[int]]:
+    """For each chunk position, the chunk values a hash within ``max_distance`` could have there."""
+    masks = _FLIP_MASKS[max_distance // CHUNKS]
+    return [
+        [chunk ^ mask for mask in masks]
+        for chunk in ((value >> (position * CHUNK_BITS)) & CHUNK_MASK for position in range(CHUNKS))
+    ]
+
+
+def cluster_pairs(pairs: Iterable[Tuple[str, str]]) -> List[List[str]]:
+    """Group linked names into clusters (connected components), largest first."""
+    parent: Dict[str, str] = {}
+
+    def find(name: str) -> str:
+        parent.setdefault(name, name)
+        root = name
+        while parent[root] != root:
+            root = parent[root]
+        while parent[name] != root:
+            parent[name], name = root, parent[name]
+        return root
+
+    for a, b in pairs:
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[root_b] = root_a
+
+    clusters: Dict[str, List[str]] = {}
+    for name in parent:
+        clusters.setdefault(find(name), []).append(name)
+    result = [sorted(members) for members in clusters.values()]
+    result.sort(key=lambda members: (-len(members), members[0]))
+    return result
@@ -0,0 +1,240 @@
+"""Thumbnail generation.
+
+These functions run inside worker processes of the background pool, so they
+live at module level and only depend on Pillow.
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import io
+import os
+import re
+import time
+from pathlib import Path
+from typing import Container, Dict, List, Optional, Tuple
+
+# Pillow for thumbnails
+try:
+    from PIL import Image, ImageOps
+    PILLOW_AVAILABLE = True
+except ImportError:
+    PILLOW_AVAILABLE = False
+
+# Support both `python app/main.py` and importing the `app` package
+try:
+    from .exif import can_read_exif, read_exif
+    from .similarity import dhash
+except ImportError:
+    from exif import can_read_exif, read_exif
+    from similarity import dhash
+
+# Renditions, largest first: each one is downscaled from the one before it.
+THUMBNAIL_SIZES = (800, 400, 200)
+# The rendition behind `thumbUrl`, kept under its original file name
+DEFAULT_THUMBNAIL_SIZE = 400
+# Placeholders: a WebP this many pixels on its longest side, inlined in
+# listings as a data URI of about 200 characters
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 50
+
+
+_RENDITION_NAME = re.compile(r"(.+)_thumb(?:_\d+)?\.webp")
+
+
+def _stem_thumbnail_name(stem: str, size: int) -> str:
+    if size == DEFAULT_THUMBNAIL_SIZE:
+        return f"{stem}_thumb.webp"
+    return f"{stem}_thumb_{size}.webp"
+
+
+def thumbnail_name(filename: str, size: int = DEFAULT_THUMBNAIL_SIZE) -> str:
+    return _stem_thumbnail_name(Path(filename).stem, size)
+
+
+def thumbnail_names(filename: str) -> Dict[int, str]:
+    return {size: thumbnail_name(filename, size) for size in THUMBNAIL_SIZES}
+
+
+def thumbnail_mask(filename: str, existing: Container[str]) -> int:
+    """Bitmask of the renditions of ``filename`` found in ``existing``.
+
+    Bit ``i`` is set when the ``THUMBNAIL_SIZES[i]`` rendition exists.
+    """
+    mask = 0
+    for bit, size in enumerate(THUMBNAIL_SIZES):
+        if thumbnail_name(filename, size) in existing:
+            mask |= 1 << bit
+    return mask
+
+
+def thumbnail_sizes(mask: int) -> List[int]:
+    """Sizes present in a mask built by ``thumbnail_mask``, smallest first."""
+    return sorted(size for bit, size in enumerate(THUMBNAIL_SIZES) if mask & (1 << bit))
+
+
+ALL_THUMBNAILS_MASK = (1 << len(THUMBNAIL_SIZES)) - 1
+
+
+def _stem_version(thumbs_dir: Path, stem: str) -> Optional[str]:
+    parts = []
+    for size in THUMBNAIL_SIZES:
+        try:
+            stat = os.stat(thumbs_dir / _stem_thumbnail_name(stem, size))
+        except OSError:
+            continue
+        parts.append(f"{size}:{stat.st_size}:{stat.st_mtime_ns}")
+    if not parts:
+        return None
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()[:16]
+
+
+def thumbnail_version(thumbs_dir: Path, filename: str) -> Optional[str]:
+    """Version token of the thumbnails of ``filename``, or None if it has none.
+
+    Renditions are only ever replaced whole (written then renamed), so their
+    sizes and mtimes change whenever their content does. The token goes in
+    thumbnail URLs, which can then be cached as immutable.
+    """
+    return _stem_version(thumbs_dir, Path(filename).stem)
+
+
+def rendition_version(thumbs_dir: Path, thumb_name: str) -> Optional[str]:
+    """``thumbnail_version`` for the file a rendition name belongs to."""
+    match = _RENDITION_NAME.fullmatch(thumb_name)
+    return _stem_version(thumbs_dir, match.group(1)) if match else None
+
+
+def placeholder(img: "Image.Image") -> str:
+    """A tiny WebP of an image as a ``data:`` URI, shown scaled up while its thumbnail loads."""
+    tiny = img.convert("RGB") if img.mode != "RGB" else img.copy()
+    tiny.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.Resampling.BOX)
+    buffer = io.BytesIO()
+    tiny.save(buffer, "WEBP", quality=PLACEHOLDER_QUALITY, method=6)
+    return "data:image/webp;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def placeholder_files(paths: List[Path]) -> List[Optional[str]]:
+    """Placeholders of a batch of (thumbnail) images; None for any that cannot be read."""
+    results = []
+    for path in paths:
+        try:
+            with Image.open(path) as img:
+                results.append(placeholder(img))
+        except Exception:
+            results.append(None)
+    return results
+
+
+def can_thumbnail(file_path: Path) -> bool:
+    """Whether a thumbnail can be generated for an image file."""
+    # Skip HEIC for now as it requires additional support
+    return PILLOW_AVAILABLE and file_path.suffix.lower() != ".heic"
+
+
+def generate_thumbnail(
+    file_path: Path, thumbs_dir: Path
+) -> Optional[Tuple[str, int, Tuple[int, float, Dict], Tuple[float, float], str]]:
+    """Generate every thumbnail rendition for an image file.
+
+    Returns the name of the default rendition, the image's perceptual hash
+    (taken from the smallest rendition while it is still decoded), its
+    EXIF as ``(size, mtime, exif)``, ``(megapixels, seconds)`` of the
+    source image and the time taken, and its placeholder (also made from
+    the smallest rendition), or None on failure.
+    """
+    if not can_thumbnail(file_path):
+        return None
+
+    thumbs_dir.mkdir(exist_ok=True)
+    names = thumbnail_names(file_path.name)
+
+    try:
+        started = time.perf_counter()
+        stat = os.stat(file_path)
+        with Image.open(file_path) as img:
+            megapixels = img.size[0] * img.size[1] / 1_000_000
+            exif = read_exif(img) if can_read_exif(file_path) else {}
+            # Let the JPEG decoder scale down by up to 8x while decoding, as
+            # long as the result still covers the largest rendition.
+            largest = THUMBNAIL_SIZES[0]
+            img.draft("RGB", (largest, largest))
+
+            # Apply EXIF orientation if present (fixes rotation for vertical photos)
+            try:
+                img = ImageOps.exif_transpose(img)
+            except Exception:
+                # If exif_transpose fails, continue without rotation
+                pass
+
+            # Convert to RGB if necessary (for PNG with transparency, etc.)
+            if img.mode in ('RGBA', 'LA', 'P'):
+                background = Image.new('RGB', img.size, (0, 0, 0))
+                if img.mode == 'P':
+                    img = img.convert('RGBA')
+                background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
+                img = background
+            elif img.mode != 'RGB':
+                img = img.convert('RGB')
+
+            # Maintain aspect ratio, deriving each rendition from the previous one
+            for size in THUMBNAIL_SIZES:
+                img.thumbnail((size, size), Image.Resampling.LANCZOS)
+                # Write then rename so the gallery never fetches a half-written file
+                thumb_path = thumbs_dir / names[size]
+                tmp_path = thumb_path.with_name(f".{names[size]}.tmp")
+                img.save(tmp_path, 'WEBP', quality=80)
+                os.replace(tmp_path, thumb_path)
+            perceptual_hash = dhash(img)
+            preview = placeholder(img)
+        return (
+            names[DEFAULT_THUMBNAIL_SIZE], perceptual_hash, (stat.st_size, stat.st_mtime, exif),
+            (megapixels, time.perf_counter() - started), preview,
+        )
+    except Exception as e:
+        print(f"Failed to generate thumbnail for {file_path}: {e}")
+        return None
+
+
+def build_sprite_sheet(thumbs_dir: Path, names: List[str], size: int, dest: Path,
+                       columns: int) -> Optional[Tuple[Tuple[int, int], Dict[str, List[int]]]]:
+    """Pack the ``size`` renditions of ``names`` into one WebP sheet at ``dest``.
+
+    Renditions are laid out left to right in rows up to ``columns`` cells
+    of ``size`` wide, each row as tall as its tallest rendition. Returns
+    the sheet's ``(width, height)`` and ``[x, y, width, height]`` of every
+    file placed on it, or None when none of the renditions could be read.
+    Files whose rendition is missing or unreadable are left out.
+    """
+    tiles = []
+    for name in names:
+        try:
+            with Image.open(thumbs_dir / thumbnail_name(name, size)) as tile:
+                tile.load()
+                tiles.append((name, tile.convert("RGB") if tile.mode != "RGB" else tile))
+        except Exception as e:
+            print(f"Failed to read thumbnail of {name} for a sprite sheet: {e}")
+    if not tiles:
+        return None
+
+    row_width = columns * size
+    places: Dict[str, List[int]] = {}
+    x = y = row_height = width = 0
+    for name, tile in tiles:
+        if x and x + tile.width > row_width:
+            x, y, row_height = 0, y + row_height, 0
+        places[name] = [x, y, tile.width, tile.height]
+        x += tile.width
+        width = max(width, x)
+        row_height = max(row_height, tile.height)
+    height = y + row_height
+
+    sheet = Image.new("RGB", (width, height), (0, 0, 0))
+    for name, tile in tiles:
+        sheet.paste(tile, tuple(places[name][:2]))
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = dest.with_name(f".{dest.name}.{os.getpid()}.tmp")
+    # Sheets are large; a faster encoder setting costs them a few percent in size
+    sheet.save(tmp_path, "WEBP", quality=80, method=2)
+    os.replace(tmp_path, dest)
+    return (width, height), places
@@ -0,0 +1,324 @@
+"""Upload handling: hashing spools for form uploads and resumable uploads.
+
+Upload bodies are written straight into a staging folder inside the project
+while they are hashed, then renamed into place. Each file crosses the network
+once and is written to disk once, however large it is.
+
+Resumable uploads follow the core tus protocol (create, HEAD for the offset,
+PATCH to append, DELETE to abandon). Their state lives on disk beside the
+project, so any worker can continue an upload that another worker started.
+"""
+from __future__ import annotations
+
+import base64
+import binascii
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from flask import Request
+
+# Support both `python app/main.py` and importing the `app` package
+try:
+    from .hashing import ContentHasher
+except ImportError:
+    from hashing import ContentHasher
+
+# fcntl is POSIX-only; without it concurrent PATCHes to one upload are not locked out
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+TUS_VERSION = "1.0.0"
+UPLOADS_DIR_NAME = ".uploads"
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Staged files and resumable uploads are discarded after this long without progress
+UPLOAD_EXPIRY_SECONDS = 24 * 60 * 60
+# Incremental hash states kept in memory for resumable uploads in progress
+MAX_CACHED_HASHERS = 64
+# Bytes sampled from the head, middle and tail of a file for its fingerprint
+FINGERPRINT_SAMPLE_SIZE = 64 * 1024
+
+_UPLOAD_ID_RE = re.compile(r"[0-9a-f]{32}")
+
+
+class UploadBusyError(Exception):
+    """Another request is currently appending to the same resumable upload."""
+
+
+def uploads_dir(folder: Path) -> Path:
+    """The staging folder for uploads into a project."""
+    path = folder / UPLOADS_DIR_NAME
+    path.mkdir(exist_ok=True)
+    return path
+
+
+def parse_upload_metadata(header: str) -> Dict[str, str]:
+    """Parse a tus ``Upload-Metadata`` header (``key base64value`` pairs)."""
+    metadata = {}
+    for pair in header.split(","):
+        parts = pair.strip().split(" ", 1)
+        if not parts[0]:
+            continue
+        value = ""
+        if len(parts) == 2:
+            try:
+                value = base64.b64decode(parts[1], validate=True).decode("utf-8")
+            except (binascii.Error, UnicodeDecodeError):
+                continue
+        metadata[parts[0]] = value
+    return metadata
+
+
+def file_fingerprint(path: Path) -> str:
+    """SHA-256 of the first, middle and last 64 KiB of a file (all of it when small).
+
+    Browsers compute the same value with ``File.slice`` to learn which files
+    a project already holds before uploading anything. Together with the
+    exact size it tells files apart without reading whole videos.
+    """
+    size = path.stat().st_size
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        if size <= 3 * FINGERPRINT_SAMPLE_SIZE:
+            digest.update(f.read())
+        else:
+            for offset in (0, (size - FINGERPRINT_SAMPLE_SIZE) // 2, size - FINGERPRINT_SAMPLE_SIZE):
+                f.seek(offset)
+                digest.update(f.read(FINGERPRINT_SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+def prune_stale_uploads(folder: Path) -> None:
+    """Remove staged files left behind by uploads that stopped long ago."""
+    staging = folder / UPLOADS_DIR_NAME
+    if not staging.is_dir():
+        return
+    cutoff = time.time() - UPLOAD_EXPIRY_SECONDS
+    for entry in os.scandir(staging):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.unlink(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+class HashingSpool:
+    """Staged upload file that hashes everything written to it."""
+
+    def __init__(self, directory: Path) -> None:
+        fd, name = tempfile.mkstemp(dir=directory, prefix="form-", suffix=".part")
+        self.name = name
+        self.size = 0
+        self._file = os.fdopen(fd, "w+b")
+        self._hasher = ContentHasher()
+        self._committed = False
+
+    def write(self, data) -> int:
+        self._hasher.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def hexdigests(self) -> Tuple[str, str]:
+        """Return the ``(md5, digest)`` hashes of everything written."""
+        return self._hasher.hexdigests()
+
+    def commit(self, destination: Path) -> None:
+        """Move the finished upload into place."""
+        self._file.close()
+        os.replace(self.name, destination)
+        self._committed = True
+
+    def discard(self) -> None:
+        self._file.close()
+        if not self._committed:
+            try:
+                os.unlink(self.name)
+            except FileNotFoundError:
+                pass
+
+    def __getattr__(self, name):
+        # read/seek/readable/... for werkzeug's FileStorage
+        return getattr(self._file, name)
+
+
+class UploadRequest(Request):
+    """Request that spools file uploads into ``upload_dir`` once a view sets it.
+
+    Form parsing is lazy, so a view can point ``upload_dir`` at the project's
+    staging folder before touching ``request.files``. Files that the view
+    does not commit are deleted when the request closes.
+    """
+
+    upload_dir: Optional[Path] = None
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._spools: List[HashingSpool] = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.upload_dir is None:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        spool = HashingSpool(self.upload_dir)
+        self._spools.append(spool)
+        return spool
+
+    def close(self) -> None:
+        super().close()
+        for spool in self._spools:
+            spool.discard()
+
+
+class ResumableUploads:
+    """Resumable uploads, stored as ``<id>.part`` plus ``<id>.json`` in the staging folder.
+
+    The part file's size is the upload offset. Each process keeps the hash
+    state of uploads it is appending to, so a file is normally hashed as it
+    arrives. When a chunk lands on another worker, the hash catches up from
+    disk when the upload finishes.
+    """
+
+    def __init__(self) -> None:
+        self._hashers: "OrderedDict[str, Tuple[int, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _paths(folder: Path, upload_id: str) -> Optional[Tuple[Path, Path]]:
+        if not _UPLOAD_ID_RE.fullmatch(upload_id):
+            return None
+        staging = folder / UPLOADS_DIR_NAME
+        return staging / f"{upload_id}.part", staging / f"{upload_id}.json"
+
+    def create(self, folder: Path, filename: str, length: int) -> str:
+        prune_stale_uploads(folder)
+        upload_id = uuid.uuid4().hex
+        staging = uploads_dir(folder)
+        (staging / f"{upload_id}.part").touch()
+        record = {"filename": filename, "length": length, "created": time.time()}
+        (staging / f"{upload_id}.json").write_text(json.dumps(record))
+        return upload_id
+
+    def get(self, folder: Path, upload_id: str) -> Optional[Dict]:
+        """The upload's record with its current ``offset``, or None if unknown."""
+        paths = self._paths(folder, upload_id)
+        if paths is None:
+            return None
+        part_path, record_path = paths
+        try:
+            record = json.loads(record_path.read_text())
+            record["offset"] = part_path.stat().st_size
+        except (OSError, ValueError):
+            return None
+        return record
+
+    @contextmanager
+    def lock(self, folder: Path, upload_id: str) -> Iterator[Optional[Dict]]:
+        """Hold an upload exclusively while appending; yields None if it is unknown."""
+        paths = self._paths(folder, upload_id)
+        if paths is None or not paths[1].exists():
+            yield None
+            return
+        try:
+            lock_file = open(paths[1], "rb")
+        except FileNotFoundError:
+            yield None
+            return
+        with lock_file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise UploadBusyError(upload_id) from None
+            yield self.get(folder, upload_id)
+
+    def append(self, folder: Path, upload_id: str, upload: Dict, stream: BinaryIO) -> int:
+        """Append ``stream`` at the upload's offset, stopping at its length; returns the new offset."""
+        part_path, record_path = self._paths(folder, upload_id)
+        start = offset = upload["offset"]
+        remaining = upload["length"] - offset
+        with self._lock:
+            cached = self._hashers.pop(upload_id, None)
+        # Only hash in-stream when this process has seen every byte before `start`
+        if cached is not None and cached[0] == start:
+            hasher = cached[1]
+        elif start == 0:
+            hasher = ContentHasher()
+        else:
+            hasher = None
+        try:
+            with open(part_path, "ab") as out:
+                while remaining > 0:
+                    chunk = stream.read(min(UPLOAD_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    out.write(chunk)
+                    if hasher is not None:
+                        hasher.update(chunk)
+                    offset += len(chunk)
+                    remaining -= len(chunk)
+        finally:
+            # Whatever arrived before a dropped connection is kept for the resume
+            os.utime(record_path)
+            if hasher is not None:
+                self._remember(upload_id, offset, hasher)
+            elif cached is not None:
+                self._remember(upload_id, *cached)
+        return offset
+
+    def finish(self, folder: Path, upload_id: str, destination: Path) -> Tuple[str, str]:
+        """Move a complete upload into place and return its ``(md5, digest)`` hashes."""
+        part_path, record_path = self._paths(folder, upload_id)
+        with self._lock:
+            cached = self._hashers.pop(upload_id, None)
+        hashed, hasher = cached if cached is not None else (0, ContentHasher())
+        size = part_path.stat().st_size
+        if hashed > size:
+            hashed, hasher = 0, ContentHasher()
+        self._catch_up(hasher, part_path, hashed, size)
+        os.replace(part_path, destination)
+        record_path.unlink()
+        return hasher.hexdigests()
+
+    def delete(self, folder: Path, upload_id: str) -> bool:
+        paths = self._paths(folder, upload_id)
+        if paths is None or not paths[1].exists():
+            return False
+        with self._lock:
+            self._hashers.pop(upload_id, None)
+        for path in paths:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+        return True
+
+    @staticmethod
+    def _catch_up(hasher, part_path: Path, start: int, end: int) -> None:
+        """Feed bytes ``start:end`` of the part file into ``hasher``."""
+        if start >= end:
+            return
+        with open(part_path, "rb") as src:
+            src.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = src.read(min(UPLOAD_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                remaining -= len(chunk)
+
+    def _remember(self, upload_id: str, offset: int, hasher) -> None:
+        with self._lock:
+            self._hashers[upload_id] = (offset, hasher)
+            while len(self._hashers) > MAX_CACHED_HASHERS:
+                self._hashers.popitem(last=False)
@@ -0,0 +1,428 @@
+"""Watching PROJECT_ROOT for media copied into the project folders from outside the app.
+
+Photos are often rsynced straight into the volume. The watcher notices the
+files that appear, change, are renamed or are removed, and hands just those
+to the app to index, thumbnail and hash. A large drop therefore costs work
+in proportion to its size instead of a rescan of the library.
+
+Changes come from inotify where the kernel offers it, read through ctypes
+so no extra package is needed. Elsewhere, and on file systems whose changes
+inotify cannot see (network shares, folders shared from a Docker Desktop
+host), the folders are polled and each scan is compared with the last.
+
+Events are collected until a folder has been quiet for a moment, so a burst
+of thousands of files is handled in a few batches. A file modified too
+recently is probably still being written and waits for a later batch.
+
+Only one process watches at a time. Gunicorn workers compete for a lock
+file, and whichever holds it runs the watcher; another takes over within
+ELECTION_INTERVAL seconds if it exits.
+"""
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Container, Dict, Iterator, List, Optional, Set, Tuple
+
+# Locking a file to elect the watching process is Unix-only
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+WATCH_MODES = ("auto", "inotify", "poll", "off")
+# A batch is handled once its folder has been quiet this long...
+DEBOUNCE_SECONDS = 2.0
+# ...or once its oldest change is this old, so a long copy is ingested as it goes
+MAX_DELAY_SECONDS = 10.0
+DEFAULT_POLL_INTERVAL = 10.0
+ELECTION_INTERVAL = 30.0
+# Files modified more recently than this may still be being written
+SETTLE_NS = 2_000_000_000
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0o2000000)
+ROOT_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR
+# IN_CREATE catches hard links, which are never written
+FOLDER_MASK = IN_CLOSE_WRITE | IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class Changes:
+    """What happened to one project's files since its last batch, merged.
+
+    ``changed`` files are new or rewritten, ``removed`` ones are gone, and
+    ``renamed`` maps old names to new ones for files renamed within the project.
+    """
+
+    __slots__ = ("changed", "removed", "renamed")
+
+    def __init__(self) -> None:
+        self.changed: Set[str] = set()
+        self.removed: Set[str] = set()
+        self.renamed: Dict[str, str] = {}
+
+    def __bool__(self) -> bool:
+        return bool(self.changed or self.removed or self.renamed)
+
+    def change(self, name: str) -> None:
+        self.removed.discard(name)
+        self.changed.add(name)
+
+    def remove(self, name: str) -> None:
+        self.changed.discard(name)
+        for old, new in list(self.renamed.items()):
+            if new == name:
+                # Renamed and then deleted: the original is what disappeared
+                del self.renamed[old]
+                name = old
+        self.removed.add(name)
+
+    def rename(self, old: str, new: str) -> None:
+        if old in self.changed:
+            # Written during this batch, so there is nothing to carry over
+            self.changed.discard(old)
+            self.removed.add(old)
+            self.change(new)
+            return
+        for first, target in list(self.renamed.items()):
+            if target == old:
+                old = first
+                del self.renamed[first]
+        self.removed.discard(new)
+        self.changed.discard(new)
+        if old != new:
+            self.renamed[old] = new
+
+
+class _Inotify:
+    """A minimal binding of the Linux inotify calls."""
+
+    def __init__(self) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+    def add_watch(self, path: Path, mask: int) -> int:
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), str(path))
+        return wd
+
+    def read(self, timeout: float) -> Iterator[Tuple[int, int, int, str]]:
+        """Events as ``(wd, mask, cookie, name)``, waiting up to ``timeout`` for the first."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return
+        try:
+            data = os.read(self.fd, 256 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            yield wd, mask, cookie, name
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class FolderWatcher:
+    """Watches the project folders under ``root`` on a background thread.
+
+    ``ingest(project, changes)`` receives each settled batch. ``resync(project)``
+    is called for a project whose changes may have been missed: when watching
+    starts, when a project folder appears, and when inotify overflows.
+    """
+
+    def __init__(self, root: Path, extensions: Container[str],
+                 ingest: Callable[[str, Changes], None], resync: Callable[[str], None],
+                 mode: str = "auto", poll_interval: float = DEFAULT_POLL_INTERVAL,
+                 lock_path: Optional[Path] = None) -> None:
+        if mode not in WATCH_MODES:
+            raise ValueError(f"WATCH_MODE must be one of: {', '.join(WATCH_MODES)}")
+        self.root = root
+        self.extensions = extensions
+        self.ingest = ingest
+        self.resync = resync
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.lock_path = lock_path
+        self._lock_file = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self.mode == "off" or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="bestshot-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _is_media(self, name: str) -> bool:
+        return not name.startswith(".") and os.path.splitext(name)[1].lower() in self.extensions
+
+    def _projects(self) -> List[str]:
+        try:
+            with os.scandir(self.root) as entries:
+                return sorted(
+                    entry.name for entry in entries
+                    if entry.is_dir() and not entry.name.startswith(".")
+                )
+        except OSError:
+            return []
+
+    def _acquire(self) -> bool:
+        """Try to become the one watching process."""
+        if fcntl is None or self.lock_path is None:
+            return True
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        lock_file = open(self.lock_path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        # Held for the life of the process
+        self._lock_file = lock_file
+        return True
+
+    def _call(self, fn: Callable, *args) -> None:
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f"Watcher failed to process {args[0]}: {e}")
+
+    def _run(self) -> None:
+        while not self._acquire():
+            if self._stop.wait(ELECTION_INTERVAL):
+                return
+        if self.mode in ("auto", "inotify"):
+            try:
+                inotify = _Inotify()
+            except (OSError, AttributeError) as e:
+                if self.mode == "inotify":
+                    print(f"Watcher could not start inotify: {e}")
+                    return
+                print(f"inotify unavailable ({e}); polling {self.root} instead")
+            else:
+                try:
+                    self._watch(inotify)
+                    return
+                except OSError as e:
+                    if self.mode == "inotify":
+                        print(f"Watcher stopped: {e}")
+                        return
+                    print(f"inotify failed ({e}); polling {self.root} instead")
+                finally:
+                    inotify.close()
+        self._poll()
+
+    # ============ inotify ============
+
+    def _watch(self, inotify: _Inotify) -> None:
+        folders: Dict[int, str] = {}
+        resyncs: Set[str] = set()
+        pending: Dict[str, Changes] = {}
+        first_change: Dict[str, float] = {}
+        last_change: Dict[str, float] = {}
+        # cookie -> (project, name, when) of a rename whose other half is not read yet
+        moves: Dict[int, Tuple[str, str, float]] = {}
+
+        def watch_folder(project: str) -> None:
+            try:
+                folders[inotify.add_watch(self.root / project, FOLDER_MASK)] = project
+            except FileNotFoundError:
+                return
+            resyncs.add(project)
+
+        def changes_for(project: str) -> Changes:
+            now = time.monotonic()
+            first_change.setdefault(project, now)
+            last_change[project] = now
+            return pending.setdefault(project, Changes())
+
+        def forget(project: str) -> None:
+            pending.pop(project, None)
+            first_change.pop(project, None)
+            last_change.pop(project, None)
+
+        inotify.add_watch(self.root, ROOT_MASK)
+        for project in self._projects():
+            watch_folder(project)
+
+        while not self._stop.is_set():
+            for wd, mask, cookie, name in inotify.read(DEBOUNCE_SECONDS / 4):
+                if mask & IN_Q_OVERFLOW:
+                    # Events were dropped: compare every folder with the index
+                    resyncs.update(folders.values())
+                    continue
+                if mask & IN_IGNORED:
+                    folders.pop(wd, None)
+                    continue
+                project = folders.get(wd)
+                if project is None:
+                    # An event on the root: a project folder came or went
+                    if mask & IN_ISDIR and not name.startswith("."):
+                        if mask & (IN_CREATE | IN_MOVED_TO):
+                            watch_folder(name)
+                        else:
+                            forget(name)
+                    continue
+                if mask & IN_ISDIR or not name or name.startswith("."):
+                    continue
+                if mask & IN_MOVED_FROM:
+                    if self._is_media(name):
+                        moves[cookie] = (project, name, time.monotonic())
+                    continue
+                if mask & IN_MOVED_TO:
+                    source = moves.pop(cookie, None)
+                    if not self._is_media(name):
+                        if source:
+                            changes_for(source[0]).remove(source[1])
+                    elif source and source[0] == project:
+                        changes_for(project).rename(source[1], name)
+                    else:
+                        if source:
+                            changes_for(source[0]).remove(source[1])
+                        changes_for(project).change(name)
+                    continue
+                if not self._is_media(name):
+                    continue
+                if mask & IN_DELETE:
+                    changes_for(project).remove(name)
+                else:
+                    changes_for(project).change(name)
+
+            # Files moved out of the watched folders never get their other half
+            now = time.monotonic()
+            for cookie, (project, name, moved) in list(moves.items()):
+                if now - moved >= DEBOUNCE_SECONDS / 4:
+                    del moves[cookie]
+                    changes_for(project).remove(name)
+
+            for project in list(resyncs):
+                resyncs.discard(project)
+                self._call(self.resync, project)
+            now = time.monotonic()
+            for project in list(pending):
+                if (now - last_change[project] < DEBOUNCE_SECONDS
+                        and now - first_change[project] < MAX_DELAY_SECONDS):
+                    continue
+                changes = pending[project]
+                forget(project)
+                waiting = self._unsettled(project, changes.changed)
+                changes.changed -= waiting
+                if changes:
+                    self._call(self.ingest, project, changes)
+                if waiting:
+                    later = changes_for(project)
+                    for name in waiting:
+                        later.change(name)
+
+    def _unsettled(self, project: str, names: Set[str]) -> Set[str]:
+        """Those of ``names`` modified too recently to be complete."""
+        cutoff = time.time_ns() - SETTLE_NS
+        unsettled = set()
+        for name in names:
+            try:
+                if os.stat(self.root / project / name).st_mtime_ns > cutoff:
+                    unsettled.add(name)
+            except OSError:
+                pass
+        return unsettled
+
+    # ============ Polling ============
+
+    def _scan(self, project: str) -> Optional[Dict[str, Tuple[int, int, int]]]:
+        """``{name: (size, mtime_ns, inode)}`` of a project's media, or None if unreadable."""
+        files = {}
+        try:
+            with os.scandir(self.root / project) as entries:
+                for entry in entries:
+                    if self._is_media(entry.name) and entry.is_file():
+                        stat = entry.stat()
+                        files[entry.name] = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        except OSError:
+            return None
+        return files
+
+    def _poll(self) -> None:
+        snapshots: Dict[str, Dict[str, Tuple[int, int, int]]] = {}
+        while not self._stop.is_set():
+            projects = self._projects()
+            for project in projects:
+                current = self._scan(project)
+                if current is None:
+                    continue
+                previous = snapshots.get(project)
+                if previous is None:
+                    snapshots[project] = current
+                    self._call(self.resync, project)
+                    continue
+                changes, snapshots[project] = self._diff(previous, current)
+                if changes:
+                    self._call(self.ingest, project, changes)
+            for project in set(snapshots) - set(projects):
+                del snapshots[project]
+            self._stop.wait(self.poll_interval)
+
+    @staticmethod
+    def _diff(previous: Dict[str, Tuple[int, int, int]],
+              current: Dict[str, Tuple[int, int, int]]) -> Tuple[Changes, Dict]:
+        """The changes between two scans, and the snapshot to compare the next scan with.
+
+        A file still being written is left out of both, so it is reported
+        once it has settled. A file that kept its inode under a new name
+        was renamed.
+        """
+        cutoff = time.time_ns() - SETTLE_NS
+        changes = Changes()
+        snapshot = {}
+        for name, state in current.items():
+            if state[1] > cutoff:
+                if name in previous:
+                    snapshot[name] = previous[name]
+                continue
+            snapshot[name] = state
+        gone = {previous[name][2]: name for name in previous if name not in snapshot}
+        for name, state in snapshot.items():
+            known = previous.get(name)
+            if known == state:
+                continue
+            old = gone.pop(state[2], None) if known is None else None
+            if old is not None and previous[old][:2] == state[:2]:
+                changes.rename(old, name)
+            else:
+                if old is not None:
+                    changes.remove(old)
+                changes.change(name)
+        for name in gone.values():
+            changes.remove(name)
+        return changes, snapshot
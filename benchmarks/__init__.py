@@ -0,0 +1,5 @@
+"""Benchmarks for the hot paths of the BestShot server.
+
+``library`` builds a synthetic library of projects; ``run`` times the
+server against it and compares the results with an earlier run.
+"""
@@ -0,0 +1,228 @@
+"""Synthetic libraries for the benchmarks.
+
+A library is a project root with many projects of uneven size, holding
+photos and videos of realistic sizes and dates, dense tags, comments,
+rankings and votes. It is generated from a seed, so the same parameters
+always give the same library.
+
+Listings only look at file names, sizes and dates, so library files are
+sparse: each photo is a tiny JPEG carrying ``DateTimeOriginal``, extended
+to its full size without using the disk space. Thumbnails are empty
+placeholders under the names the app gives its renditions. Benchmarks
+that read file contents (uploads, thumbnails, ZIP downloads) use real
+images from ``make_photo`` instead.
+"""
+from __future__ import annotations
+
+import io
+import json
+import math
+import os
+import random
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+from app.media_meta import MediaMetaStore
+from app.thumbnails import thumbnail_names
+
+MANIFEST_FILENAME = "benchmark-library.json"
+MANIFEST_VERSION = 1
+
+# Share of each extension among photos and videos
+PHOTO_EXTENSIONS = ((".jpg", 0.85), (".png", 0.05), (".heic", 0.10))
+VIDEO_EXTENSIONS = ((".mp4", 0.7), (".mov", 0.3))
+# Median file sizes; sizes are log-normal around them
+PHOTO_MEDIAN_BYTES = 4 * 1024 * 1024
+VIDEO_MEDIAN_BYTES = 80 * 1024 * 1024
+PHOTO_SIZE_RANGE = (200 * 1024, 40 * 1024 * 1024)
+VIDEO_SIZE_RANGE = (2 * 1024 * 1024, 4 * 1024 * 1024 * 1024)
+# Shares of files that are ranked or carry a comment
+RANKED_SHARE = 0.6
+COMMENT_SHARE = 0.1
+MAX_TAGS_PER_FILE = 6
+# Projects span the last few years; each one is a shoot of up to a month
+LIBRARY_YEARS = 8
+SHOOT_DAYS = 30
+
+TAG_WORDS = (
+    "family", "friends", "travel", "beach", "mountains", "city", "night", "sunset",
+    "portrait", "landscape", "food", "pets", "dog", "cat", "wedding", "birthday",
+    "holiday", "snow", "forest", "lake", "river", "street", "architecture", "car",
+    "concert", "sport", "hiking", "garden", "flowers", "kids", "baby", "school",
+    "party", "museum", "art", "black-and-white", "macro", "wildlife", "birds", "sea",
+    "boat", "train", "plane", "road-trip", "camping", "festival", "market", "rain",
+    "fog", "autumn", "spring", "summer", "winter", "favourite", "print", "edit",
+    "reject", "maybe", "client", "selects",
+)
+COMMENTS = (
+    "Check focus", "Crop tighter", "Great light", "Print this one", "Slightly soft",
+    "Best of the set", "Eyes closed", "Needs straightening",
+)
+VOTE_OUTCOMES = ("left", "right", "tie")
+
+
+def _log_normal_size(rng: random.Random, median: int, sigma: float, bounds) -> int:
+    size = int(rng.lognormvariate(math.log(median), sigma))
+    return max(bounds[0], min(bounds[1], size))
+
+
+def _pick_extension(rng: random.Random, choices) -> str:
+    return rng.choices([ext for ext, _ in choices], [share for _, share in choices])[0]
+
+
+def _split(total: int, weights: List[float]) -> List[int]:
+    """Share ``total`` out in proportion to ``weights``, in whole numbers."""
+    scale = total / sum(weights)
+    counts = [int(weight * scale) for weight in weights]
+    for i in range(total - sum(counts)):
+        counts[i % len(counts)] += 1
+    return counts
+
+
+def _seed_photo(extension: str, taken: float) -> bytes:
+    """The first bytes of a library photo: a tiny image with its capture time."""
+    img = Image.new("RGB", (64, 48), (96, 96, 96))
+    buffer = io.BytesIO()
+    if extension == ".png":
+        img.save(buffer, "PNG")
+    else:
+        exif = Image.Exif()
+        exif[0x010F] = "BenchCam"
+        exif[0x8769] = {0x9003: datetime.fromtimestamp(taken).strftime("%Y:%m:%d %H:%M:%S")}
+        img.save(buffer, "JPEG", exif=exif)
+    return buffer.getvalue()
+
+
+def _write_sparse(path: Path, head: bytes, size: int, mtime: float) -> None:
+    with open(path, "wb") as f:
+        f.write(head)
+        f.truncate(max(size, len(head)))
+    os.utime(path, (mtime, mtime))
+
+
+def make_photo(width: int, height: int, seed: int = 0, quality: int = 90) -> bytes:
+    """A JPEG photo of the given size whose detail compresses like a real one.
+
+    Smooth colour blobs with fine grain on top: JPEG sizes land within the
+    range of camera files, unlike flat colour (too small) or pure noise
+    (too large).
+    """
+    rng = random.Random(seed)
+    small = (max(1, width // 64), max(1, height // 64))
+    base = Image.frombytes(
+        "RGB", small, rng.getrandbits(8 * 3 * small[0] * small[1]).to_bytes(3 * small[0] * small[1], "little")
+    ).resize((width, height), Image.Resampling.BICUBIC)
+    grain = Image.frombytes(
+        "L", (width, height), rng.getrandbits(8 * width * height).to_bytes(width * height, "little")
+    ).convert("RGB")
+    img = Image.blend(base, grain, 0.08)
+    buffer = io.BytesIO()
+    img.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def read_manifest(root: Path) -> Optional[Dict]:
+    try:
+        return json.loads((root / MANIFEST_FILENAME).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def generate(root: Path, projects: int = 200, images: int = 100_000, videos: int = 5_000,
+             votes_per_project: int = 50, seed: int = 1, thumbnails: bool = True,
+             progress=None) -> Dict:
+    """Build a library under ``root`` and return its manifest.
+
+    An existing library built with the same parameters is reused as is.
+    ``progress`` is called with a message after each project.
+    """
+    params = {
+        "version": MANIFEST_VERSION,
+        "projects": projects,
+        "images": images,
+        "videos": videos,
+        "votesPerProject": votes_per_project,
+        "seed": seed,
+        "thumbnails": thumbnails,
+    }
+    manifest = read_manifest(root)
+    if manifest and manifest.get("params") == params:
+        return manifest
+    if root.exists() and any(root.iterdir()):
+        raise ValueError(f"{root} is not empty and holds no library built with these parameters")
+
+    rng = random.Random(seed)
+    root.mkdir(parents=True, exist_ok=True)
+    store = MediaMetaStore()
+    # A few large projects and many small ones, as in real libraries
+    weights = [rng.lognormvariate(0, 1) for _ in range(projects)]
+    image_counts = _split(images, weights)
+    video_counts = _split(videos, weights)
+    now = time.time()
+    started = time.perf_counter()
+    totals = {"files": 0, "bytes": 0, "tags": 0, "ranked": 0}
+    tag_weights = [1 / (rank + 1) for rank in range(len(TAG_WORDS))]
+
+    for index, (image_count, video_count) in enumerate(zip(image_counts, video_counts)):
+        folder = root / f"project-{index:04d}"
+        folder.mkdir()
+        (folder / ".project.json").write_text(json.dumps({"description": f"Synthetic project {index}"}))
+        thumbs_dir = folder / ".thumbs"
+        thumbs_dir.mkdir()
+        shoot_start = now - rng.uniform(SHOOT_DAYS, LIBRARY_YEARS * 365) * 86400
+        step = SHOOT_DAYS * 86400 / max(1, image_count + video_count)
+
+        names = []
+        for number in range(image_count + video_count):
+            taken = shoot_start + number * step + rng.uniform(0, step)
+            if number < image_count:
+                extension = _pick_extension(rng, PHOTO_EXTENSIONS)
+                name = f"IMG_{number:05d}{extension}"
+                size = _log_normal_size(rng, PHOTO_MEDIAN_BYTES, 0.5, PHOTO_SIZE_RANGE)
+                head = _seed_photo(extension, taken) if extension != ".heic" else b""
+                if thumbnails and extension != ".heic":
+                    for thumb_name in thumbnail_names(name).values():
+                        (thumbs_dir / thumb_name).touch()
+            else:
+                extension = _pick_extension(rng, VIDEO_EXTENSIONS)
+                name = f"VID_{number:05d}{extension}"
+                size = _log_normal_size(rng, VIDEO_MEDIAN_BYTES, 1.0, VIDEO_SIZE_RANGE)
+                head = b""
+            # Copied off the camera a little after it was taken
+            _write_sparse(folder / name, head, size, taken + rng.uniform(60, 3600))
+            names.append(name)
+            totals["bytes"] += size
+
+        changes = {}
+        for name in names:
+            fields = {"tags": list(dict.fromkeys(
+                rng.choices(TAG_WORDS, tag_weights, k=rng.randint(0, MAX_TAGS_PER_FILE))
+            ))}
+            if rng.random() < COMMENT_SHARE:
+                fields["comment"] = rng.choice(COMMENTS)
+            totals["tags"] += len(fields["tags"])
+            changes[name] = fields
+        store.update(folder, changes)
+        ranked = rng.sample(names, int(len(names) * RANKED_SHARE))
+        store.set_order(folder, ranked)
+        for _ in range(votes_per_project if len(ranked) > 1 else 0):
+            left, right = rng.sample(ranked, 2)
+            store.add_vote(folder, left, right, rng.choice(VOTE_OUTCOMES), f"voter-{rng.randint(1, 3)}")
+        store.close(folder)
+        totals["files"] += len(names)
+        totals["ranked"] += len(ranked)
+        if progress:
+            progress(f"project {index + 1}/{projects}: {len(names)} files")
+
+    manifest = {
+        "params": params,
+        "totals": totals,
+        "largestProject": f"project-{max(range(projects), key=lambda i: image_counts[i] + video_counts[i]):04d}",
+        "generatedSeconds": round(time.perf_counter() - started, 2),
+    }
+    (root / MANIFEST_FILENAME).write_text(json.dumps(manifest, indent=2))
+    return manifest
@@ -0,0 +1,440 @@
+"""Time the server's hot paths against a synthetic library.
+
+Usage::
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --quick --baseline results.json --threshold 0.2
+
+Requests go through the Flask test client, so the timings cover routing,
+the media index, serialization and the response body, but not the network
+or a WSGI server. Each benchmark is repeated and reported as the median
+with its spread. With ``--baseline`` the results are compared with an
+earlier run and the command exits with status 1 if any benchmark got worse
+by more than the threshold.
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from importlib.metadata import version
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from werkzeug.datastructures import FileStorage, MultiDict
+from werkzeug.test import encode_multipart
+
+from benchmarks.library import generate, make_photo
+
+RESULTS_VERSION = 1
+GROUPS = ("listings", "thumbnails", "uploads", "downloads", "batch")
+DEFAULT_THRESHOLD = 0.2
+SCRATCH_PROJECT = "benchmark-scratch"
+PAGE_SIZE = 200
+# Photo sizes timed for thumbnail generation, in megapixels (3:2 frames)
+THUMBNAIL_MEGAPIXELS = (2, 12, 24)
+UPLOAD_MEGAPIXELS = 12
+UPLOAD_FILES = 8
+BATCH_FILES = 1000
+JOB_TIMEOUT = 3600
+JOB_POLL_INTERVAL = 0.05
+MB = 1024 * 1024
+
+QUICK = {"projects": 20, "images": 2000, "videos": 100, "repeat": 3}
+FULL = {"projects": 200, "images": 100_000, "videos": 5_000, "repeat": 5}
+
+
+def _summary(samples: List[float], unit: str, better: str = "lower", **extra) -> Dict:
+    ordered = sorted(samples)
+    result = {
+        "value": statistics.median(ordered),
+        "unit": unit,
+        "better": better,
+        "min": ordered[0],
+        "max": ordered[-1],
+        "mean": statistics.fmean(ordered),
+        "p95": ordered[min(len(ordered) - 1, math.ceil(0.95 * len(ordered)) - 1)],
+        "samples": samples,
+    }
+    result.update(extra)
+    return result
+
+
+def _consume(response) -> int:
+    """Read a whole response body, streamed or not; returns its length."""
+    try:
+        return sum(len(chunk) for chunk in response.response)
+    finally:
+        response.close()
+
+
+def _frame(megapixels: float):
+    width = int(math.sqrt(megapixels * 1_000_000 * 3 / 2))
+    return width, int(width * 2 / 3)
+
+
+class Runner:
+    """Runs the benchmarks of one session against a library."""
+
+    def __init__(self, root: Path, repeat: int, log: Callable[[str], None]) -> None:
+        self.root = root
+        self.repeat = repeat
+        self.log = log
+        self.results: Dict[str, Dict] = {}
+        self.started = time.time()
+        # The app reads its settings when it is imported
+        os.environ["PROJECT_ROOT"] = str(root)
+        os.environ["WATCH_MODE"] = "off"
+        from app import main as bestshot
+        self.client = bestshot.app.test_client()
+        self.largest = None
+
+    def request(self, method: str, url: str, status: int = 200, **kwargs) -> int:
+        """Make a request and read its body; returns the body's length."""
+        response = self.client.open(url, method=method, buffered=False, **kwargs)
+        if response.status_code != status:
+            body = response.get_data(as_text=True)[:200]
+            response.close()
+            raise RuntimeError(f"{method} {url} returned {response.status_code}: {body}")
+        return _consume(response)
+
+    def request_job(self, method: str, url: str, **kwargs) -> Dict:
+        """Make a request that starts a job and wait for the job; returns its result."""
+        response = self.client.open(url, method=method, **kwargs)
+        if response.status_code not in (200, 202):
+            body = response.get_data(as_text=True)[:200]
+            raise RuntimeError(f"{method} {url} returned {response.status_code}: {body}")
+        data = response.get_json()
+        if response.status_code == 200:
+            return data
+        deadline = time.time() + JOB_TIMEOUT
+        while time.time() < deadline:
+            job = self.client.get(f"/api/jobs/{data['job']}").get_json()
+            if job["status"] == "completed":
+                return job["result"] or {}
+            if job["status"] in ("failed", "cancelled"):
+                raise RuntimeError(f"{method} {url}: job {job['status']}: {job['error']}")
+            time.sleep(JOB_POLL_INTERVAL)
+        raise RuntimeError(f"{method} {url}: job did not finish in time")
+
+    def time(self, name: str, fn: Callable[[], object], unit: str = "s",
+             repeat: Optional[int] = None, prepare: Optional[Callable[[], None]] = None,
+             **extra) -> List[float]:
+        """Time ``fn`` after one untimed warm-up call; ``prepare`` runs untimed before each call."""
+        samples = []
+        for attempt in range(1 + (repeat or self.repeat)):
+            if prepare:
+                prepare()
+            start = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - start
+            if attempt:
+                samples.append(elapsed)
+        self.results[name] = _summary(samples, unit, **extra)
+        self.log(f"{name}: {self.results[name]['value'] * 1000:.1f} ms")
+        return samples
+
+    def wait_for_jobs(self) -> None:
+        """Wait for the background jobs queued during this session to finish."""
+        deadline = time.time() + JOB_TIMEOUT
+        with sqlite3.connect(str(self.root / ".bestshot" / "jobs.db"), timeout=30) as conn:
+            while time.time() < deadline:
+                pending = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running') AND created >= ?",
+                    (self.started,),
+                ).fetchone()[0]
+                if not pending:
+                    return
+                time.sleep(0.5)
+        raise RuntimeError("Background jobs did not finish in time")
+
+    # ============ Listings ============
+    def listings(self) -> None:
+        # The first listing reconciles every project with an empty index
+        start = time.perf_counter()
+        self.request("GET", f"/api/all-media?limit={PAGE_SIZE}&sort=date_desc")
+        self.results["index.cold_scan"] = _summary([time.perf_counter() - start], "s")
+        self.log(f"index.cold_scan: {self.results['index.cold_scan']['value']:.2f} s")
+        self.log("waiting for EXIF extraction")
+        self.wait_for_jobs()
+
+        project = self.largest
+        self.time("projects.list", lambda: self.request("GET", "/api/projects"))
+        self.time("images.page", lambda: self.request(
+            "GET", f"/api/projects/{project}/images?limit={PAGE_SIZE}"))
+        self.time("images.full", lambda: self.request("GET", f"/api/projects/{project}/images"))
+        self.time("images.full_date_desc", lambda: self.request(
+            "GET", f"/api/projects/{project}/images?sort=date_desc"))
+        self.time("all_media.page", lambda: self.request(
+            "GET", f"/api/all-media?limit={PAGE_SIZE}&sort=date_desc"))
+        self.time("all_media.page_rank", lambda: self.request(
+            "GET", f"/api/all-media?limit={PAGE_SIZE}"))
+        self.time("all_media.page_rating", lambda: self.request(
+            "GET", f"/api/all-media?limit={PAGE_SIZE}&sort=rating"))
+        self.time("all_media.tag_filter", lambda: self.request(
+            "GET", f"/api/all-media?limit={PAGE_SIZE}&tag=travel&tag=sunset"))
+        self.time("all_media.ndjson", lambda: self.request(
+            "GET", "/api/all-media?format=ndjson&sort=date_desc"))
+
+    # ============ Thumbnails ============
+    def thumbnails(self) -> None:
+        from app.thumbnails import generate_thumbnail
+
+        per_megapixel = []
+        with tempfile.TemporaryDirectory() as scratch:
+            scratch = Path(scratch)
+            for megapixels in THUMBNAIL_MEGAPIXELS:
+                path = scratch / f"photo-{megapixels}mp.jpg"
+                path.write_bytes(make_photo(*_frame(megapixels), seed=megapixels))
+                thumbs_dir = scratch / ".thumbs"
+
+                def run():
+                    if generate_thumbnail(path, thumbs_dir) is None:
+                        raise RuntimeError(f"Thumbnail generation failed for {path.name}")
+
+                samples = self.time(f"thumbnail.{megapixels}mp", run, bytes=path.stat().st_size)
+                per_megapixel += [sample / megapixels for sample in samples]
+        self.results["thumbnail.per_megapixel"] = _summary(per_megapixel, "s/MP")
+        self.log(f"thumbnail.per_megapixel: {self.results['thumbnail.per_megapixel']['value'] * 1000:.1f} ms")
+
+    # ============ Uploads and downloads ============
+    def _scratch(self) -> str:
+        if not (self.root / SCRATCH_PROJECT).is_dir():
+            self.request("POST", "/api/projects", status=201, json={"name": SCRATCH_PROJECT})
+        return SCRATCH_PROJECT
+
+    def uploads(self) -> None:
+        project = self._scratch()
+        photos = [make_photo(*_frame(UPLOAD_MEGAPIXELS), seed=100 + i) for i in range(UPLOAD_FILES)]
+        boundary, body = encode_multipart(MultiDict([
+            ("files", FileStorage(stream=io.BytesIO(data), filename=f"upload-{i:02d}.jpg",
+                                  content_type="image/jpeg"))
+            for i, data in enumerate(photos)
+        ]))
+        samples = self.time("upload.request", lambda: self.request(
+            "POST", f"/api/projects/{project}/upload", status=201, data=body,
+            content_type=f"multipart/form-data; boundary={boundary}",
+        ), files=UPLOAD_FILES, bytes=len(body))
+        self.results["upload.throughput"] = _summary(
+            [len(body) / MB / sample for sample in samples], "MB/s", better="higher",
+        )
+        self.log(f"upload.throughput: {self.results['upload.throughput']['value']:.1f} MB/s")
+        # Thumbnails of the uploads are made in the background
+        self.wait_for_jobs()
+
+    def downloads(self) -> None:
+        project = self._scratch()
+        if not any(not entry.name.startswith(".") for entry in os.scandir(self.root / project)):
+            self.uploads()
+        archives = self.root / ".bestshot" / "archives"
+
+        def drop_archives():
+            for archive in archives.glob("*.zip"):
+                archive.unlink()
+
+        # Building the archive, then downloading the cached one
+        self.time("download.archive_build", lambda: self.request_job(
+            "POST", f"/api/projects/{project}/archive"), prepare=drop_archives)
+        url = f"/api/projects/{project}/download"
+        size = self.request("GET", url)
+        samples = self.time("download.zip", lambda: self.request("GET", url), bytes=size)
+        self.results["download.zip_throughput"] = _summary(
+            [size / MB / sample for sample in samples], "MB/s", better="higher",
+        )
+        self.log(f"download.zip_throughput: {self.results['download.zip_throughput']['value']:.1f} MB/s")
+
+        # The gallery's first page of thumbnails as one sprite sheet, built then cached
+        sprites = self.root / ".bestshot" / "sprites"
+
+        def drop_sprites():
+            for sheet in sprites.glob("*"):
+                sheet.unlink()
+
+        url = f"/api/projects/{project}/sprites?size=400"
+
+        def build():
+            # The first request queues the sheet; it is ready once its map is written
+            self.request("GET", url)
+            deadline = time.time() + JOB_TIMEOUT
+            while not any(sprites.glob("*.json")):
+                if time.time() > deadline:
+                    raise RuntimeError("Sprite sheet was not built in time")
+                time.sleep(0.01)
+
+        self.time("sprites.build", build, prepare=drop_sprites)
+        self.time("sprites.cached", lambda: self.request("GET", url))
+
+    # ============ Batch edits ============
+    def batch(self) -> None:
+        project = self.largest
+        names = sorted(
+            entry.name for entry in os.scandir(self.root / project)
+            if entry.is_file() and not entry.name.startswith(".")
+        )[:BATCH_FILES]
+        url = f"/api/projects/{project}/batch-tags"
+        self.time("batch.add_tag", lambda: self.request(
+            "POST", url, json={"files": names, "addTags": ["benchmark"]}), files=len(names))
+        self.time("batch.remove_tag", lambda: self.request(
+            "POST", url, json={"files": names, "removeTags": ["benchmark"]}), files=len(names))
+
+        scratch = self._scratch()
+        folder = self.root / scratch
+        seed = (self.root / project / names[0]).read_bytes()[:4096]
+        doomed = [f"delete-{i:05d}.jpg" for i in range(BATCH_FILES)]
+
+        def prepare():
+            for name in doomed:
+                with open(folder / name, "wb") as f:
+                    f.write(seed)
+                    f.truncate(4 * MB)
+            # Index them, as they would be after the gallery listed them
+            self.request("GET", f"/api/projects/{scratch}/images?limit=1")
+            self.wait_for_jobs()
+
+        self.time("batch.delete", lambda: self.request_job(
+            "DELETE", f"/api/projects/{scratch}/batch-delete", json={"files": doomed},
+        ), prepare=prepare, files=len(doomed))
+
+    def cleanup(self) -> None:
+        if (self.root / SCRATCH_PROJECT).is_dir():
+            self.wait_for_jobs()
+            self.request("DELETE", f"/api/projects/{SCRATCH_PROJECT}")
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[Dict]:
+    """Benchmarks that got worse than ``baseline`` by more than ``threshold`` (0.2 is 20%)."""
+    regressions = []
+    for name, result in sorted(results["results"].items()):
+        before = baseline.get("results", {}).get(name)
+        if not before or not before["value"] or result["unit"] != before["unit"]:
+            continue
+        change = result["value"] / before["value"] - 1
+        worse = change if result["better"] == "lower" else -change
+        if worse > threshold:
+            regressions.append({
+                "name": name,
+                "unit": result["unit"],
+                "baseline": before["value"],
+                "value": result["value"],
+                "change": round(change, 4),
+            })
+    return regressions
+
+
+def _environment() -> Dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=Path(__file__).resolve().parent,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "flask": version("flask"),
+        "pillow": version("Pillow"),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--library", type=Path,
+                        help="library folder; built on first use (default: one per size in the temp folder)")
+    parser.add_argument("--quick", action="store_true",
+                        help=f"a small library and fewer repeats ({QUICK['images']} images)")
+    parser.add_argument("--projects", type=int)
+    parser.add_argument("--images", type=int)
+    parser.add_argument("--videos", type=int)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, help="timed runs per benchmark")
+    parser.add_argument("--only", help=f"comma-separated groups to run: {', '.join(GROUPS)}")
+    parser.add_argument("--output", type=Path, help="write the results here as JSON (default: stdout)")
+    parser.add_argument("--baseline", type=Path, help="results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="relative change counted as a regression (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    preset = QUICK if args.quick else FULL
+    size = {key: getattr(args, key) or preset[key] for key in ("projects", "images", "videos")}
+    repeat = args.repeat or preset["repeat"]
+    groups = args.only.split(",") if args.only else list(GROUPS)
+    unknown = set(groups) - set(GROUPS)
+    if unknown:
+        parser.error(f"unknown groups: {', '.join(sorted(unknown))}")
+
+    def log(message: str) -> None:
+        print(message, file=sys.stderr, flush=True)
+
+    root = args.library or Path(tempfile.gettempdir()) / (
+        f"bestshot-benchmark-{size['projects']}x{size['images']}-{args.seed}"
+    )
+    log(f"library: {root}")
+    manifest = generate(root.resolve(), seed=args.seed, progress=log, **size)
+    # Start every session from an empty index so the cold scan is comparable
+    index_dir = root / ".bestshot"
+    for name in ("index.db", "index.db-wal", "index.db-shm"):
+        try:
+            (index_dir / name).unlink()
+        except FileNotFoundError:
+            pass
+    if (root / SCRATCH_PROJECT).exists():
+        shutil.rmtree(root / SCRATCH_PROJECT)
+
+    runner = Runner(root.resolve(), repeat, log)
+    runner.largest = manifest["largestProject"]
+    if "listings" not in groups:
+        # The other groups still need the index built
+        runner.request("GET", "/api/all-media?limit=1")
+    try:
+        for group in GROUPS:
+            if group in groups:
+                getattr(runner, group)()
+    finally:
+        runner.cleanup()
+
+    results = {
+        "version": RESULTS_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "environment": _environment(),
+        "library": manifest,
+        "repeat": repeat,
+        "results": runner.results,
+    }
+    regressions = []
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        if baseline.get("library", {}).get("params") != manifest["params"]:
+            log("warning: the baseline was run against a different library")
+        regressions = compare(results, baseline, args.threshold)
+        results["comparison"] = {
+            "baseline": str(args.baseline),
+            "threshold": args.threshold,
+            "regressions": regressions,
+        }
+        for regression in regressions:
+            log(f"REGRESSION {regression['name']}: {regression['baseline']:.4g} -> "
+                f"{regression['value']:.4g} {regression['unit']} ({regression['change']:+.0%})")
+    text = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(text + "\n")
+    else:
+        print(text)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""Check the headers the app sends in offload mode, without nginx.
+
+Usage::
+
+    python deploy/check_offload.py
+
+For ``SENDFILE_MODE=x-accel`` and ``x-sendfile`` in turn, requests go
+through the Flask test client against a scratch project. The media,
+thumbnail and download endpoints must answer with an empty body and the
+redirect header nginx (or mod_xsendfile) acts on, keep their
+Content-Disposition, and refuse paths that lead out of the project
+without sending any redirect header. Exits with status 1 on any failure.
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from typing import List, Optional
+from urllib.parse import quote
+
+# Runs as a script from anywhere; the app package sits next to deploy/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+PROJECT = "Offload"
+PREFIX = "/protected-media/"
+PHOTO = "photo one.jpg"
+NON_ASCII = "café.jpg"
+OFFLOAD_HEADERS = ("X-Accel-Redirect", "X-Sendfile")
+
+
+class Checker:
+    """Makes requests in one offload mode and collects the failures."""
+
+    def __init__(self, client, mode: str, root: Path) -> None:
+        self.client = client
+        self.mode = mode
+        self.root = root
+        self.failures: List[str] = []
+
+    def expect(self, condition: bool, message: str) -> None:
+        if not condition:
+            self.failures.append(f"{self.mode}: {message}")
+
+    def offloaded(self, url: str, path: Path, attachment: Optional[str] = None) -> None:
+        """``url`` must hand ``path`` to the proxy, as an attachment named ``attachment`` if given."""
+        response = self.client.get(url)
+        self.expect(response.status_code == 200, f"GET {url} returned {response.status_code}")
+        self.expect(response.data == b"", f"GET {url} sent a body of {len(response.data)} bytes")
+        if self.mode == "x-accel":
+            expected = PREFIX + quote(path.relative_to(self.root).as_posix())
+            header, other = "X-Accel-Redirect", "X-Sendfile"
+        else:
+            expected = str(path)
+            header, other = "X-Sendfile", "X-Accel-Redirect"
+        self.expect(response.headers.get(header) == expected,
+                    f"GET {url}: {header} is {response.headers.get(header)!r}, expected {expected!r}")
+        self.expect(other not in response.headers, f"GET {url} also sent {other}")
+        disposition = response.headers.get("Content-Disposition")
+        if attachment is None:
+            self.expect(disposition is None, f"GET {url} sent Content-Disposition {disposition!r}")
+        else:
+            self.expect(disposition is not None and disposition.startswith("attachment"),
+                        f"GET {url}: Content-Disposition is {disposition!r}, expected an attachment")
+            ascii_name = attachment.encode("ascii", "ignore").decode("ascii")
+            if ascii_name == attachment:
+                self.expect(f'filename="{attachment}"' in (disposition or "")
+                            or f"filename={attachment}" in (disposition or ""),
+                            f"GET {url}: Content-Disposition {disposition!r} does not name {attachment!r}")
+            else:
+                self.expect("filename*=UTF-8''" in (disposition or ""),
+                            f"GET {url}: Content-Disposition {disposition!r} lacks the UTF-8 filename")
+
+    def refused(self, url: str, statuses=(400, 404)) -> None:
+        """``url`` must be refused, without any offload header."""
+        response = self.client.get(url)
+        self.expect(response.status_code in statuses,
+                    f"GET {url} returned {response.status_code}, expected one of {statuses}")
+        for header in OFFLOAD_HEADERS:
+            self.expect(header not in response.headers, f"GET {url} sent {header} for a refused path")
+
+
+def check(mode: str, root: Path) -> List[str]:
+    os.environ["SENDFILE_MODE"] = mode
+    from app import main as bestshot
+
+    checker = Checker(bestshot.create_app().test_client(), mode, root)
+    folder = root / PROJECT
+    thumbs_dir = folder / bestshot.THUMBS_DIR_NAME
+    thumb = bestshot.thumbnail_name(PHOTO, min(bestshot.THUMBNAIL_SIZES))
+    base = f"/api/projects/{PROJECT}"
+
+    checker.offloaded(f"{base}/files/{PHOTO}", folder / PHOTO)
+    checker.offloaded(f"{base}/files/{NON_ASCII}", folder / NON_ASCII)
+    checker.offloaded(f"{base}/thumbs/{thumb}", thumbs_dir / thumb)
+    checker.offloaded(f"{base}/files/{PHOTO}/download", folder / PHOTO, attachment=PHOTO)
+    checker.offloaded(f"{base}/files/{NON_ASCII}/download", folder / NON_ASCII, attachment=NON_ASCII)
+
+    # A link inside the project to a file outside it, and dot segments
+    for url in (f"{base}/files/escape.jpg", f"{base}/files/escape.jpg/download",
+                f"{base}/thumbs/escape.jpg"):
+        checker.refused(url, statuses=(400,))
+    for url in (f"{base}/files/..%2F..%2Fsecret.jpg", f"{base}/files/..%2F..%2Fsecret.jpg/download",
+                f"{base}/thumbs/..%2F..%2F..%2Fsecret.jpg"):
+        checker.refused(url)
+    checker.refused(f"{base}/files/missing.jpg", statuses=(404,))
+    return checker.failures
+
+
+def main() -> int:
+    scratch = Path(tempfile.mkdtemp(prefix="bestshot-offload-")).resolve()
+    root = scratch / "projects"
+    try:
+        # The app reads its settings when it is imported
+        os.environ["PROJECT_ROOT"] = str(root)
+        os.environ["WATCH_MODE"] = "off"
+        os.environ["SENDFILE_PREFIX"] = PREFIX
+        from app import main as bestshot
+
+        folder = root / PROJECT
+        thumbs_dir = folder / bestshot.THUMBS_DIR_NAME
+        thumbs_dir.mkdir(parents=True)
+        (scratch / "secret.jpg").write_bytes(b"outside the project root")
+        for name in (PHOTO, NON_ASCII):
+            (folder / name).write_bytes(b"not really a photo")
+        (thumbs_dir / bestshot.thumbnail_name(PHOTO, min(bestshot.THUMBNAIL_SIZES))).write_bytes(b"thumb")
+        for link in (folder / "escape.jpg", thumbs_dir / "escape.jpg"):
+            link.symlink_to(scratch / "secret.jpg")
+        failures = []
+        for mode in bestshot.SENDFILE_MODES:
+            failures.extend(check(mode, root))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    for failure in failures:
+        print(f"FAIL {failure}", file=sys.stderr)
+    if failures:
+        return 1
+    print(f"ok: {', '.join(bestshot.SENDFILE_MODES)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
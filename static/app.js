@@ -100,6 +100,13 @@ const uploadProgress = document.getElementById("upload-progress");
 const uploadProgressStatus = document.getElementById("upload-progress-status");
 const uploadProgressFill = document.getElementById("upload-progress-fill");
 
+// Background job progress
+const jobProgress = document.getElementById("job-progress");
+const jobProgressTitle = document.getElementById("job-progress-title");
+const jobProgressStatus = document.getElementById("job-progress-status");
+const jobProgressFill = document.getElementById("job-progress-fill");
+const jobProgressCancel = document.getElementById("job-progress-cancel");
+
 // Duplicate modal
 const duplicateModal = document.getElementById("duplicate-modal");
 const duplicateList = document.getElementById("duplicate-list");
@@ -117,6 +124,9 @@ const compareAllBtn = document.getElementById("compare-all");
 const compareUnrankedBtn = document.getElementById("compare-unranked");
 const compareAllCount = document.getElementById("compare-all-count");
 const compareUnrankedCount = document.getElementById("compare-unranked-count");
+const compareResumeBtn = document.getElementById("compare-resume");
+const compareResumeCount = document.getElementById("compare-resume-count");
+const compareVoteBtn = document.getElementById("compare-vote");
 const cancelComparisonSelectionBtn = document.getElementById("cancel-comparison-selection");
 const comparisonSelectionBackdrop = comparisonSelection.querySelector(".comparison-selection__backdrop");
 
@@ -206,7 +216,6 @@ const state = {
   gridSize: "medium",
   viewerIndex: -1,
   comparison: null,
-  comparisonScope: "all",
   pendingFiles: null,
   isSelectionMode: false,
   selectedItems: new Set(),
@@ -216,9 +225,15 @@ const state = {
   theme: localStorage.getItem("theme") || "dark",
   pendingUploadFiles: null, // For duplicate detection flow
   pendingUploadProject: null, // Project name for pending upload
+  pendingDuplicateNames: null, // Names of pending files the project already has
   showExif: false, // EXIF panel visibility in media viewer
+  rankingVersion: null, // Ranking version the gallery was loaded at, sent back as If-Match
+  sprites: new Map(), // Places of the first page's thumbnails on its sprite sheet, by file name
 };
 
+// Ranking edits are sent one at a time so each carries the version the previous one returned
+let rankingQueue = Promise.resolve();
+
 // Touch drag-and-drop state
 let touchDragState = null;
 
@@ -299,6 +314,9 @@ function updateSortUI() {
     name_desc: "Name (Z-A)",
     date: "Date (Oldest)",
     date_desc: "Date (Newest)",
+    taken: "Date Taken (Oldest)",
+    taken_desc: "Date Taken (Newest)",
+    rating: "Rating",
     size: "Size (Smallest)",
     size_desc: "Size (Largest)",
   };
@@ -404,12 +422,23 @@ function updateGridSize() {
   });
 }
 
+// Approximate rendered card width per grid size, used as the `sizes` hint so
+// the browser fetches the thumbnail rendition that matches the grid.
+const GRID_THUMB_WIDTHS = { small: 200, medium: 280, large: 400 };
+
+function gridThumbSizes() {
+  return `${GRID_THUMB_WIDTHS[state.gridSize] || GRID_THUMB_WIDTHS.medium}px`;
+}
+
 gridSizeButtons.forEach((btn) => {
   btn.addEventListener("click", (e) => {
     e.stopPropagation();
     state.gridSize = btn.dataset.gridSize;
     localStorage.setItem("gridSize", state.gridSize);
     updateGridSize();
+    imagesGrid.querySelectorAll("img[srcset]").forEach((img) => {
+      img.sizes = gridThumbSizes();
+    });
   });
 });
 
@@ -604,12 +633,7 @@ function renderProjects() {
             targetProject: project.name,
           }),
         });
-        
-        if (!res.ok) {
-          const error = await res.json().catch(() => ({}));
-          alert(error.description || "Failed to move file");
-          return;
-        }
+        await jobResult(res, `Moving ${mediaName}`);
         
         // Reload both projects
         if (state.isAllProjects) {
@@ -621,6 +645,7 @@ function renderProjects() {
         }
         await fetchProjects();
       } catch (error) {
+        if (error.cancelled) return;
         console.error("Move error:", error);
         alert("Failed to move file: " + error.message);
       }
@@ -651,35 +676,172 @@ async function selectAllProjects() {
   await loadAllProjectsState();
 }
 
-async function loadAllProjectsState() {
-  showGalleryLoading(true);
-  const url = `/api/all-media?media=${state.mediaFilter}&sort=${state.sortBy}`;
+// Listings are fetched page by page: a small first page so the gallery paints
+// quickly, then larger pages appended until the server reports no next cursor.
+const MEDIA_FIRST_PAGE_SIZE = 200;
+const MEDIA_PAGE_SIZE = 1000;
+let mediaLoadToken = 0;
+// The first page of a project's thumbnails is drawn from one sprite sheet.
+// Its map is fetched alongside the listing and answers without building
+// anything (a page seen for the first time has no sheet yet), so the first
+// paint waits for it only briefly before falling back to one request per
+// thumbnail.
+const SPRITE_PAGE_SIZE = 100;
+const SPRITE_WAIT_MS = 300;
+const SVG_NS = "http://www.w3.org/2000/svg";
+
+async function fetchMediaPages(baseUrl, onPage, ready = null) {
+  const token = ++mediaLoadToken;
+  let cursor = null;
+  let isFirstPage = true;
+  do {
+    const limit = isFirstPage ? MEDIA_FIRST_PAGE_SIZE : MEDIA_PAGE_SIZE;
+    const cursorParam = cursor ? `&cursor=${encodeURIComponent(cursor)}` : "";
+    const res = await fetch(`${baseUrl}&limit=${limit}${cursorParam}`);
+    // A newer load (project switch, filter change) supersedes this one
+    if (token !== mediaLoadToken) return true;
+    if (!res.ok) return false;
+    const data = await res.json();
+    // Anything the first paint needs besides the listing itself
+    if (isFirstPage && ready) await ready;
+    if (token !== mediaLoadToken) return true;
+    cursor = data.nextCursor;
+    onPage(data, isFirstPage, !cursor);
+    isFirstPage = false;
+  } while (cursor);
+  return true;
+}
+
+// Read an NDJSON listing as it streams in, handing items on in batches
+// (the first one small, so the gallery appears quickly).
+async function fetchMediaStream(url, onBatch) {
+  const token = ++mediaLoadToken;
   const res = await fetch(url);
-  showGalleryLoading(false);
-  if (!res.ok) {
-    alert("Unable to load media");
-    return;
+  if (token !== mediaLoadToken) return true;
+  if (!res.ok || !res.body) return false;
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffered = "";
+  let batch = [];
+  let isFirstBatch = true;
+  for (;;) {
+    const { value, done } = await reader.read();
+    // A newer load (project switch, filter change) supersedes this one
+    if (token !== mediaLoadToken) {
+      reader.cancel();
+      return true;
+    }
+    buffered += decoder.decode(value, { stream: !done });
+    const lines = buffered.split("\n");
+    buffered = done ? "" : lines.pop();
+    for (const line of lines) {
+      if (line) batch.push(JSON.parse(line));
+    }
+    if (done || batch.length >= (isFirstBatch ? MEDIA_FIRST_PAGE_SIZE : MEDIA_PAGE_SIZE)) {
+      onBatch(batch, isFirstBatch, done);
+      batch = [];
+      isFirstBatch = false;
+    }
+    if (done) return true;
   }
-  const data = await res.json();
-  state.images = data.images;
-  state.description = "";
-  workspaceTitle.textContent = "All Albums";
-  
+}
+
+// Where the thumbnails of the first page of a listing are on its sprite
+// sheet, by file name; empty if the map could not be fetched.
+async function fetchSprites(project, query) {
+  const cardWidth = GRID_THUMB_WIDTHS[state.gridSize] || GRID_THUMB_WIDTHS.medium;
+  const size = cardWidth * (window.devicePixelRatio || 1) <= 200 ? 200 : 400;
+  const sprites = new Map();
+  try {
+    const res = await fetch(
+      `/api/projects/${encodeURIComponent(project)}/sprites?${query}&size=${size}&limit=${SPRITE_PAGE_SIZE}`
+    );
+    if (!res.ok) return sprites;
+    const data = await res.json();
+    if (!data.sheet) return sprites;
+    for (const [name, place] of Object.entries(data.items)) {
+      sprites.set(name, {
+        ...place,
+        size: data.size,
+        sheet: data.sheet,
+        sheetWidth: data.width,
+        sheetHeight: data.height,
+      });
+    }
+  } catch (error) {
+    console.warn("Sprite sheet unavailable", error);
+  }
+  return sprites;
+}
+
+// The thumbnail of a card cut out of its sprite sheet: the viewBox selects
+// its place on the sheet, and "slice" scales it to cover the card like
+// object-fit: cover does for the <img> it stands in for.
+function spriteImage(media, sprite, onError) {
+  const svg = document.createElementNS(SVG_NS, "svg");
+  svg.setAttribute("class", "image-card__sprite");
+  svg.setAttribute("viewBox", `${sprite.x} ${sprite.y} ${sprite.width} ${sprite.height}`);
+  svg.setAttribute("preserveAspectRatio", "xMidYMid slice");
+  svg.setAttribute("role", "img");
+  svg.setAttribute("aria-label", media.name);
+  if (media.placeholder) {
+    svg.style.backgroundImage = `url("${media.placeholder}")`;
+  }
+  const image = document.createElementNS(SVG_NS, "image");
+  image.setAttribute("href", sprite.sheet);
+  image.setAttribute("width", sprite.sheetWidth);
+  image.setAttribute("height", sprite.sheetHeight);
+  // A sheet pruned since its map was fetched: load the thumbnail on its own
+  image.addEventListener("error", () => {
+    state.sprites.delete(media.name);
+    onError(svg);
+  });
+  svg.appendChild(image);
+  return svg;
+}
+
+function updateWorkspaceMeta() {
   const imageCount = state.images.filter((m) => m.type === "image").length;
   const videoCount = state.images.filter((m) => m.type === "video").length;
   const parts = [];
   if (imageCount > 0) parts.push(`${imageCount} photo${imageCount === 1 ? "" : "s"}`);
   if (videoCount > 0) parts.push(`${videoCount} video${videoCount === 1 ? "" : "s"}`);
   workspaceMeta.textContent = parts.length ? parts.join(", ") : "No media";
-  
-  // Hide description section for All Albums view
-  projectNoteSection.hidden = true;
-  projectDescriptionField.value = "";
-  enableWorkspace();
-  renderImages();
+}
+
+async function loadAllProjectsState() {
+  showGalleryLoading(true);
+  // Streamed in listing order, so the first items show before the whole library is read
+  const url = `/api/all-media?media=${state.mediaFilter}&sort=${state.sortBy}&format=ndjson`;
+  const ok = await fetchMediaStream(url, (images, isFirstPage, isLastPage) => {
+    if (isFirstPage) {
+      showGalleryLoading(false);
+      state.images = images;
+      // Sprite sheets are per project
+      state.sprites = new Map();
+      state.description = "";
+      workspaceTitle.textContent = "All Albums";
+      // Hide description section for All Albums view
+      projectNoteSection.hidden = true;
+      projectDescriptionField.value = "";
+      enableWorkspace();
+    } else {
+      state.images = state.images.concat(images);
+    }
+    updateWorkspaceMeta();
+    if (isFirstPage || isLastPage) {
+      renderImages();
+    }
+  });
+  showGalleryLoading(false);
+  if (!ok) {
+    alert("Unable to load media");
+  }
 }
 
 async function loadProjectState() {
+  // Files may have been replaced since their EXIF was fetched
+  exifCache.clear();
   if (state.isAllProjects) {
     await loadAllProjectsState();
     return;
@@ -689,31 +851,41 @@ async function loadProjectState() {
     return;
   }
   showGalleryLoading(true);
-  const url = `/api/projects/${encodeURIComponent(state.currentProject)}/images?media=${state.mediaFilter}&sort=${state.sortBy}`;
-  const res = await fetch(url);
+  const query = `media=${state.mediaFilter}&sort=${state.sortBy}`;
+  const url = `/api/projects/${encodeURIComponent(state.currentProject)}/images?${query}`;
+  let sprites = new Map();
+  const spritesLoaded = fetchSprites(state.currentProject, query).then((loaded) => {
+    sprites = loaded;
+  });
+  const ready = Promise.race([
+    spritesLoaded,
+    new Promise((resolve) => setTimeout(resolve, SPRITE_WAIT_MS)),
+  ]);
+  const ok = await fetchMediaPages(url, (data, isFirstPage, isLastPage) => {
+    if (isFirstPage) {
+      showGalleryLoading(false);
+      state.images = data.images;
+      state.sprites = sprites;
+      state.description = data.description || "";
+      state.rankingVersion = data.rankingVersion ?? null;
+      workspaceTitle.textContent = data.project;
+      // Show description section and exit edit mode
+      projectNoteSection.hidden = false;
+      exitDescriptionEditMode(false);
+      projectDescriptionField.value = state.description;
+      enableWorkspace();
+    } else {
+      state.images = state.images.concat(data.images);
+    }
+    updateWorkspaceMeta();
+    if (isFirstPage || isLastPage) {
+      renderImages();
+    }
+  }, ready);
   showGalleryLoading(false);
-  if (!res.ok) {
+  if (!ok) {
     alert("Unable to load album");
-    return;
   }
-  const data = await res.json();
-  state.images = data.images;
-  state.description = data.description || "";
-  workspaceTitle.textContent = data.project;
-  
-  const imageCount = state.images.filter((m) => m.type === "image").length;
-  const videoCount = state.images.filter((m) => m.type === "video").length;
-  const parts = [];
-  if (imageCount > 0) parts.push(`${imageCount} photo${imageCount === 1 ? "" : "s"}`);
-  if (videoCount > 0) parts.push(`${videoCount} video${videoCount === 1 ? "" : "s"}`);
-  workspaceMeta.textContent = parts.length ? parts.join(", ") : "No media";
-  
-  // Show description section and exit edit mode
-  projectNoteSection.hidden = false;
-  exitDescriptionEditMode(false);
-  projectDescriptionField.value = state.description;
-  enableWorkspace();
-  renderImages();
 }
 
 function showGalleryLoading(show) {
@@ -802,7 +974,18 @@ function renderImages() {
     }
     
     const rank = card.querySelector(".rank-pill");
-    if (media.isRanked) {
+    if (state.sortBy === "rating") {
+      // Ratings from everyone's votes, with their 95% interval on hover
+      if (media.rating) {
+        const { score, low, high, votes } = media.rating;
+        rank.textContent = `${Math.round(score)}`;
+        rank.title = `${Math.round(low)}–${Math.round(high)} from ${votes} vote${votes === 1 ? "" : "s"}`;
+        rank.classList.remove("unranked");
+      } else {
+        rank.textContent = "Unrated";
+        rank.classList.add("unranked");
+      }
+    } else if (media.isRanked) {
       rank.textContent = `#${media.rank}`;
       rank.classList.remove("unranked");
     } else {
@@ -831,7 +1014,7 @@ function renderImages() {
         videoThumbnail.style.transition = "opacity 0.3s ease";
         videoThumbnail.style.opacity = "0";
       }
-      video.src = `${media.url}?v=${Date.now()}`;
+      video.src = media.url;
       video.addEventListener("loadeddata", () => {
         video.currentTime = 0.1;
         if (videoThumbnail) {
@@ -853,16 +1036,45 @@ function renderImages() {
       img.alt = media.name;
       // Set loading attribute before src to ensure lazy loading works correctly
       img.loading = "lazy";
+      // The listing inlines a tiny preview, shown scaled up until the thumbnail loads
+      if (media.placeholder) {
+        img.style.backgroundImage = `url("${media.placeholder}")`;
+        img.classList.add("has-placeholder");
+      }
       
-      // Always use thumbnail if available for faster loading
-      if (media.thumbUrl) {
-        img.src = `${media.thumbUrl}?v=${Date.now()}`;
-        // Preload full image in background for when user clicks
-        const fullImg = new Image();
-        fullImg.src = `${media.url}?v=${Date.now()}`;
+      // Always use thumbnail if available for faster loading. Thumbnail URLs
+      // change with their content and files revalidate by ETag, so neither
+      // needs a cache-busting query string.
+      const showThumbnail = () => {
+        if (media.thumbUrl) {
+          if (media.thumbUrls) {
+            // Let the browser pick the smallest rendition that fills the card
+            img.sizes = gridThumbSizes();
+            img.srcset = Object.entries(media.thumbUrls)
+              .map(([size, url]) => `${url} ${size}w`)
+              .join(", ");
+          }
+          img.src = media.thumbUrl;
+        } else {
+          img.src = media.url;
+        }
+      };
+      // Cut from the sprite sheet while the sheet still shows the current thumbnail
+      const sprite = state.sprites.get(media.name);
+      if (sprite && media.thumbUrls && media.thumbUrls[sprite.size] === sprite.thumbUrl) {
+        img.replaceWith(spriteImage(media, sprite, (svg) => {
+          svg.replaceWith(img);
+          showThumbnail();
+        }));
       } else {
-        img.src = `${media.url}?v=${Date.now()}`;
+        showThumbnail();
       }
+      // Preload the full image once the pointer is over the card, for when
+      // the user clicks, rather than fetching every image on first paint
+      card.addEventListener("pointerenter", () => {
+        const fullImg = new Image();
+        fullImg.src = media.url;
+      }, { once: true });
       
       // Add fade-in animation when image loads
       img.addEventListener("load", () => {
@@ -1050,10 +1262,17 @@ bulkDeleteBtn.addEventListener("click", async () => {
         body: JSON.stringify({ files }),
       });
       
-      if (!res.ok) {
-        allSucceeded = false;
-        console.error(`Failed to delete files from ${projectName}`);
+      let data;
+      try {
+        data = await jobResult(res, `Deleting ${files.length} file(s) from ${projectName}`);
+      } catch (error) {
+        if (!error.cancelled) {
+          allSucceeded = false;
+          console.error(`Failed to delete files from ${projectName}:`, error);
+        }
+        continue;
       }
+      removeMediaItems(projectName, data.deleted);
     }
     
     if (!allSucceeded) {
@@ -1061,7 +1280,7 @@ bulkDeleteBtn.addEventListener("click", async () => {
     }
     
     exitSelectionMode();
-    await loadAllProjectsState();
+    updateWorkspaceMeta();
     await fetchProjects();
   } else {
     // Single project view
@@ -1074,13 +1293,16 @@ bulkDeleteBtn.addEventListener("click", async () => {
       body: JSON.stringify({ files: Array.from(state.selectedItems) }),
     });
     
-    if (!res.ok) {
-      alert("Failed to delete files");
+    let data;
+    try {
+      data = await jobResult(res, `Deleting ${state.selectedItems.size} file(s)`);
+    } catch (error) {
+      if (!error.cancelled) alert("Failed to delete files");
       return;
     }
-    
+    removeMediaItems(projectName, data.deleted);
     exitSelectionMode();
-    await loadProjectState();
+    updateWorkspaceMeta();
     await fetchProjects();
   }
 });
@@ -1150,7 +1372,12 @@ bulkTagBtn.addEventListener("click", async () => {
     return;
   }
   
-  await loadProjectState();
+  const data = await res.json();
+  data.updated.forEach(({ name, tags }) => {
+    const media = findMedia(projectName, name);
+    if (media) media.tags = tags;
+  });
+  renderImages();
 });
 
 // ============ Tag Functions ============
@@ -1258,9 +1485,18 @@ function downloadMediaFile(projectName, filename) {
 async function downloadProject(projectName) {
   if (!projectName) return;
   
-  const downloadUrl = `/api/projects/${encodeURIComponent(projectName)}/download`;
+  // The server builds the archive (or finds it cached) first, so the download
+  // itself is a plain file
+  let data;
+  try {
+    const res = await fetch(`/api/projects/${encodeURIComponent(projectName)}/archive`, { method: "POST" });
+    data = await jobResult(res, `Preparing ${projectName}.zip`);
+  } catch (error) {
+    if (!error.cancelled) alert("Failed to prepare the download: " + error.message);
+    return;
+  }
   const link = document.createElement("a");
-  link.href = downloadUrl;
+  link.href = data.download;
   link.download = `${projectName}.zip`;
   document.body.appendChild(link);
   link.click();
@@ -1284,13 +1520,10 @@ async function deleteMediaFile(projectName, filename) {
     return;
   }
   
-  if (state.isAllProjects) {
-    await loadAllProjectsState();
-    await fetchProjects();
-  } else {
-    await loadProjectState();
-    await fetchProjects();
-  }
+  removeMediaItems(projectName, [filename]);
+  updateWorkspaceMeta();
+  renderImages();
+  await fetchProjects();
 }
 
 async function updateMediaTags(projectName, filename, tags) {
@@ -1331,15 +1564,296 @@ async function reorderImages(from, to) {
   const [moved] = state.images.splice(from, 1);
   state.images.splice(to, 0, moved);
   
-  // Update rankings immediately for visual feedback
+  // Only the move is sent: the server places the item next to its new neighbour
+  const before = to + 1 < state.images.length ? state.images[to + 1].name : null;
+  const after = before === null && to > 0 ? state.images[to - 1].name : null;
+  
+  // Update rankings immediately for visual feedback. Unranked items shown
+  // above the drop point become ranked too, as the server ranks them first.
+  const lastRanked = before === null ? to : to + 1;
   state.images.forEach((img, idx) => {
+    if (idx <= lastRanked && (img === moved || !img.isRanked) && state.sortBy === "rank") {
+      img.isRanked = true;
+    }
     if (img.isRanked) {
       img.rank = idx + 1;
     }
   });
   
   renderImages();
-  await saveOrder();
+  await moveRanking(moved.name, before, after);
+}
+
+async function moveRanking(name, before, after) {
+  const body = { name, media: state.mediaFilter };
+  if (before !== null) body.before = before;
+  else if (after !== null) body.after = after;
+  try {
+    await sendRankingEdit(`/api/projects/${encodeURIComponent(state.currentProject)}/rank/move`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify(body),
+    });
+  } catch (error) {
+    console.error(error.message);
+  }
+}
+
+// Send a ranking change conditional on the version this gallery was loaded at.
+// If another device changed the ranking first, reload instead of overwriting it
+// and resolve to null.
+function sendRankingEdit(url, options) {
+  const project = state.currentProject;
+  const attempt = rankingQueue.then(async () => {
+    const headers = { ...(options.headers || {}) };
+    if (state.rankingVersion !== null) {
+      headers["If-Match"] = `"${state.rankingVersion}"`;
+    }
+    const res = await fetch(url, { ...options, headers });
+    if (res.status === 412) {
+      if (project === state.currentProject) {
+        alert("The ranking was changed on another device. Showing the latest order.");
+        await loadProjectState();
+      }
+      return null;
+    }
+    if (!res.ok) {
+      throw new Error("Failed to save ranking");
+    }
+    const data = await res.json();
+    if (project === state.currentProject) {
+      state.rankingVersion = data.version;
+    }
+    return data;
+  });
+  rankingQueue = attempt.catch(() => null);
+  return attempt;
+}
+
+// ============ Change Feed ============
+// The server publishes every change, from this device or any other, as an
+// event (see /api/events). Small changes are applied to the loaded gallery
+// in place; anything else reloads it, which the listing's ETag keeps cheap.
+const CHANGE_FEED_EVENTS = [
+  "media.added", "media.deleted", "media.updated", "tags.changed", "comment.changed",
+  "rank.moved", "rank.replaced", "ratings.changed",
+  "project.created", "project.updated", "project.renamed", "project.deleted", "reset",
+];
+const CHANGE_RELOAD_DELAY = 300;
+const CHANGE_FEED_RETRY_DELAY = 5000;
+let changeFeed = null;
+let lastEventSeq = null;
+let galleryReloadTimer = null;
+let projectsReloadTimer = null;
+let galleryRenderFrame = null;
+
+function connectChangeFeed() {
+  // Hidden tabs follow no feed: each open stream holds a server thread
+  if (!window.EventSource || changeFeed || document.hidden) return;
+  // The browser resumes from the last event id itself; after a refused
+  // connection it is passed explicitly so nothing in between is missed
+  const url = lastEventSeq === null ? "/api/events" : `/api/events?since=${lastEventSeq}`;
+  changeFeed = new EventSource(url);
+  CHANGE_FEED_EVENTS.forEach((type) => {
+    changeFeed.addEventListener(type, (event) => {
+      const change = JSON.parse(event.data);
+      lastEventSeq = change.seq;
+      applyChange(change);
+    });
+  });
+  changeFeed.addEventListener("error", () => {
+    if (changeFeed.readyState === EventSource.CLOSED) {
+      changeFeed = null;
+      setTimeout(connectChangeFeed, CHANGE_FEED_RETRY_DELAY);
+    }
+  });
+}
+
+// Drop the feed while the tab is hidden and catch up when it is shown again
+document.addEventListener("visibilitychange", () => {
+  if (document.hidden) {
+    if (changeFeed) {
+      changeFeed.close();
+      changeFeed = null;
+    }
+    return;
+  }
+  if (changeFeed) return;
+  if (lastEventSeq === null) {
+    // Nothing seen yet to resume from, so whatever changed meanwhile is reloaded
+    scheduleGalleryReload();
+    scheduleProjectsReload();
+  }
+  connectChangeFeed();
+});
+
+function scheduleGalleryReload() {
+  clearTimeout(galleryReloadTimer);
+  galleryReloadTimer = setTimeout(() => {
+    galleryReloadTimer = null;
+    loadProjectState();
+  }, CHANGE_RELOAD_DELAY);
+}
+
+function scheduleProjectsReload() {
+  clearTimeout(projectsReloadTimer);
+  projectsReloadTimer = setTimeout(() => {
+    projectsReloadTimer = null;
+    fetchProjects();
+  }, CHANGE_RELOAD_DELAY);
+}
+
+// A burst of events (thumbnails finishing, say) renders the gallery once
+function scheduleGalleryRender() {
+  if (galleryRenderFrame !== null) return;
+  galleryRenderFrame = requestAnimationFrame(() => {
+    galleryRenderFrame = null;
+    updateWorkspaceMeta();
+    renderImages();
+  });
+}
+
+function mediaProject(media) {
+  return media.project || state.currentProject;
+}
+
+function findMedia(project, name) {
+  return state.images.find((media) => media.name === name && mediaProject(media) === project);
+}
+
+// Remove files from the gallery, closing the gaps they leave in the ranking
+function removeMediaItems(project, names) {
+  const removed = new Set(names);
+  const gone = state.images.filter((media) => removed.has(media.name) && mediaProject(media) === project);
+  if (!gone.length) return;
+  gone
+    .filter((media) => media.isRanked)
+    .sort((a, b) => b.rank - a.rank)
+    .forEach((media) => {
+      state.images.forEach((other) => {
+        if (other.isRanked && other.rank > media.rank && mediaProject(other) === project) {
+          other.rank -= 1;
+        }
+      });
+    });
+  state.images = state.images.filter((media) => !gone.includes(media));
+  gone.forEach((media) => state.selectedItems.delete(media.name));
+}
+
+// Apply a move made elsewhere; false if the gallery can't follow it in place
+function applyRankMove(project, { name, rank, ranked }) {
+  const moved = findMedia(project, name);
+  if (!moved || ranked.length) return false;
+  const from = moved.isRanked ? moved.rank : Infinity;
+  state.images.forEach((media) => {
+    if (media === moved || !media.isRanked || mediaProject(media) !== project) return;
+    if (from < rank && media.rank > from && media.rank <= rank) {
+      media.rank -= 1;
+    } else if (rank < from && media.rank >= rank && media.rank < from) {
+      media.rank += 1;
+    }
+  });
+  moved.isRanked = true;
+  moved.rank = rank;
+  if (state.sortBy === "rank") {
+    const position = (media) => (media.isRanked ? media.rank : Number.MAX_SAFE_INTEGER);
+    state.images.sort((a, b) => position(a) - position(b));
+  }
+  return true;
+}
+
+function applyProjectChange(type, project, data) {
+  scheduleProjectsReload();
+  if (project !== state.currentProject) {
+    if (state.isAllProjects && type !== "project.created") scheduleGalleryReload();
+    return;
+  }
+  if (type === "project.renamed") {
+    state.currentProject = data.name;
+    workspaceTitle.textContent = data.name;
+    updateURL();
+    updateMobileProjectName();
+  } else if (type === "project.updated" && !isEditingDescription) {
+    state.description = data.description;
+    projectDescriptionField.value = data.description;
+  }
+}
+
+function applyChange({ type, project, data }) {
+  if (type === "reset") {
+    // Events were missed: start over from the current state
+    scheduleProjectsReload();
+    scheduleGalleryReload();
+    return;
+  }
+  if (type.startsWith("project.")) {
+    applyProjectChange(type, project, data);
+    return;
+  }
+  if (type === "media.added" || type === "media.deleted") {
+    scheduleProjectsReload();
+  }
+  if (!state.isAllProjects && project !== state.currentProject) return;
+
+  // Ranking edits carry the version they produced. One step ahead of the
+  // gallery can be applied; further ahead means a change was missed.
+  const version = data.rankingVersion;
+  const tracksVersion = version !== undefined && !state.isAllProjects && state.rankingVersion !== null;
+  let inStep = tracksVersion && version === state.rankingVersion + 1;
+  if (tracksVersion && version > state.rankingVersion + 1) {
+    scheduleGalleryReload();
+    return;
+  }
+
+  switch (type) {
+    case "media.added":
+      scheduleGalleryReload();
+      return;
+    case "media.deleted":
+      removeMediaItems(project, data.names);
+      break;
+    case "media.updated":
+      data.items.forEach((item) => {
+        const media = findMedia(project, item.name);
+        if (media) Object.assign(media, item);
+      });
+      break;
+    case "tags.changed":
+      data.updated.forEach(({ name, tags }) => {
+        const media = findMedia(project, name);
+        if (media) media.tags = tags;
+      });
+      break;
+    case "comment.changed": {
+      const media = findMedia(project, data.name);
+      if (media) media.comment = data.comment;
+      break;
+    }
+    case "rank.moved":
+      if (state.isAllProjects) {
+        scheduleGalleryReload();
+        return;
+      }
+      // Already applied: this device made the move and has its response
+      if (tracksVersion && !inStep) return;
+      if (!applyRankMove(project, data)) {
+        inStep = false;
+        scheduleGalleryReload();
+      }
+      break;
+    case "rank.replaced":
+      if (state.isAllProjects || !tracksVersion || inStep) scheduleGalleryReload();
+      return;
+    case "ratings.changed":
+      if (state.sortBy === "rating") scheduleGalleryReload();
+      return;
+    default:
+      return;
+  }
+  if (inStep) {
+    state.rankingVersion = version;
+  }
+  scheduleGalleryRender();
 }
 
 // ============ Touch Drag-and-Drop Support ============
@@ -1533,19 +2047,20 @@ async function uploadFiles(files, projectName = null, skipDuplicateCheck = false
   const filesArray = Array.isArray(files) ? files : Array.from(files);
   if (!filesArray.length) return;
 
-  // Check for duplicates first if not skipping
+  // Check for duplicates first if not skipping. Only sizes and sampled
+  // fingerprints are sent; file bodies are uploaded once, afterwards.
   if (!skipDuplicateCheck) {
-    const checkFormData = new FormData();
-    filesArray.forEach((file) => {
-      if (file instanceof File) {
-        checkFormData.append("files", file);
-      }
-    });
-
     try {
+      const entries = [];
+      for (const file of filesArray) {
+        if (file instanceof File) {
+          entries.push({ filename: file.name, size: file.size, fingerprint: await fileFingerprint(file) });
+        }
+      }
       const checkRes = await fetch(`/api/projects/${encodeURIComponent(targetProject)}/check-duplicates`, {
         method: "POST",
-        body: checkFormData,
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ files: entries }),
       });
 
       if (checkRes.ok) {
@@ -1553,6 +2068,7 @@ async function uploadFiles(files, projectName = null, skipDuplicateCheck = false
         if (checkData.duplicates && checkData.duplicates.length > 0) {
           // Store files and show modal
           state.pendingUploadFiles = filesArray;
+          state.pendingDuplicateNames = new Set(checkData.duplicates.map((dup) => dup.filename));
           showDuplicateModal(checkData.duplicates, targetProject);
           return;
         }
@@ -1567,16 +2083,102 @@ async function uploadFiles(files, projectName = null, skipDuplicateCheck = false
   await performUpload(filesArray, targetProject);
 }
 
+// ============ File Fingerprints ============
+// Must match file_fingerprint() on the server: SHA-256 of the first, middle
+// and last 64 KiB of a file, or of the whole file when it is small.
+const FINGERPRINT_SAMPLE_SIZE = 64 * 1024;
+
+async function fileFingerprint(file) {
+  const sample = FINGERPRINT_SAMPLE_SIZE;
+  const parts = file.size <= 3 * sample
+    ? [file]
+    : [0, Math.floor((file.size - sample) / 2), file.size - sample].map((start) => file.slice(start, start + sample));
+  const bytes = new Uint8Array(await new Blob(parts).arrayBuffer());
+  if (window.crypto && window.crypto.subtle) {
+    const digest = new Uint8Array(await window.crypto.subtle.digest("SHA-256", bytes));
+    return Array.from(digest, (byte) => byte.toString(16).padStart(2, "0")).join("");
+  }
+  return sha256Hex(bytes);
+}
+
+// crypto.subtle only exists on secure origins, and BestShot is often opened
+// over plain HTTP on a LAN, so keep a small SHA-256 for that case.
+const SHA256_K = new Uint32Array([
+  0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+  0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+  0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+  0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+  0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+  0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+  0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+  0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2,
+]);
+
+function sha256Hex(bytes) {
+  const rotr = (x, n) => (x >>> n) | (x << (32 - n));
+  const padded = new Uint8Array(((bytes.length + 72) >> 6) << 6);
+  padded.set(bytes);
+  padded[bytes.length] = 0x80;
+  const view = new DataView(padded.buffer);
+  view.setUint32(padded.length - 8, Math.floor(bytes.length / 0x20000000));
+  view.setUint32(padded.length - 4, (bytes.length * 8) >>> 0);
+
+  const h = new Uint32Array([
+    0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19,
+  ]);
+  const w = new Uint32Array(64);
+  for (let offset = 0; offset < padded.length; offset += 64) {
+    for (let i = 0; i < 16; i++) w[i] = view.getUint32(offset + i * 4);
+    for (let i = 16; i < 64; i++) {
+      const s0 = rotr(w[i - 15], 7) ^ rotr(w[i - 15], 18) ^ (w[i - 15] >>> 3);
+      const s1 = rotr(w[i - 2], 17) ^ rotr(w[i - 2], 19) ^ (w[i - 2] >>> 10);
+      w[i] = w[i - 16] + s0 + w[i - 7] + s1;
+    }
+    let [a, b, c, d, e, f, g, k] = h;
+    for (let i = 0; i < 64; i++) {
+      const t1 = (k + (rotr(e, 6) ^ rotr(e, 11) ^ rotr(e, 25)) + ((e & f) ^ (~e & g)) + SHA256_K[i] + w[i]) >>> 0;
+      const t2 = ((rotr(a, 2) ^ rotr(a, 13) ^ rotr(a, 22)) + ((a & b) ^ (a & c) ^ (b & c))) >>> 0;
+      k = g;
+      g = f;
+      f = e;
+      e = (d + t1) >>> 0;
+      d = c;
+      c = b;
+      b = a;
+      a = (t1 + t2) >>> 0;
+    }
+    h[0] += a;
+    h[1] += b;
+    h[2] += c;
+    h[3] += d;
+    h[4] += e;
+    h[5] += f;
+    h[6] += g;
+    h[7] += k;
+  }
+  return Array.from(h, (word) => word.toString(16).padStart(8, "0")).join("");
+}
+
 async function performUpload(filesArray, projectName = null) {
   const targetProject = projectName || state.currentProject;
   if (!targetProject) return;
   
+  // Large files go through the resumable protocol in chunks; the rest share
+  // one multipart request.
+  const files = filesArray.filter((file) => file instanceof File);
+  const largeFiles = files.filter((file) => file.size >= RESUMABLE_UPLOAD_THRESHOLD);
+  const smallFiles = files.filter((file) => file.size < RESUMABLE_UPLOAD_THRESHOLD);
   const formData = new FormData();
-  filesArray.forEach((file) => {
-    if (file instanceof File) {
-      formData.append("files", file);
-    }
-  });
+  smallFiles.forEach((file) => formData.append("files", file));
+
+  // Progress is tracked in bytes across every file
+  const totalBytes = files.reduce((sum, file) => sum + file.size, 0) || 1;
+  let finishedBytes = 0;
+  const showProgress = (loaded) => {
+    const percent = Math.round(((finishedBytes + loaded) / totalBytes) * 100);
+    uploadProgressFill.style.width = `${percent}%`;
+    uploadProgressStatus.textContent = `${percent}%`;
+  };
 
   // Show progress
   uploadProgress.hidden = false;
@@ -1584,31 +2186,45 @@ async function performUpload(filesArray, projectName = null) {
   uploadProgressStatus.textContent = "0%";
 
   try {
-    // Use XMLHttpRequest for progress tracking
-    await new Promise((resolve, reject) => {
-      const xhr = new XMLHttpRequest();
-      
-      xhr.upload.addEventListener("progress", (e) => {
-        if (e.lengthComputable) {
-          const percent = Math.round((e.loaded / e.total) * 100);
-          uploadProgressFill.style.width = `${percent}%`;
-          uploadProgressStatus.textContent = `${percent}%`;
-        }
-      });
+    const thumbnailJobs = [];
+    if (smallFiles.length) {
+      // Use XMLHttpRequest for progress tracking
+      const responseText = await new Promise((resolve, reject) => {
+        const xhr = new XMLHttpRequest();
+        
+        xhr.upload.addEventListener("progress", (e) => {
+          if (e.lengthComputable) {
+            const sentBytes = smallFiles.reduce((sum, file) => sum + file.size, 0);
+            showProgress((e.loaded / e.total) * sentBytes);
+          }
+        });
 
-      xhr.addEventListener("load", () => {
-        if (xhr.status >= 200 && xhr.status < 300) {
-          resolve(xhr.response);
-        } else {
-          reject(new Error(xhr.statusText));
-        }
-      });
+        xhr.addEventListener("load", () => {
+          if (xhr.status >= 200 && xhr.status < 300) {
+            resolve(xhr.response);
+          } else {
+            reject(new Error(xhr.statusText));
+          }
+        });
 
-      xhr.addEventListener("error", () => reject(new Error("Upload failed")));
+        xhr.addEventListener("error", () => reject(new Error("Upload failed")));
 
-      xhr.open("POST", `/api/projects/${encodeURIComponent(targetProject)}/upload`);
-      xhr.send(formData);
-    });
+        xhr.open("POST", `/api/projects/${encodeURIComponent(targetProject)}/upload`);
+        xhr.send(formData);
+      });
+      finishedBytes += smallFiles.reduce((sum, file) => sum + file.size, 0);
+      try {
+        thumbnailJobs.push(JSON.parse(responseText).thumbnailJob);
+      } catch (e) {
+        // Older servers may not return JSON here; thumbnails appear on next load
+      }
+    }
+
+    for (const file of largeFiles) {
+      const result = await resumableUpload(file, targetProject, showProgress);
+      finishedBytes += file.size;
+      thumbnailJobs.push(result.thumbnailJob);
+    }
 
     uploadProgressFill.style.width = "100%";
     uploadProgressStatus.textContent = "Complete!";
@@ -1624,6 +2240,10 @@ async function performUpload(filesArray, projectName = null) {
       await loadProjectState();
     }
     await fetchProjects();
+    // With the change feed, cards switch to their thumbnails as each one is made
+    if (!changeFeed) {
+      thumbnailJobs.forEach((jobId) => watchThumbnailJob(jobId, targetProject));
+    }
   } catch (error) {
     console.error("Upload error:", error);
     uploadProgress.hidden = true;
@@ -1631,6 +2251,170 @@ async function performUpload(filesArray, projectName = null) {
   }
 }
 
+// ============ Resumable Uploads ============
+// Files at least this large are sent in chunks that survive a dropped
+// connection. The upload URL is kept in localStorage, so even a reload can
+// pick up where the last chunk left off.
+const RESUMABLE_UPLOAD_THRESHOLD = 32 * 1024 * 1024;
+const RESUMABLE_CHUNK_SIZE = 8 * 1024 * 1024;
+const RESUMABLE_RETRY_DELAYS = [1000, 3000, 5000, 10000, 20000, 30000];
+
+function resumableUploadKey(projectName, file) {
+  return `upload:${projectName}:${file.name}:${file.size}:${file.lastModified}`;
+}
+
+function sendUploadChunk(url, blob, offset, onProgress) {
+  return new Promise((resolve, reject) => {
+    const xhr = new XMLHttpRequest();
+    xhr.upload.addEventListener("progress", (e) => onProgress(e.loaded));
+    xhr.addEventListener("load", () => {
+      if (xhr.status >= 200 && xhr.status < 300) {
+        resolve(xhr);
+      } else {
+        const error = new Error(xhr.statusText || "Upload failed");
+        error.status = xhr.status;
+        reject(error);
+      }
+    });
+    xhr.addEventListener("error", () => reject(new Error("Upload failed")));
+    xhr.open("PATCH", url);
+    xhr.setRequestHeader("Tus-Resumable", "1.0.0");
+    xhr.setRequestHeader("Upload-Offset", String(offset));
+    xhr.setRequestHeader("Content-Type", "application/offset+octet-stream");
+    xhr.send(blob);
+  });
+}
+
+async function fetchUploadOffset(url) {
+  const res = await fetch(url, { method: "HEAD", headers: { "Tus-Resumable": "1.0.0" } });
+  if (res.status === 404) return null;
+  if (!res.ok) throw new Error(res.statusText);
+  return Number(res.headers.get("Upload-Offset"));
+}
+
+async function resumableUpload(file, projectName, onProgress) {
+  const key = resumableUploadKey(projectName, file);
+  let url = localStorage.getItem(key);
+  let offset = url ? await fetchUploadOffset(url).catch(() => null) : null;
+  if (offset === null) {
+    const res = await fetch(`/api/projects/${encodeURIComponent(projectName)}/uploads`, {
+      method: "POST",
+      headers: {
+        "Tus-Resumable": "1.0.0",
+        "Upload-Length": String(file.size),
+        "Upload-Metadata": `filename ${btoa(unescape(encodeURIComponent(file.name)))}`,
+      },
+    });
+    if (!res.ok) throw new Error(res.statusText || "Upload failed");
+    url = res.headers.get("Location");
+    offset = 0;
+    localStorage.setItem(key, url);
+  }
+
+  let attempt = 0;
+  for (;;) {
+    const chunk = file.slice(offset, Math.min(offset + RESUMABLE_CHUNK_SIZE, file.size));
+    const chunkStart = offset;
+    try {
+      const xhr = await sendUploadChunk(url, chunk, offset, (loaded) => onProgress(chunkStart + loaded));
+      attempt = 0;
+      offset = Number(xhr.getResponseHeader("Upload-Offset"));
+      if (offset >= file.size) {
+        localStorage.removeItem(key);
+        return JSON.parse(xhr.responseText);
+      }
+    } catch (error) {
+      if (error.status === 404) {
+        localStorage.removeItem(key);
+        throw error;
+      }
+      // Give up for now, keeping the upload URL so the next attempt resumes
+      if (attempt >= RESUMABLE_RETRY_DELAYS.length) throw error;
+      // Wait, then ask the server how much actually arrived and carry on from there
+      await new Promise((resolve) => setTimeout(resolve, RESUMABLE_RETRY_DELAYS[attempt]));
+      attempt += 1;
+      const serverOffset = await fetchUploadOffset(url).catch(() => offset);
+      if (serverOffset === null) {
+        localStorage.removeItem(key);
+        throw error;
+      }
+      offset = serverOffset;
+    }
+  }
+}
+
+// Long operations (archives, batch deletes, moves, thumbnails) run as server
+// jobs. A request that starts one answers 200 with the result when the job is
+// quick, or 202 with the job id to follow until it finishes.
+const JOB_POLL_INTERVAL = 1500;
+const JOB_FINISHED = new Set(["completed", "failed", "cancelled"]);
+
+async function waitForJob(jobId, onProgress = null) {
+  for (;;) {
+    await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL));
+    const res = await fetch(`/api/jobs/${encodeURIComponent(jobId)}`);
+    if (!res.ok) throw new Error("Lost track of the background job");
+    const job = await res.json();
+    if (onProgress) onProgress(job);
+    if (JOB_FINISHED.has(job.status)) return job;
+  }
+}
+
+// Follow a job in the progress panel, which offers to cancel it
+async function trackJob(jobId, title) {
+  jobProgressTitle.textContent = title;
+  jobProgressFill.style.width = "0%";
+  jobProgressStatus.textContent = "Queued";
+  jobProgressCancel.disabled = false;
+  jobProgressCancel.onclick = () => {
+    jobProgressCancel.disabled = true;
+    fetch(`/api/jobs/${encodeURIComponent(jobId)}/cancel`, { method: "POST" }).catch(() => {});
+  };
+  jobProgress.hidden = false;
+  try {
+    return await waitForJob(jobId, (job) => {
+      const percent = job.total ? Math.round(((job.done + job.failed) / job.total) * 100) : 0;
+      jobProgressFill.style.width = `${percent}%`;
+      jobProgressStatus.textContent = job.status === "queued" ? "Queued" : `${percent}%`;
+    });
+  } finally {
+    jobProgress.hidden = true;
+  }
+}
+
+// The result of a request that starts a job, once the job has finished.
+// Throws if either fails; a cancelled job throws an error marked `cancelled`.
+async function jobResult(res, title) {
+  const data = await res.json().catch(() => ({}));
+  if (!res.ok) throw new Error(data.description || `Request failed (${res.status})`);
+  if (res.status !== 202) return data;
+  const job = await trackJob(data.job, title);
+  if (job.status === "cancelled") {
+    const error = new Error("Cancelled");
+    error.cancelled = true;
+    throw error;
+  }
+  if (job.status !== "completed") throw new Error(job.error || "Background job failed");
+  return { ...data, ...job.result };
+}
+
+// Thumbnails are generated in the background after an upload. Without the change
+// feed, wait for the job and reload the gallery once it finishes so cards switch
+// over to the thumbnails.
+async function watchThumbnailJob(jobId, projectName) {
+  if (!jobId) return;
+  try {
+    await waitForJob(jobId);
+  } catch (e) {
+    return;
+  }
+  if (state.isAllProjects) {
+    await loadAllProjectsState();
+  } else if (projectName === state.currentProject) {
+    await loadProjectState();
+  }
+}
+
 function showDuplicateModal(duplicates, projectName) {
   duplicateList.innerHTML = "";
   duplicates.forEach((dup) => {
@@ -1652,50 +2436,18 @@ function closeDuplicateModal() {
   document.body.style.overflow = "";
   state.pendingUploadFiles = null;
   state.pendingUploadProject = null;
+  state.pendingDuplicateNames = null;
 }
 
 uploadSkipDuplicatesBtn.addEventListener("click", async () => {
   if (!state.pendingUploadFiles || !state.pendingUploadProject) return;
   const targetProject = state.pendingUploadProject;
+  const duplicateNames = state.pendingDuplicateNames || new Set();
+  // Only the files the project doesn't already have are uploaded
+  const files = state.pendingUploadFiles.filter((file) => !duplicateNames.has(file.name));
   closeDuplicateModal();
-  // Upload with duplicate check enabled (server will skip duplicates)
-  const formData = new FormData();
-  state.pendingUploadFiles.forEach((file) => {
-    if (file instanceof File) {
-      formData.append("files", file);
-    }
-  });
-  formData.append("checkDuplicates", "true");
-  
-  uploadProgress.hidden = false;
-  uploadProgressFill.style.width = "0%";
-  
-  try {
-    const res = await fetch(`/api/projects/${encodeURIComponent(targetProject)}/upload`, {
-      method: "POST",
-      body: formData,
-    });
-    
-    uploadProgressFill.style.width = "100%";
-    uploadProgressStatus.textContent = "Complete!";
-    
-    setTimeout(() => {
-      uploadProgress.hidden = true;
-    }, 1500);
-
-    if (!res.ok) {
-      throw new Error("Upload failed");
-    }
-    
-    if (state.isAllProjects) {
-      await loadAllProjectsState();
-    } else if (targetProject === state.currentProject) {
-      await loadProjectState();
-    }
-    await fetchProjects();
-  } catch (error) {
-    uploadProgress.hidden = true;
-    alert("Upload failed: " + error.message);
+  if (files.length) {
+    await performUpload(files, targetProject);
   }
 });
 
@@ -1713,15 +2465,14 @@ duplicateBackdrop.addEventListener("click", closeDuplicateModal);
 async function saveOrder() {
   if (!state.currentProject || state.isAllProjects) return;
   const order = state.images.map((img) => img.name);
-  const res = await fetch(`/api/projects/${encodeURIComponent(state.currentProject)}/rank`, {
-    method: "POST",
-    headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({ order }),
-  });
-
-  if (!res.ok) {
-    console.error("Failed to save ranking");
-    return;
+  try {
+    await sendRankingEdit(`/api/projects/${encodeURIComponent(state.currentProject)}/rank`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ order }),
+    });
+  } catch (error) {
+    console.error(error.message);
   }
 }
 
@@ -1818,14 +2569,18 @@ async function removeAllRankings() {
     return;
   }
   
-  const res = await fetch(`/api/projects/${encodeURIComponent(state.currentProject)}/rankings`, {
-    method: "DELETE",
-  });
-  
-  if (!res.ok) {
+  let data;
+  try {
+    data = await sendRankingEdit(`/api/projects/${encodeURIComponent(state.currentProject)}/rankings`, {
+      method: "DELETE",
+    });
+  } catch (error) {
     alert("Failed to remove rankings");
     return;
   }
+  if (!data) {
+    return;
+  }
   
   // Update state - mark all items as unranked
   state.images.forEach((img) => {
@@ -2108,7 +2863,7 @@ function openMediaViewer(index) {
   
   renderViewerTags(media);
   loadViewerComment(media);
-  loadViewerExif(media);
+  loadViewerExif(media, filteredImages, index);
   
   mediaViewerModal.hidden = false;
   document.body.style.overflow = "hidden";
@@ -2189,7 +2944,43 @@ viewerCommentInput.addEventListener("keydown", (e) => {
   }
 });
 
-async function loadViewerExif(media) {
+// EXIF for the viewer, fetched for a window of images around the current one
+// so arrow-key navigation doesn't wait on a request per image.
+// Keyed by project and name; values are promises of {exif, fileInfo} or null.
+const exifCache = new Map();
+const EXIF_WINDOW = 10;
+
+function exifCacheKey(media) {
+  return `${media.project || state.currentProject}\u0000${media.name}`;
+}
+
+function fetchExifWindow(filteredImages, index) {
+  const byProject = new Map();
+  const start = Math.max(0, index - EXIF_WINDOW);
+  const end = Math.min(filteredImages.length - 1, index + EXIF_WINDOW);
+  for (let i = start; i <= end; i++) {
+    const media = filteredImages[i];
+    const projectName = media && (media.project || state.currentProject);
+    if (!projectName || media.type !== "image" || exifCache.has(exifCacheKey(media))) continue;
+    if (!byProject.has(projectName)) byProject.set(projectName, []);
+    byProject.get(projectName).push(media);
+  }
+  byProject.forEach((items, projectName) => {
+    const params = new URLSearchParams();
+    items.forEach((media) => params.append("name", media.name));
+    const request = fetch(`/api/projects/${encodeURIComponent(projectName)}/exif?${params}`)
+      .then((res) => (res.ok ? res.json() : { files: {} }))
+      .catch(() => ({ files: {} }));
+    items.forEach((media) => {
+      exifCache.set(
+        exifCacheKey(media),
+        request.then((data) => data.files[media.name] || null)
+      );
+    });
+  });
+}
+
+async function loadViewerExif(media, filteredImages, index) {
   viewerExifPanel.hidden = true;
   exifGrid.innerHTML = "";
   
@@ -2206,16 +2997,17 @@ async function loadViewerExif(media) {
   }
   
   try {
-    const res = await fetch(
-      `/api/projects/${encodeURIComponent(projectName)}/files/${encodeURIComponent(media.name)}/exif`
-    );
+    // Also fetches the neighbours not cached yet, in one request per project
+    fetchExifWindow(filteredImages, index);
+    const data = await exifCache.get(exifCacheKey(media));
     
-    if (!res.ok) {
+    if (!data) {
       viewerExifSection.hidden = true;
       return;
     }
+    // The viewer may have moved on while this was loading
+    if (getFilteredImages()[state.viewerIndex] !== media) return;
     
-    const data = await res.json();
     const exif = data.exif || {};
     const fileInfo = data.fileInfo || {};
     
@@ -2429,30 +3221,44 @@ viewerTagInput.addEventListener("blur", () => {
 });
 
 // ============ Comparison Mode Functions ============
-function generatePairs(items) {
-  const pairs = [];
-  for (let i = 0; i < items.length; i++) {
-    for (let j = i + 1; j < items.length; j++) {
-      pairs.push([items[i], items[j]]);
-    }
+// The server picks each question (binary insertion, see app/comparison.py)
+// and keeps the session, so a comparison can be resumed from any device.
+function comparisonUrl(path = "") {
+  return `/api/projects/${encodeURIComponent(state.currentProject)}/compare${path}`;
+}
+
+async function readComparison(res) {
+  if (!res.ok) {
+    throw new Error(res.status === 404 ? "No comparison in progress" : "Comparison request failed");
   }
-  for (let i = pairs.length - 1; i > 0; i--) {
-    const j = Math.floor(Math.random() * (i + 1));
-    [pairs[i], pairs[j]] = [pairs[j], pairs[i]];
+  return res.json();
+}
+
+// Tells this browser's votes apart from other people's
+function voterId() {
+  let id = localStorage.getItem("voterId");
+  if (!id) {
+    id = `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`;
+    localStorage.setItem("voterId", id);
   }
-  return pairs;
+  return id;
 }
 
 function getUnrankedItems() {
   return state.images.filter((img) => !img.isRanked);
 }
 
-function openComparisonSelection() {
+async function openComparisonSelection() {
+  if (!state.currentProject || state.isAllProjects) {
+    alert("Open a single album to compare its items");
+    return;
+  }
   const allCount = state.images.length;
   const unrankedCount = getUnrankedItems().length;
   
   compareAllCount.textContent = `${allCount} item${allCount === 1 ? "" : "s"}`;
   compareUnrankedCount.textContent = `${unrankedCount} new item${unrankedCount === 1 ? "" : "s"}`;
+  compareVoteBtn.disabled = allCount < 2;
   
   const canCompareUnranked = unrankedCount >= 1 && allCount >= 2;
   compareUnrankedBtn.disabled = !canCompareUnranked;
@@ -2462,6 +3268,15 @@ function openComparisonSelection() {
     compareUnrankedBtn.classList.remove("disabled-option");
   }
   
+  // Offer to resume an unfinished session, possibly started on another device
+  compareResumeBtn.hidden = true;
+  const res = await fetch(comparisonUrl());
+  if (res.ok) {
+    const session = await res.json();
+    compareResumeCount.textContent = `${session.placed} of ${session.total} placed`;
+    compareResumeBtn.hidden = false;
+  }
+  
   comparisonSelection.hidden = false;
   document.body.style.overflow = "hidden";
 }
@@ -2471,428 +3286,279 @@ function closeComparisonSelection() {
   document.body.style.overflow = "";
 }
 
-function startComparisonMode(scope = "all") {
-  state.comparisonScope = scope;
-  
-  const itemsToCompare = [...state.images];
-  const unrankedItems = getUnrankedItems();
-  const unrankedNames = new Set(unrankedItems.map((img) => img.name));
-  
-  if (scope === "unranked" && unrankedItems.length < 1) {
+async function startComparisonMode(scope = "all") {
+  if (scope === "unranked" && getUnrankedItems().length < 1) {
     alert("Need at least 1 unranked item to compare");
     return;
   }
   
-  if (itemsToCompare.length < 2) {
+  if (state.images.length < 2) {
     alert("Need at least 2 items to start comparison mode");
     return;
   }
   
   closeComparisonSelection();
-  
-  const scores = {};
-  const beatsMap = {};
-  const losesTo = {};
-  
-  itemsToCompare.forEach((img) => {
-    scores[img.name] = 0;
-    beatsMap[img.name] = new Set();
-    losesTo[img.name] = new Set();
-  });
-  
-  if (scope === "unranked") {
-    const rankedItems = state.images.filter((img) => img.isRanked);
-    rankedItems.sort((a, b) => a.rank - b.rank);
-    
-    for (let i = 0; i < rankedItems.length; i++) {
-      for (let j = i + 1; j < rankedItems.length; j++) {
-        const winner = rankedItems[i].name;
-        const loser = rankedItems[j].name;
-        beatsMap[winner].add(loser);
-        losesTo[loser].add(winner);
-        scores[winner]++;
-      }
-    }
+  try {
+    const session = await readComparison(await fetch(comparisonUrl(), {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ scope, media: state.mediaFilter }),
+    }));
+    enterComparisonMode(session);
+  } catch (error) {
+    alert(error.message);
   }
-  
-  let allPairs;
-  if (scope === "unranked") {
-    allPairs = generatePairsWithUnranked(itemsToCompare, unrankedNames);
-  } else {
-    allPairs = generatePairs(itemsToCompare);
-  }
-  
-  state.comparison = {
-    allPairs,
-    currentPairIndex: 0,
-    scores,
-    beatsMap,
-    losesTo,
-    comparisonsAsked: 0,
-    comparisonsSkipped: 0,
-    itemsToCompare,
-    unrankedNames,
-  };
-  
-  comparisonMode.hidden = false;
-  document.body.style.overflow = "hidden";
-  
-  // Start preloading pairs immediately in the background
-  preloadComparisonPairs();
-  showCurrentPair();
 }
 
-function generatePairsWithUnranked(items, unrankedNames) {
-  const pairs = [];
-  for (let i = 0; i < items.length; i++) {
-    for (let j = i + 1; j < items.length; j++) {
-      if (unrankedNames.has(items[i].name) || unrankedNames.has(items[j].name)) {
-        pairs.push([items[i], items[j]]);
-      }
-    }
-  }
-  for (let i = pairs.length - 1; i > 0; i--) {
-    const j = Math.floor(Math.random() * (i + 1));
-    [pairs[i], pairs[j]] = [pairs[j], pairs[i]];
+async function resumeComparisonMode() {
+  closeComparisonSelection();
+  try {
+    enterComparisonMode(await readComparison(await fetch(comparisonUrl())));
+  } catch (error) {
+    alert(error.message);
   }
-  return pairs;
 }
 
-function isRelationshipKnown(itemA, itemB) {
-  if (!state.comparison) return false;
-  const { beatsMap } = state.comparison;
-  return beatsMap[itemA.name].has(itemB.name) || beatsMap[itemB.name].has(itemA.name);
+function enterComparisonMode(session) {
+  state.comparison = { session, busy: false };
+  comparisonMode.hidden = false;
+  document.body.style.overflow = "hidden";
+  showCurrentPair();
 }
 
-function recordWin(winnerName, loserName) {
-  if (!state.comparison) return;
-  const { beatsMap, losesTo, scores } = state.comparison;
-  
-  if (beatsMap[winnerName].has(loserName)) return;
-  
-  beatsMap[winnerName].add(loserName);
-  losesTo[loserName].add(winnerName);
-  scores[winnerName]++;
-  
-  for (const item of beatsMap[loserName]) {
-    if (!beatsMap[winnerName].has(item)) {
-      beatsMap[winnerName].add(item);
-      losesTo[item].add(winnerName);
-      scores[winnerName]++;
-      state.comparison.comparisonsSkipped++;
-    }
+// Open-ended voting: the server picks the most informative pair each time
+// and rates every file from the votes of everyone ranking the project.
+async function startVotingMode() {
+  if (state.images.length < 2) {
+    alert("Need at least 2 items to start comparison mode");
+    return;
   }
-  
-  for (const item of losesTo[winnerName]) {
-    if (!beatsMap[item].has(loserName)) {
-      beatsMap[item].add(loserName);
-      losesTo[loserName].add(item);
-      scores[item]++;
-      state.comparison.comparisonsSkipped++;
-    }
-    for (const subItem of beatsMap[loserName]) {
-      if (!beatsMap[item].has(subItem)) {
-        beatsMap[item].add(subItem);
-        losesTo[subItem].add(item);
-        scores[item]++;
-        state.comparison.comparisonsSkipped++;
-      }
-    }
+  closeComparisonSelection();
+  state.comparison = { voting: true, pair: null, cast: 0, busy: false };
+  comparisonMode.hidden = false;
+  document.body.style.overflow = "hidden";
+  await loadNextVote();
+}
+
+async function loadNextVote() {
+  const comparison = state.comparison;
+  try {
+    const pair = await readComparison(await fetch(
+      `/api/projects/${encodeURIComponent(state.currentProject)}/votes/next?media=${state.mediaFilter}`
+    ));
+    if (state.comparison !== comparison) return;
+    comparison.pair = pair;
+    showCurrentPair();
+  } catch (error) {
+    alert(error.message);
+    closeComparisonMode();
   }
 }
 
-function exitComparisonMode() {
+function closeComparisonMode() {
+  const votesCast = state.comparison && state.comparison.voting && state.comparison.cast > 0;
   state.comparison = null;
   comparisonMode.hidden = true;
   document.body.style.overflow = "";
+  // New votes change the ratings shown on the cards
+  if (votesCast) {
+    loadProjectState();
+  }
 }
 
-function findNextUnknownPair() {
-  if (!state.comparison) return null;
-  const { allPairs, currentPairIndex } = state.comparison;
-  
-  for (let i = currentPairIndex; i < allPairs.length; i++) {
-    const [left, right] = allPairs[i];
-    if (!isRelationshipKnown(left, right)) {
-      state.comparison.currentPairIndex = i;
-      return [left, right];
-    }
+async function exitComparisonMode() {
+  if (!state.comparison) return;
+  if (state.comparison.voting) {
+    closeComparisonMode();
+    return;
+  }
+  const { session } = state.comparison;
+  if (session.asked > 0 && !confirm("Discard this comparison? Use Continue Later to keep it.")) {
+    return;
   }
-  return null;
+  await fetch(comparisonUrl(), { method: "DELETE" });
+  closeComparisonMode();
 }
 
-// Preload upcoming comparison pairs for faster navigation
-function preloadComparisonPairs() {
-  if (!state.comparison) return;
-  const { allPairs, currentPairIndex } = state.comparison;
-  const preloadCount = 10; // Preload next 10 pairs
+function showComparisonCard(card, media) {
+  const img = card.querySelector("img");
+  const video = card.querySelector("video");
+  const name = card.querySelector(".comparison-card__name");
   
-  let preloaded = 0;
-  for (let i = currentPairIndex; i < allPairs.length && preloaded < preloadCount; i++) {
-    const [left, right] = allPairs[i];
-    
-    // Skip if relationship is already known (won't be shown)
-    if (isRelationshipKnown(left, right)) continue;
-    
-    // Preload left image
-    if (left.type === "image") {
-      const cacheKey = `compare:${left.url}`;
-      if (!preloadedImages.has(cacheKey)) {
-        preloadedImages.set(cacheKey, { status: 'loading' });
-        const img = new Image();
-        img.loading = "eager";
-        img.onload = () => {
-          preloadedImages.set(cacheKey, { img, status: 'loaded' });
-        };
-        img.onerror = () => {
-          preloadedImages.delete(cacheKey);
-        };
-        img.src = left.url;
-        
-        // Also preload thumbnail if available
-        if (left.thumbUrl && !preloadedImages.has(`compare:${left.thumbUrl}`)) {
-          const thumb = new Image();
-          thumb.src = left.thumbUrl;
-          preloadedImages.set(`compare:${left.thumbUrl}`, { img: thumb, status: 'loaded' });
-        }
-      }
-    }
-    
-    // Preload right image
-    if (right.type === "image") {
-      const cacheKey = `compare:${right.url}`;
-      if (!preloadedImages.has(cacheKey)) {
-        preloadedImages.set(cacheKey, { status: 'loading' });
-        const img = new Image();
-        img.loading = "eager";
-        img.onload = () => {
-          preloadedImages.set(cacheKey, { img, status: 'loaded' });
-        };
-        img.onerror = () => {
-          preloadedImages.delete(cacheKey);
-        };
-        img.src = right.url;
-        
-        // Also preload thumbnail if available
-        if (right.thumbUrl && !preloadedImages.has(`compare:${right.thumbUrl}`)) {
-          const thumb = new Image();
-          thumb.src = right.thumbUrl;
-          preloadedImages.set(`compare:${right.thumbUrl}`, { img: thumb, status: 'loaded' });
-        }
-      }
+  if (media.type === "video") {
+    img.hidden = true;
+    video.hidden = false;
+    video.src = media.url;
+    video.load();
+  } else {
+    video.hidden = true;
+    img.hidden = false;
+    const cacheKey = `compare:${media.url}`;
+    const preloaded = preloadedImages.get(cacheKey);
+    if (preloaded && preloaded.status === "loaded" && preloaded.img.complete) {
+      img.src = media.url;
+    } else if (media.thumbUrl) {
+      // Show the thumbnail first for instant feedback
+      img.src = media.thumbUrl;
+      const fullImg = new Image();
+      fullImg.onload = () => {
+        preloadedImages.set(cacheKey, { img: fullImg, status: "loaded" });
+        if (img.alt === media.name) img.src = media.url;
+      };
+      fullImg.src = media.url;
+    } else {
+      img.src = media.url;
     }
-    
-    preloaded++;
+    img.alt = media.name;
   }
+  name.textContent = media.name;
 }
 
 function showCurrentPair() {
   if (!state.comparison) return;
+  if (state.comparison.voting) {
+    const { pair, cast } = state.comparison;
+    comparisonProgress.textContent =
+      `${cast} vote${cast === 1 ? "" : "s"} this round • ${pair.votes} from ${pair.voters} voter${pair.voters === 1 ? "" : "s"} in total`;
+    showComparisonCard(compareLeft, pair.left);
+    showComparisonCard(compareRight, pair.right);
+    return;
+  }
+  const { session } = state.comparison;
   
-  const nextPair = findNextUnknownPair();
-  
-  if (!nextPair) {
+  if (session.done) {
     showComparisonResults();
     return;
   }
   
-  const [left, right] = nextPair;
-  const { comparisonsAsked, comparisonsSkipped, allPairs } = state.comparison;
-  
-  // Calculate percentage complete
-  const totalComparisons = allPairs.length;
-  const completedComparisons = comparisonsAsked + comparisonsSkipped;
-  const percentComplete = totalComparisons > 0 
-    ? Math.round((completedComparisons / totalComparisons) * 100)
+  const percentComplete = session.total > 0
+    ? Math.round((session.placed / session.total) * 100)
     : 0;
+  comparisonProgress.textContent =
+    `${percentComplete}% placed • Comparison ${session.asked + 1} • at most ${session.remaining} to go`;
   
-  const statusText = comparisonsSkipped > 0
-    ? `${percentComplete}% complete • Comparison ${comparisonsAsked + 1} (${comparisonsSkipped} inferred)`
-    : `${percentComplete}% complete • Comparison ${comparisonsAsked + 1}`;
-  comparisonProgress.textContent = statusText;
-  
-  const leftImg = compareLeft.querySelector("img");
-  const leftVideo = compareLeft.querySelector("video");
-  const leftName = compareLeft.querySelector(".comparison-card__name");
-  
-  if (left.type === "video") {
-    leftImg.hidden = true;
-    leftVideo.hidden = false;
-    leftVideo.src = left.url;
-    leftVideo.load();
-  } else {
-    leftVideo.hidden = true;
-    leftImg.hidden = false;
-    
-    // Use preloaded image if available, otherwise show thumbnail first
-    const cacheKey = `compare:${left.url}`;
-    if (preloadedImages.has(cacheKey)) {
-      const preloaded = preloadedImages.get(cacheKey);
-      if (preloaded.status === 'loaded' && preloaded.img.complete) {
-        leftImg.src = left.url;
-      } else {
-        // Show thumbnail while waiting for preload
-        leftImg.src = left.thumbUrl || left.url;
-        if (preloaded.img) {
-          preloaded.img.onload = () => {
-            leftImg.src = left.url;
-          };
-        }
-      }
-    } else {
-      // Show thumbnail first for instant feedback
-      if (left.thumbUrl) {
-        leftImg.src = left.thumbUrl;
-        const fullImg = new Image();
-        fullImg.onload = () => {
-          leftImg.src = left.url;
-        };
-        fullImg.src = left.url;
-      } else {
-        leftImg.src = left.url;
-      }
-    }
-    leftImg.alt = left.name;
+  showComparisonCard(compareLeft, session.left);
+  showComparisonCard(compareRight, session.right);
+}
+
+async function castVote(side) {
+  const comparison = state.comparison;
+  comparison.busy = true;
+  try {
+    const res = await fetch(`/api/projects/${encodeURIComponent(state.currentProject)}/votes`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({
+        left: comparison.pair.left.name,
+        right: comparison.pair.right.name,
+        winner: side === "skip" ? "tie" : side,
+        voter: voterId(),
+      }),
+    });
+    if (!res.ok) throw new Error("Failed to record vote");
+    comparison.cast++;
+  } catch (error) {
+    alert(error.message);
+  } finally {
+    comparison.busy = false;
   }
-  leftName.textContent = left.name;
-  
-  const rightImg = compareRight.querySelector("img");
-  const rightVideo = compareRight.querySelector("video");
-  const rightName = compareRight.querySelector(".comparison-card__name");
-  
-  if (right.type === "video") {
-    rightImg.hidden = true;
-    rightVideo.hidden = false;
-    rightVideo.src = right.url;
-    rightVideo.load();
-  } else {
-    rightVideo.hidden = true;
-    rightImg.hidden = false;
-    
-    // Use preloaded image if available, otherwise show thumbnail first
-    const cacheKey = `compare:${right.url}`;
-    if (preloadedImages.has(cacheKey)) {
-      const preloaded = preloadedImages.get(cacheKey);
-      if (preloaded.status === 'loaded' && preloaded.img.complete) {
-        rightImg.src = right.url;
-      } else {
-        // Show thumbnail while waiting for preload
-        rightImg.src = right.thumbUrl || right.url;
-        if (preloaded.img) {
-          preloaded.img.onload = () => {
-            rightImg.src = right.url;
-          };
-        }
-      }
-    } else {
-      // Show thumbnail first for instant feedback
-      if (right.thumbUrl) {
-        rightImg.src = right.thumbUrl;
-        const fullImg = new Image();
-        fullImg.onload = () => {
-          rightImg.src = right.url;
-        };
-        fullImg.src = right.url;
-      } else {
-        rightImg.src = right.url;
-      }
-    }
-    rightImg.alt = right.name;
+  if (state.comparison === comparison) {
+    await loadNextVote();
   }
-  rightName.textContent = right.name;
 }
 
-function selectWinner(side) {
-  if (!state.comparison) return;
-  
-  const nextPair = findNextUnknownPair();
-  if (!nextPair) {
+async function selectWinner(side) {
+  if (!state.comparison || state.comparison.busy) return;
+  const comparison = state.comparison;
+  if (comparison.voting) {
+    if (comparison.pair) await castVote(side);
+    return;
+  }
+  if (comparison.session.done) {
     showComparisonResults();
     return;
   }
   
-  const [left, right] = nextPair;
-  
-  if (side === "left") {
-    recordWin(left.name, right.name);
-  } else if (side === "right") {
-    recordWin(right.name, left.name);
+  comparison.busy = true;
+  try {
+    const res = await fetch(comparisonUrl("/answer"), {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({
+        step: comparison.session.step,
+        winner: side === "skip" ? "tie" : side,
+        voter: voterId(),
+      }),
+    });
+    // 409: the question was answered elsewhere, so catch up with the session
+    comparison.session = await readComparison(res.status === 409 ? await fetch(comparisonUrl("/next")) : res);
+  } catch (error) {
+    alert(error.message);
+  } finally {
+    comparison.busy = false;
+  }
+  if (state.comparison === comparison) {
+    showCurrentPair();
   }
-  
-  state.comparison.comparisonsAsked++;
-  state.comparison.currentPairIndex++;
-  
-  // Preload upcoming pairs before showing next
-  preloadComparisonPairs();
-  showCurrentPair();
 }
 
 function showComparisonResults() {
   if (!state.comparison) return;
   
-  const { scores, comparisonsAsked, comparisonsSkipped, allPairs } = state.comparison;
-  
-  const ranked = Object.entries(scores)
-    .map(([name, score]) => ({ name, score }))
-    .sort((a, b) => b.score - a.score);
+  const { session } = state.comparison;
   
   resultsList.innerHTML = "";
   
   const summaryDiv = document.createElement("div");
   summaryDiv.className = "comparison-results__summary";
-  const totalPossible = allPairs.length;
-  const efficiency = totalPossible > 0 
-    ? Math.round((1 - comparisonsAsked / totalPossible) * 100) 
+  const allPairs = (session.total * (session.total - 1)) / 2;
+  const efficiency = allPairs > 0
+    ? Math.round((1 - session.asked / allPairs) * 100)
     : 0;
   summaryDiv.innerHTML = `
     <p style="text-align: center; margin-bottom: 1rem; color: var(--text-secondary);">
-      ${comparisonsAsked} comparisons made, ${comparisonsSkipped} inferred automatically
-      ${efficiency > 0 ? `<br><small>(${efficiency}% fewer comparisons needed)</small>` : ""}
+      ${session.asked} comparisons made${session.ties > 0 ? `, ${session.ties} ties` : ""}
+      ${efficiency > 0 ? `<br><small>(${efficiency}% fewer than comparing every pair)</small>` : ""}
     </p>
   `;
   resultsList.appendChild(summaryDiv);
   
-  ranked.forEach((item, index) => {
-    const media = state.images.find((m) => m.name === item.name);
+  session.order.forEach((name, index) => {
+    const media = state.images.find((m) => m.name === name);
     const div = document.createElement("div");
     div.className = "comparison-results__item";
     
-    const thumb = media.type === "video" 
-      ? `<video class="comparison-results__thumb" src="${media.url}" muted></video>`
-      : `<img class="comparison-results__thumb" src="${media.thumbUrl || media.url}" alt="" />`;
+    let thumb = "";
+    if (media) {
+      thumb = media.type === "video"
+        ? `<video class="comparison-results__thumb" src="${media.url}" muted></video>`
+        : `<img class="comparison-results__thumb" src="${media.thumbUrl || media.url}" alt="" />`;
+    }
     
     div.innerHTML = `
       <span class="comparison-results__rank">#${index + 1}</span>
       ${thumb}
-      <span class="comparison-results__name">${escapeHtml(item.name)}</span>
-      <span class="comparison-results__score">${item.score} wins</span>
+      <span class="comparison-results__name">${escapeHtml(name)}</span>
     `;
     
     resultsList.appendChild(div);
   });
   
-  state.comparison.rankedOrder = ranked.map((r) => r.name);
-  
   comparisonMode.hidden = true;
   comparisonResults.hidden = false;
 }
 
 async function applyRanking() {
-  if (!state.comparison || !state.comparison.rankedOrder) return;
-  
-  const rankedOrder = state.comparison.rankedOrder;
-  
-  const reordered = rankedOrder.map((name) => state.images.find((m) => m.name === name)).filter(Boolean);
-  reordered.forEach((m, idx) => {
-    m.isRanked = true;
-    m.rank = idx + 1;
-  });
-  state.images = reordered;
-  
-  await saveOrder();
-  
+  if (!state.comparison) return;
+  try {
+    // Resolves to null if the ranking changed elsewhere; the session is kept
+    await sendRankingEdit(comparisonUrl("/finish"), { method: "POST" });
+  } catch (error) {
+    alert(error.message);
+    return;
+  }
   closeComparisonResults();
-  renderImages();
+  await loadProjectState();
 }
 
 function closeComparisonResults() {
@@ -2901,85 +3567,16 @@ function closeComparisonResults() {
   state.comparison = null;
 }
 
-function discardRanking() {
+async function discardRanking() {
+  if (state.comparison) {
+    await fetch(comparisonUrl(), { method: "DELETE" });
+  }
   closeComparisonResults();
 }
 
-async function savePartialRanking() {
-  if (!state.comparison) return;
-  
-  const { scores, itemsToCompare, comparisonScope, comparisonsAsked } = state.comparison;
-  
-  // Don't save if no comparisons have been made
-  if (comparisonsAsked === 0) {
-    if (!confirm("No comparisons have been made yet. Exit without saving?")) {
-      return;
-    }
-    exitComparisonMode();
-    return;
-  }
-  
-  // Rank items by their current scores
-  const ranked = Object.entries(scores)
-    .map(([name, score]) => ({ name, score }))
-    .sort((a, b) => b.score - a.score);
-  
-  let finalOrder;
-  
-  if (comparisonScope === "unranked") {
-    // Merge with existing ranked items
-    const existingRanked = state.images.filter((img) => img.isRanked);
-    existingRanked.sort((a, b) => a.rank - b.rank);
-    
-    // Get newly ranked items (those that were unranked before)
-    const newlyRanked = ranked
-      .map((r) => {
-        const media = state.images.find((m) => m.name === r.name);
-        return media && !media.isRanked ? { media, score: r.score } : null;
-      })
-      .filter(Boolean);
-    
-    // Insert newly ranked items into existing ranking based on their scores
-    // For now, append them at the end - they can be refined by continuing later
-    finalOrder = [
-      ...existingRanked.map((m) => m.name),
-      ...newlyRanked.map((r) => r.media.name),
-    ];
-  } else {
-    // Replace all rankings with current scores
-    finalOrder = ranked.map((r) => r.name);
-  }
-  
-  // Update state.images with new rankings
-  const reordered = finalOrder
-    .map((name) => state.images.find((m) => m.name === name))
-    .filter(Boolean);
-  
-  // Preserve items not in the comparison (shouldn't happen in "all" mode, but safe to handle)
-  const notInComparison = state.images.filter(
-    (img) => !itemsToCompare.some((item) => item.name === img.name)
-  );
-  
-  // Combine: ranked items first, then unranked items not in comparison
-  const allItems = [
-    ...reordered.map((m, idx) => {
-      m.isRanked = true;
-      m.rank = idx + 1;
-      return m;
-    }),
-    ...notInComparison,
-  ];
-  
-  state.images = allItems;
-  
-  // Save to server
-  await saveOrder();
-  
-  // Exit comparison mode
-  exitComparisonMode();
-  
-  // Reload project state to reflect changes
-  await loadProjectState();
+// The session is already saved on the server after every answer
+function continueComparisonLater() {
+  closeComparisonMode();
 }
 
 compareLeft.addEventListener("click", () => selectWinner("left"));
@@ -2989,7 +3586,7 @@ exitComparisonBtn.addEventListener("click", exitComparisonMode);
 applyRankingBtn.addEventListener("click", applyRanking);
 discardRankingBtn.addEventListener("click", discardRanking);
 resultsBackdrop.addEventListener("click", discardRanking);
-continueLaterBtn.addEventListener("click", savePartialRanking);
+continueLaterBtn.addEventListener("click", continueComparisonLater);
 
 // ============ Global Keyboard Handler ============
 document.addEventListener("keydown", (event) => {
@@ -3071,6 +3668,8 @@ refreshProjectsBtn.addEventListener("click", fetchProjects);
 startCompareBtn.addEventListener("click", openComparisonSelection);
 compareAllBtn.addEventListener("click", () => startComparisonMode("all"));
 compareUnrankedBtn.addEventListener("click", () => startComparisonMode("unranked"));
+compareResumeBtn.addEventListener("click", resumeComparisonMode);
+compareVoteBtn.addEventListener("click", startVotingMode);
 cancelComparisonSelectionBtn.addEventListener("click", closeComparisonSelection);
 comparisonSelectionBackdrop.addEventListener("click", closeComparisonSelection);
 
@@ -3259,6 +3858,7 @@ disableWorkspace();
 updateActionStates();
 updateSortUI();
 updateMobileProjectName();
+connectChangeFeed();
 fetchProjects(initialProject);
 
 // Handle browser back/forward navigation